@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# Compares how long creating the EC2 client takes, and how much
+# memory it uses, with the stock botocore model and with sebs' trimmed model.
+# Every run is a fresh interpreter so nothing is cached in memory.
+#
+#   ./scripts/benchmark-model.py [--runs 5]
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+MEASURE = """
+import sys, time, json, resource
+started = time.perf_counter()
+import boto3
+imported = time.perf_counter()
+if sys.argv[1] == 'stock':
+    session = boto3.session.Session(region_name='us-east-1')
+else:
+    from sebs.model import make_session
+    session = make_session('us-east-1', cache_dir=sys.argv[2])
+created = time.perf_counter()
+session.client('ec2')
+ended = time.perf_counter()
+print(json.dumps({'import': imported - started, 'client': ended - created,
+                  'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+"""
+
+
+def measure(mode, cache_dir):
+    output = subprocess.check_output([sys.executable, '-c', MEASURE, mode, cache_dir],
+                                     cwd=os.path.join(os.path.dirname(__file__), '..'))
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark EC2 client creation.')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        results = {
+            'stock': [measure('stock', cache_dir) for _ in range(args.runs)],
+            # The first trimmed run builds the cache
+            'trimmed (cold)': [measure('trimmed', cache_dir)],
+            'trimmed (warm)': [measure('trimmed', cache_dir) for _ in range(args.runs)],
+        }
+
+    print(f"{'model':<16} {'client ms':>20} {'max RSS MiB':>12}")
+
+    for mode, runs in results.items():
+        client = statistics.median(run['client'] for run in runs) * 1000
+        rss = statistics.median(run['rss'] for run in runs)
+        print(f'{mode:<16} {client:>20.1f} {rss:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+import sys
+import time
+import random
+import logging
+import threading
+from collections import Counter
+from sebs.lazy import LazyImport
+from sebs.cleanup import error_code
+
+botocore_exceptions = LazyImport('botocore.exceptions')
+
+log = logging.getLogger('sebs')
+
+# Requests per second and burst allowed for each category of call. EC2
+# throttles per account, so these stay well below its own buckets to leave
+# room for every other sebs and tool in the account.
+LIMITS = {
+    'describe': (20, 50),
+    'mutate': (5, 20),
+    'resource': (2, 10),
+}
+
+# Calls that create or move volumes and snapshots have the smallest buckets
+RESOURCE_CALLS = ['create_volume', 'attach_volume', 'detach_volume',
+                  'create_snapshot', 'create_snapshots']
+
+THROTTLE_CODES = ['RequestLimitExceeded', 'Throttling', 'ThrottlingException',
+                  'TooManyRequestsException', 'SnapshotCreationPerVolumeRateExceeded']
+
+# Errors worth another try that are not about our request rate
+TRANSIENT_CODES = ['InternalError', 'InternalFailure', 'ServiceUnavailable', 'Unavailable']
+
+# Client methods that don't call the API
+LOCAL_METHODS = ['get_paginator', 'get_waiter', 'can_paginate', 'close']
+
+
+def connection_errors():
+    # Dropped connections from the lean client are builtin ConnectionErrors,
+    # botocore's can only be raised once it has been loaded
+    errors = (ConnectionError,)
+
+    if 'botocore.exceptions' in sys.modules:
+        errors += (botocore_exceptions.ConnectionError, botocore_exceptions.ReadTimeoutError)
+
+    return errors
+
+
+def category(operation):
+    if operation.startswith(('describe_', 'get_', 'list_')):
+        return 'describe'
+
+    if operation in RESOURCE_CALLS:
+        return 'resource'
+
+    return 'mutate'
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        with self.lock:
+            self.refill()
+            # Callers take a token up front and sleep off the debt so they are
+            # served in the order they asked.
+            self.tokens -= 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if delay:
+            self.sleep(delay)
+
+        return delay
+
+    def throttled(self):
+        # Halve the rate and give up the burst until calls succeed again
+        with self.lock:
+            self.refill()
+            self.rate = max(self.rate / 2, self.max_rate / 20)
+            self.tokens = min(self.tokens, 0)
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.rate + self.max_rate / 10, self.max_rate)
+
+
+class ApiClient:
+    def __init__(self, client, limits=None, attempts=8, base=0.5, cap=20,
+                 clock=time.monotonic, sleep=time.sleep, rand=random.random):
+        # Every call to the wrapped boto3 client waits on the bucket of its
+        # category and is retried here, so the client's own retries should be
+        # turned off.
+        self.client = client
+        self.buckets = {name: TokenBucket(rate, burst, clock=clock, sleep=sleep)
+                        for name, (rate, burst) in (limits or LIMITS).items()}
+        self.attempts = attempts
+        self.base = base
+        self.cap = cap
+        self.sleep = sleep
+        self.rand = rand
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.retries = Counter()
+        self.throttles = Counter()
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+
+        if name.startswith('_') or name in LOCAL_METHODS or not callable(attr):
+            return attr
+
+        return lambda **kwargs: self.call(name, **kwargs)
+
+    def get_paginator(self, operation):
+        return ApiPaginator(self, operation)
+
+    def call(self, operation, **kwargs):
+        bucket = self.buckets[category(operation)]
+
+        for attempt in range(1, self.attempts + 1):
+            bucket.take()
+            self.count(self.calls, operation)
+
+            try:
+                response = getattr(self.client, operation)(**kwargs)
+            except connection_errors() as e:
+                error = e
+            except Exception as e:
+                if error_code(e) in THROTTLE_CODES:
+                    bucket.throttled()
+                    self.count(self.throttles, operation)
+                elif error_code(e) not in TRANSIENT_CODES:
+                    raise
+
+                error = e
+            else:
+                bucket.succeeded()
+                return response
+
+            if attempt == self.attempts:
+                raise error
+
+            # Full jitter keeps many instances from retrying in lockstep
+            delay = self.rand() * min(self.cap, self.base * 2 ** attempt)
+            log.warning(
+                f'{operation} failed with {type(error).__name__}: {error}, retrying in {delay:.1f}s')
+
+            self.count(self.retries, operation)
+            self.sleep(delay)
+
+    def count(self, counter, operation):
+        with self.lock:
+            counter[operation] += 1
+
+    def stats(self):
+        return {
+            'calls': sum(self.calls.values()),
+            'retries': sum(self.retries.values()),
+            'throttles': sum(self.throttles.values()),
+        }
+
+    def summary(self):
+        stats = self.stats()
+
+        return f"{stats['calls']} calls, {stats['retries']} retries, {stats['throttles']} throttles"
+
+
+class ApiPaginator:
+    # Pages through an operation one rate limited call at a time
+    def __init__(self, api, operation):
+        self.api = api
+        self.operation = operation
+
+    def paginate(self, **kwargs):
+        while True:
+            page = self.api.call(self.operation, **kwargs)
+            yield page
+
+            if not page.get('NextToken'):
+                return
+
+            kwargs['NextToken'] = page['NextToken']
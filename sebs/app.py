@@ -7,30 +7,226 @@ __authors__ = ["Levi Blaney", "Neha Singh"]
 __license__ = "GPLv3"
 
 import sys
+import signal
 import logging
 from sebs.ec2 import Instance
+from sebs.daemon import SnapshotDaemon
+from sebs.lifecycle import LifecycleAction
+from sebs.poller import Poller, Deadline
+from sebs.timing import Timer, write_reports
+from sebs.journal import RestoreJournal
+from sebs.metadata import InstanceMetadata, MetadataClient
+from sebs.lazy import LazyImport
+
+make_session = LazyImport('sebs.model', 'make_session')
+FleetController = LazyImport('sebs.fleet', 'FleetController')
+load_groups = LazyImport('sebs.fleet', 'load_groups')
 
 log = logging.getLogger('sebs')
 
 
 def main(args):
 
+    if args.command == 'daemon':
+        return daemon(args)
+
+    if args.command == 'on-terminate':
+        return on_terminate(args)
+
+    if args.command == 'fleet':
+        return fleet(args)
+
+    # Started first so the report covers the whole run
+    timer = Timer()
+    ready = False
+
+    try:
+        ready = restore(args, timer)
+    finally:
+        write_reports(timer.report('Ready' if ready else 'Failed'),
+                      json_path=args.report, prometheus_path=args.prometheus,
+                      emf_path=args.emf)
+
+    if not ready:
+        sys.exit(1)
+
+    log.info('Finished')
+    sys.exit()
+
+
+def instance_metadata(args):
+    return InstanceMetadata(MetadataClient(timeout=args.metadata_timeout),
+                            cache_path=args.metadata_cache)
+
+
+def restore(args, timer):
+
     log.info(f'Starting...')
+    # The run deadline starts counting now so it covers every wait
+    poller = Poller(timeout=args.wait_timeout,
+                    deadline=Deadline(args.deadline))
+
+    hydrate = None
+
+    if args.hydrate:
+        hydrate = {'workers': args.hydrate_workers, 'rate': args.hydrate_rate}
+
     # Get a handler for the current EC2 instance
-    server = Instance(args.name)
+    # Every worker needs its own connection so never size the pool below --parallel
+    server = Instance(args.name,
+                      max_pool_connections=max(
+                          args.max_connections, args.parallel),
+                      tcp_keepalive=args.keepalive,
+                      poller=poller,
+                      fast_restore=args.fast_restore,
+                      init_rate=args.init_rate,
+                      hydrate=hydrate,
+                      reuse_snapshot=args.reuse_snapshot,
+                      timer=timer,
+                      journal=RestoreJournal(args.journal),
+                      transport=args.transport,
+                      metadata=instance_metadata(args))
+
+    timer.tags['instance_id'] = server.instance.id
 
     # Add the requested Stateful Devices to the server
     for device in args.backup:
-        server.add_stateful_device(device)
+        server.add_stateful_device(device, args.overrides.get(device))
 
     # Make sure the Stateful Volumes are attached to this server
-    server.attach_stateful_volumes()
+    with timer.span('restore'):
+        failed = server.attach_stateful_volumes(args.parallel)
 
     # Tag the Stateful Volumes so they can be found on next boot
     server.tag_stateful_volumes()
 
+    # Now that the devices are usable remove the old volumes and snapshots
+    cleanup_failed = server.cleanup_resources()
+
+    # Hydrating is slow so nothing above waits on it
+    server.hydrate_stateful_volumes()
+
     for sv in server.backup:
         log.info(f"{sv.device_name} is {'Ready' if sv.ready else 'not Ready'}")
 
+    log.info(f'EC2 API usage: {server.ec2_client.summary()}')
+
+    if failed:
+        log.error(
+            f"Failed to restore: {', '.join(sv.device_name for sv in failed)}")
+        return False
+
+    if cleanup_failed:
+        log.error(f"Failed to clean up: {', '.join(cleanup_failed)}")
+        return False
+
+    return True
+
+
+def daemon(args):
+
+    log.info(f'Starting snapshot daemon...')
+
+    server = Instance(args.name,
+                      max_pool_connections=args.max_connections,
+                      tcp_keepalive=args.keepalive,
+                      poller=Poller(timeout=args.wait_timeout),
+                      metadata=instance_metadata(args))
+
+    for device in args.backup:
+        server.add_stateful_device(device)
+
+    standby_azs = list(args.standby_az)
+
+    if args.standby_asg:
+        standby_azs.extend(az for az in server.asg_availability_zones()
+                           if az not in standby_azs)
+
+    standby = SnapshotDaemon(server, interval=args.interval, retain=args.retain,
+                             standby_azs=standby_azs)
+
+    # Finish the current round cleanly when the service is stopped
+    signal.signal(signal.SIGTERM, lambda signum, frame: standby.stop())
+
+    standby.run()
+
+    log.info('Finished')
+    sys.exit()
+
+
+def on_terminate(args):
+
+    log.info(f'Starting termination snapshots...')
+
+    server = Instance(args.name,
+                      max_pool_connections=args.max_connections,
+                      tcp_keepalive=args.keepalive,
+                      poller=Poller(timeout=args.wait_timeout),
+                      metadata=instance_metadata(args))
+
+    for device in args.backup:
+        server.add_stateful_device(device)
+
+    group_name = args.asg or server.asg_name()
+
+    if not group_name:
+        log.error('Could not find the autoscaling group, pass it with --asg')
+        sys.exit(1)
+
+    action = LifecycleAction(server.autoscaling_client(), args.hook, group_name,
+                             server.instance.id, interval=args.heartbeat)
+
+    # Keep the instance around until every snapshot is safe
+    action.start()
+
+    try:
+        failed = server.snapshot_stateful_volumes()
+    finally:
+        action.stop()
+        # Never hold up the termination, the next boot can still snapshot
+        action.complete()
+
+    if failed:
+        log.error(
+            f"Failed to snapshot: {', '.join(sv.device_name for sv in failed)}")
+        sys.exit(1)
+
+    log.info('Finished')
+    sys.exit()
+
+
+def fleet(args):
+
+    log.info(f'Starting fleet controller...')
+
+    try:
+        groups = load_groups(args.config)
+    except (OSError, ValueError) as error:
+        log.error(f'Could not load {args.config}: {error}')
+        sys.exit(1)
+
+    controller = FleetController(make_session(region_name=args.region), groups,
+                                 concurrency=args.concurrency,
+                                 max_pool_connections=max(
+                                     args.max_connections, args.concurrency),
+                                 tcp_keepalive=args.keepalive,
+                                 poller=Poller(timeout=args.wait_timeout),
+                                 fast_restore=args.fast_restore,
+                                 init_rate=args.init_rate,
+                                 reuse_snapshot=args.reuse_snapshot)
+
+    results, cleanup_failed = controller.run(args.interval)
+
+    failed = [f"{result['asg']} {device}" for result in results
+              for device, status in result['devices'].items() if status == 'Failed']
+
+    if failed:
+        log.error(f"Failed to restore: {', '.join(failed)}")
+        sys.exit(1)
+
+    if cleanup_failed:
+        log.error(f"Failed to clean up: {', '.join(cleanup_failed)}")
+        sys.exit(1)
+
     log.info('Finished')
     sys.exit()
@@ -0,0 +1,61 @@
+import time
+import logging
+import threading
+
+log = logging.getLogger('sebs')
+
+# Errors that mean there is nothing left to clean up
+GONE = ['InvalidVolume.NotFound', 'InvalidSnapshot.NotFound']
+
+
+def error_code(error):
+    return getattr(error, 'response', {}).get('Error', {}).get('Code')
+
+
+class CleanupQueue:
+    def __init__(self, attempts=3, delay=2, sleep=time.sleep):
+        # Each task gets this many tries, waiting longer after each failure
+        self.attempts = attempts
+        self.delay = delay
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.tasks = []
+
+    def add(self, description, func, **kwargs):
+        log.debug(f'Queued cleanup: {description}')
+
+        with self.lock:
+            self.tasks.append((description, func, kwargs))
+
+    def run(self):
+        with self.lock:
+            tasks, self.tasks = self.tasks, []
+
+        log.info(f'Cleaning up {len(tasks)} temporary resources')
+        failed = []
+
+        for description, func, kwargs in tasks:
+            if not self.run_task(description, func, kwargs):
+                failed.append(description)
+
+        return failed
+
+    def run_task(self, description, func, kwargs):
+        for attempt in range(1, self.attempts + 1):
+            try:
+                func(**kwargs)
+                log.info(f'Finished cleanup: {description}')
+                return True
+            except Exception as e:
+                if error_code(e) in GONE:
+                    log.info(f'Nothing to clean up: {description}')
+                    return True
+
+                log.warning(
+                    f'Cleanup attempt {attempt} of {self.attempts} failed for {description}: {e}')
+
+            if attempt < self.attempts:
+                self.sleep(self.delay * 2 ** (attempt - 1))
+
+        log.error(f'Gave up on cleanup: {description}')
+        return False
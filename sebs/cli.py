@@ -1,16 +1,57 @@
 import sys
 import argparse
-try:
-    from importlib import metadata
-except ImportError:
-    # Running on pre-3.8 Python; use importlib-metadata package
-    import importlib_metadata as metadata
+from sebs.journal import JOURNAL_PATH
+from sebs.metadata import METADATA_TIMEOUT
 
 
-def parse_args(args):
+def parse_bool(value):
+    if value.lower() not in ['true', 'false']:
+        raise ValueError(f'{value} is not true or false')
 
-    parser = argparse.ArgumentParser()
+    return value.lower() == 'true'
+
+
+# Settings that can be changed when a volume is copied to another AZ
+OVERRIDES = {
+    'type': ('VolumeType', str),
+    'size': ('Size', int),
+    'iops': ('Iops', int),
+    'throughput': ('Throughput', int),
+    'encrypted': ('Encrypted', parse_bool),
+    'kms-key': ('KmsKeyId', str),
+    'multi-attach': ('MultiAttachEnabled', parse_bool),
+}
+
+
+def parse_override(value):
+    # Turns /dev/xvdf:type=gp3,iops=16000 into a device and its settings
+    device, _, options = value.partition(':')
+
+    if not device or not options:
+        raise argparse.ArgumentTypeError(
+            f"'{value}' should look like DEVICE:KEY=VALUE[,KEY=VALUE]")
+
+    settings = {}
 
+    for option in options.split(','):
+        key, _, setting = option.partition('=')
+
+        if key not in OVERRIDES or not setting:
+            raise argparse.ArgumentTypeError(
+                f"'{option}' is not one of {', '.join(OVERRIDES)} with a value")
+
+        name, convert = OVERRIDES[key]
+
+        try:
+            settings[name] = convert(setting)
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                f"'{setting}' is not a valid value for {key}")
+
+    return device, settings
+
+
+def add_common_arguments(parser):
     parser.add_argument('-b', '--backup', action='append',
                         help='<Required> List of Devices to Backup', required=True)
 
@@ -18,6 +59,44 @@ def parse_args(args):
     parser.add_argument("-n", "--name", default='sebs',
                         help='<Optional> specify a your app name.')
 
+
+def add_connection_arguments(parser):
+    parser.add_argument('--max-connections', type=int, default=10,
+                        help='<Optional> Size of the shared EC2 connection pool.')
+
+    parser.add_argument('--no-keepalive', dest='keepalive', action='store_false',
+                        help='<Optional> Disable TCP keep-alive on EC2 connections.')
+
+    parser.add_argument('--wait-timeout', type=int, default=1800,
+                        help='<Optional> Seconds to wait on any single snapshot or volume.')
+
+
+def add_metadata_arguments(parser):
+    parser.add_argument('--metadata-timeout', type=float, default=METADATA_TIMEOUT, metavar='SECONDS',
+                        help=f'<Optional> Seconds to wait on the instance metadata service. Default: {METADATA_TIMEOUT}')
+
+    parser.add_argument('--metadata-cache', default=None, metavar='FILE',
+                        help='<Optional> Keep the instance identity in FILE for later runs on the same boot (eg. /run/sebs/identity.json).')
+
+
+class VersionAction(argparse.Action):
+    # Reading the package metadata is slow so it is only done for --version
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS, help=None):
+        super().__init__(option_strings=option_strings, dest=dest, default=default,
+                         nargs=0, help="show program's version number and exit")
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        try:
+            from importlib import metadata
+        except ImportError:
+            # Running on pre-3.8 Python; use importlib-metadata package
+            import importlib_metadata as metadata
+
+        sys.stdout.write(f"{parser.prog} (version {metadata.version('sebs')})\n")
+        parser.exit()
+
+
+def add_output_arguments(parser):
     # Optional verbosity counter (eg. -v, -vv, -vvv, etc.)
     parser.add_argument(
         "-v",
@@ -29,8 +108,208 @@ def parse_args(args):
     # Specify output of "--version"
     parser.add_argument(
         "--version",
-        action="version",
-        version="%(prog)s (version {version})".format(version=metadata.version('sebs')))
+        action=VersionAction)
+
+
+def app_name(name):
+    return name if 'sebs' in name else f'{name}-sebs'
+
+
+def parse_daemon_args(args):
+
+    parser = argparse.ArgumentParser(prog='sebs daemon',
+                                     description='Keep taking standby snapshots of the stateful volumes.')
+
+    add_common_arguments(parser)
+
+    parser.add_argument('--interval', type=int, default=3600,
+                        help='<Optional> Seconds between snapshots of each volume.')
+
+    parser.add_argument('--retain', type=int, default=3,
+                        help='<Optional> Number of completed snapshots to keep per volume.')
+
+    parser.add_argument('--standby-az', action='append', default=[],
+                        help='<Optional> Keep a volume made from the newest snapshot ready in this AZ.')
+
+    parser.add_argument('--standby-asg', action='store_true',
+                        help='<Optional> Keep standby volumes in every AZ of this instance\'s autoscaling group.')
+
+    add_connection_arguments(parser)
+    add_metadata_arguments(parser)
+    add_output_arguments(parser)
+
+    parsed_args = parser.parse_args(args)
+
+    if parsed_args.interval < 1:
+        parser.error('--interval must be at least 1')
+
+    if parsed_args.retain < 1:
+        parser.error('--retain must be at least 1')
+
+    if parsed_args.max_connections < 1:
+        parser.error('--max-connections must be at least 1')
+
+    if parsed_args.metadata_timeout <= 0:
+        parser.error('--metadata-timeout must be more than 0')
+
+    parsed_args.command = 'daemon'
+    parsed_args.name = app_name(parsed_args.name)
+
+    return parsed_args
+
+
+def parse_terminate_args(args):
+
+    parser = argparse.ArgumentParser(prog='sebs on-terminate',
+                                     description='Detach and snapshot the stateful volumes while the instance terminates.')
+
+    add_common_arguments(parser)
+
+    parser.add_argument('--hook', required=True,
+                        help='<Required> Name of the termination lifecycle hook.')
+
+    parser.add_argument('--asg', default=None,
+                        help='<Optional> Autoscaling group name, found from the instance tags by default.')
+
+    parser.add_argument('--heartbeat', type=int, default=60,
+                        help='<Optional> Seconds between lifecycle heartbeats.')
+
+    add_connection_arguments(parser)
+    add_metadata_arguments(parser)
+    add_output_arguments(parser)
+
+    parsed_args = parser.parse_args(args)
+
+    if parsed_args.heartbeat < 1:
+        parser.error('--heartbeat must be at least 1')
+
+    if parsed_args.max_connections < 1:
+        parser.error('--max-connections must be at least 1')
+
+    if parsed_args.metadata_timeout <= 0:
+        parser.error('--metadata-timeout must be more than 0')
+
+    parsed_args.command = 'on-terminate'
+    parsed_args.name = app_name(parsed_args.name)
+
+    return parsed_args
+
+
+def parse_fleet_args(args):
+
+    parser = argparse.ArgumentParser(prog='sebs fleet',
+                                     description='Restore the stateful volumes of many single instance autoscaling groups.')
+
+    parser.add_argument('-c', '--config', required=True,
+                        help='<Required> JSON file listing the asg, name and backup devices of each group.')
+
+    parser.add_argument('--concurrency', type=int, default=20,
+                        help='<Optional> Number of instances to restore at the same time.')
+
+    parser.add_argument('--interval', type=int, default=None,
+                        help='<Optional> Keep reconciling the groups every this many seconds.')
+
+    parser.add_argument('--region', default=None,
+                        help='<Optional> Region of the groups, taken from the environment by default.')
+
+    restore = parser.add_mutually_exclusive_group()
+
+    restore.add_argument('--fast-restore', action='store_true',
+                         help='<Optional> Use Fast Snapshot Restore for volumes copied to another AZ.')
+
+    restore.add_argument('--init-rate', type=int, default=None,
+                         help='<Optional> Initialize volumes copied to another AZ at this many MiB/s.')
+
+    parser.add_argument('--reuse-snapshot', type=int, default=None, metavar='MAX_AGE',
+                        help='<Optional> Restore from a standby volume or snapshot up to MAX_AGE seconds old when the old volume is detached.')
+
+    add_connection_arguments(parser)
+    add_output_arguments(parser)
+
+    parsed_args = parser.parse_args(args)
+
+    if parsed_args.concurrency < 1:
+        parser.error('--concurrency must be at least 1')
+
+    if parsed_args.interval is not None and parsed_args.interval < 1:
+        parser.error('--interval must be at least 1')
+
+    if parsed_args.max_connections < 1:
+        parser.error('--max-connections must be at least 1')
+
+    parsed_args.command = 'fleet'
+
+    return parsed_args
+
+
+def parse_args(args):
+
+    if args and args[0] == 'fleet':
+        return parse_fleet_args(args[1:])
+
+    if args and args[0] == 'daemon':
+        return parse_daemon_args(args[1:])
+
+    if args and args[0] == 'on-terminate':
+        return parse_terminate_args(args[1:])
+
+    parser = argparse.ArgumentParser()
+
+    add_common_arguments(parser)
+
+    parser.add_argument('-o', '--override', action='append', default=[], type=parse_override,
+                        help='<Optional> Change a device when it is copied to another AZ (eg. /dev/xvdf:type=gp3,iops=16000).')
+
+    parser.add_argument('-p', '--parallel', type=int, default=1,
+                        help='<Optional> Number of devices to restore at the same time.')
+
+    restore = parser.add_mutually_exclusive_group()
+
+    restore.add_argument('--fast-restore', action='store_true',
+                         help='<Optional> Use Fast Snapshot Restore for volumes copied to another AZ.')
+
+    restore.add_argument('--init-rate', type=int, default=None,
+                         help='<Optional> Initialize volumes copied to another AZ at this many MiB/s.')
+
+    parser.add_argument('--reuse-snapshot', type=int, default=None, metavar='MAX_AGE',
+                        help='<Optional> Restore from a standby volume or snapshot up to MAX_AGE seconds old when the old volume is detached.')
+
+    parser.add_argument('--hydrate', action='store_true',
+                        help='<Optional> Read every block of copied volumes once they are attached.')
+
+    journal = parser.add_mutually_exclusive_group()
+
+    journal.add_argument('--journal', default=JOURNAL_PATH, metavar='FILE',
+                         help=f'<Optional> Record restore progress in FILE so a rerun can resume it. Default: {JOURNAL_PATH}')
+
+    journal.add_argument('--no-journal', dest='journal', action='store_const', const=None,
+                         help='<Optional> Only resume restores from the tags on the volumes.')
+
+    parser.add_argument('--hydrate-workers', type=int, default=8,
+                        help='<Optional> Number of concurrent readers per volume when hydrating.')
+
+    parser.add_argument('--hydrate-rate', type=int, default=None,
+                        help='<Optional> Limit hydrating each volume to this many MiB/s.')
+
+    add_connection_arguments(parser)
+    add_metadata_arguments(parser)
+
+    parser.add_argument('--transport', choices=['boto3', 'lean'], default='boto3',
+                        help='<Optional> Call EC2 with boto3 or with the lean built-in client, which starts faster and uses less memory.')
+
+    parser.add_argument('--deadline', type=int, default=None,
+                        help='<Optional> Seconds the whole run may spend waiting on AWS.')
+
+    parser.add_argument('--report', default=None, metavar='FILE',
+                        help='<Optional> Write a JSON report of how long each phase took to FILE (- for stdout).')
+
+    parser.add_argument('--prometheus', default=None, metavar='FILE',
+                        help='<Optional> Write the phase timings to FILE for the Prometheus textfile collector.')
+
+    parser.add_argument('--emf', default=None, metavar='FILE',
+                        help='<Optional> Append the phase timings to FILE as CloudWatch embedded metrics (- for stdout).')
+
+    add_output_arguments(parser)
 
     if len(args) == 0:
         parser.print_help(sys.stderr)
@@ -38,6 +317,27 @@ def parse_args(args):
 
     parsed_args = parser.parse_args(args)
 
-    parsed_args.name = parsed_args.name if 'sebs' in parsed_args.name else f'{parsed_args.name}-sebs'
+    if parsed_args.parallel < 1:
+        parser.error('--parallel must be at least 1')
+
+    if parsed_args.hydrate_workers < 1:
+        parser.error('--hydrate-workers must be at least 1')
+
+    if parsed_args.max_connections < 1:
+        parser.error('--max-connections must be at least 1')
+
+    if parsed_args.metadata_timeout <= 0:
+        parser.error('--metadata-timeout must be more than 0')
+
+    parsed_args.overrides = {}
+
+    for device, settings in parsed_args.override:
+        if device not in parsed_args.backup:
+            parser.error(f'--override device {device} is not being backed up')
+
+        parsed_args.overrides.setdefault(device, {}).update(settings)
+
+    parsed_args.command = 'restore'
+    parsed_args.name = app_name(parsed_args.name)
 
     return parsed_args
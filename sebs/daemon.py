@@ -0,0 +1,103 @@
+import sys
+import time
+import logging
+import threading
+from sebs.ec2 import STANDBY_SNAPSHOT_TAG, STANDBY_TIME_TAG
+
+log = logging.getLogger('sebs')
+
+
+class SnapshotDaemon:
+    def __init__(self, server, interval=3600, retain=3, standby_azs=None,
+                 clock=time.monotonic):
+        # Keeps recent snapshots of every stateful volume so a restore in
+        # another AZ only has to snapshot what changed since the last one.
+        self.server = server
+        self.interval = interval
+        self.retain = retain
+        # AZs to keep a volume made from the newest snapshot ready in
+        self.standby_azs = standby_azs or []
+        self.clock = clock
+        self.stopped = threading.Event()
+
+    def stop(self):
+        log.info('Stopping the snapshot daemon')
+        self.stopped.set()
+
+    def run(self, rounds=None):
+        log.info(
+            f'Snapshotting every {self.interval}s and keeping {self.retain} snapshots per volume')
+
+        while not self.stopped.is_set() and rounds != 0:
+            started = self.clock()
+
+            self.snapshot_volumes()
+
+            if rounds is not None:
+                rounds -= 1
+
+            self.stopped.wait(max(self.interval - (self.clock() - started), 0))
+
+    def snapshot_volumes(self):
+        for sv in self.server.backup:
+            if sv.status != 'Attached':
+                continue
+
+            try:
+                self.snapshot_volume(sv)
+            except:
+                t, v, _tb = sys.exc_info()
+                log.error(
+                    f'Failed to snapshot {sv.device_name}: {t.__name__}: {v}')
+
+    def snapshot_volume(self, sv):
+        snapshots = sv.standby_snapshots()
+
+        # Let a slow snapshot finish instead of piling up another one
+        if any(snapshot['State'] == 'pending' for snapshot in snapshots):
+            log.info(f'Previous snapshot of {sv.device_name} is still pending')
+        else:
+            snapshot_id = sv.create_standby_snapshot()
+            log.info(f'Started snapshot {snapshot_id} of {sv.device_name}')
+
+        completed = [snapshot for snapshot in snapshots
+                     if snapshot['State'] == 'completed']
+
+        for snapshot in completed[:max(len(completed) - self.retain, 0)]:
+            log.info(
+                f"Deleting snapshot {snapshot['SnapshotId']} of {sv.device_name}")
+
+            self.server.ec2_client.delete_snapshot(
+                SnapshotId=snapshot['SnapshotId'])
+
+        if completed:
+            for az in self.standby_azs:
+                self.refresh_standby_volume(sv, az, completed[-1])
+
+    def refresh_standby_volume(self, sv, az, snapshot):
+        volumes = sv.standby_volumes(az)
+        ready = [volume for volume in volumes if volume['State'] == 'available']
+
+        if az == sv.volume.availability_zone:
+            # The device already lives here so nothing needs to be ready
+            stale = ready
+        else:
+            if not any(self.tags(volume).get(STANDBY_SNAPSHOT_TAG) == snapshot['SnapshotId']
+                       for volume in volumes):
+                volume_id = sv.create_standby_volume(az, snapshot)
+                log.info(
+                    f"Creating standby volume {volume_id} of {sv.device_name} in {az} from {snapshot['SnapshotId']}")
+
+            # Keep the newest ready volume until a newer one replaces it
+            ready.sort(key=lambda volume: int(
+                self.tags(volume).get(STANDBY_TIME_TAG, 0)))
+            stale = ready[:-1]
+
+        for volume in stale:
+            log.info(
+                f"Deleting standby volume {volume['VolumeId']} of {sv.device_name} in {az}")
+
+            self.server.ec2_client.delete_volume(VolumeId=volume['VolumeId'])
+
+    def tags(self, volume):
+        return {tag['Key']: tag['Value'] for tag in volume.get('Tags', [])}
@@ -1,213 +1,995 @@
+import os
 import sys
-import boto3
+import time
+import hashlib
+import datetime
 import logging
-import requests
-from ec2_metadata import ec2_metadata
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from sebs.lazy import LazyImport
+from sebs.api import ApiClient
+from sebs.poller import Poller, WaitFailed, WaitTimeout
+from sebs.hydrate import Hydrator, find_device
+from sebs.cleanup import CleanupQueue
+from sebs.timing import Timer
+from sebs.journal import RestoreJournal
+from sebs.metadata import InstanceMetadata, MetadataError
+
+# Only imported once we first talk to AWS
+# boto3 sessions that load the trimmed EC2 model
+make_session = LazyImport('sebs.model', 'make_session')
+Config = LazyImport('botocore.config', 'Config')
+LeanEC2Client = LazyImport('sebs.lean', 'LeanEC2Client')
+CredentialProvider = LazyImport('sebs.lean', 'CredentialProvider')
 
 log = logging.getLogger('sebs')
 
-for name in logging.Logger.manager.loggerDict.keys():
-    if ('boto' in name) or ('urllib3' in name):
-        logging.getLogger(name).setLevel(logging.WARNING)
+# Their loggers don't exist until they are imported, but every child logger
+# takes its level from these
+for name in ['boto3', 'botocore', 's3transfer', 'urllib3']:
+    logging.getLogger(name).setLevel(logging.WARNING)
+
+
+# Volume types that accept Iops and Throughput on create_volume
+PROVISIONED_IOPS_TYPES = ['io1', 'io2', 'gp3']
+PROVISIONED_THROUGHPUT_TYPES = ['gp3']
+
+# Marks snapshots taken by the daemon, the value is the app tag and device so
+# they are still found once the device has moved to a new volume
+STANDBY_TAG = 'sebs:standby'
+# Marks volumes pre-created in other AZs, the value is the app tag and device
+STANDBY_VOLUME_TAG = 'sebs:standby-volume'
+# The snapshot a standby volume was created from and when it was taken
+STANDBY_SNAPSHOT_TAG = 'sebs:snapshot'
+STANDBY_TIME_TAG = 'sebs:snapshot-time'
+# Snapshot taken of a detached volume while its instance was terminating or
+# by a restore that may not have finished
+FINAL_SNAPSHOT_TAG = 'sebs:final-snapshot'
+# Marks a copy made by a restore, the value is the volume it was copied from
+RESTORED_FROM_TAG = 'sebs:restored-from'
+
+# Most values a single describe filter is sent with
+FILTER_BATCH_SIZE = 200
+
+
+def supports_init_rate(client):
+    # VolumeInitializationRate is newer than the oldest botocore sebs runs
+    # with, which rejects it. The lean client has no model and sends it.
+    model = getattr(getattr(client, 'meta', None), 'service_model', None)
+
+    if model is None:
+        return True
+
+    return 'VolumeInitializationRate' in model.operation_model('CreateVolume').input_shape.members
+
+
+def batches(values, size=FILTER_BATCH_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
 
 
 class Instance:
-    def __init__(self, volume_tag):
+    def __init__(self, volume_tag, max_pool_connections=10, tcp_keepalive=True, poller=None,
+                 fast_restore=False, init_rate=None, hydrate=None, reuse_snapshot=None,
+                 instance_id=None, region=None, session=None, timer=None, journal=None,
+                 transport='boto3', metadata=None):
+        # Given an instance_id we manage that instance from somewhere else
+        # instead of the instance we are running on.
+        self.instance_id = instance_id
+        self.region = region
         # Create a session so we don't have to keep getting creds.
-        self.session = None
-        self.instance = self.get_instance()
+        self.session = session
+        # Every wait shares one poller so they all honor the run deadline
+        self.poller = poller or Poller()
+        self.waiter = None
+        # Every phase of the run is recorded for the run report
+        self.timer = timer or Timer()
+        # How far each restore got, so a rerun can pick up where it stopped
+        self.journal = journal or RestoreJournal()
+        # The identity of the instance we run on, read once with one token
+        # that credentials are read with as well
+        self.metadata = metadata or InstanceMetadata()
+        # boto3, or lean to call EC2 with sebs' own client and leave boto3
+        # for the calls it doesn't cover
+        self.transport = transport
+        self.max_pool_connections = max_pool_connections
+        self.tcp_keepalive = tcp_keepalive
+        # One client is shared by every device so the service model is only
+        # loaded once and all calls reuse the same connections.
+        self.config = self.boto3_config() if transport == 'boto3' else None
+        self.ec2_client = None
+        self.asg_client = None
         self.volume_tag = volume_tag
+        self.inventory = None
+        self.instance = self.get_instance()
+
+        # Found out now rather than halfway through a copy
+        if init_rate and not supports_init_rate(self.ec2_client and self.ec2_client.client):
+            message = 'This botocore does not support --init-rate, upgrade boto3 or use --transport lean'
+
+            if self.instance_id:
+                raise ValueError(message)
+
+            log.error(message)
+            sys.exit(1)
+        # How volumes copied to another AZ should be initialized
+        self.fast_restore = fast_restore
+        self.init_rate = init_rate
+        # Hydrator options for reading copied volumes once they are attached
+        self.hydrate = hydrate
+        # Max age in seconds of a standby snapshot we can restore from
+        self.reuse_snapshot = reuse_snapshot
+        # Deleting old volumes and snapshots is kept off the critical path
+        self.cleanup = CleanupQueue()
         self.backup = []
 
+    def boto3_config(self):
+        # Retries happen in ApiClient so throttling slows every call down
+        return Config(max_pool_connections=self.max_pool_connections,
+                      tcp_keepalive=self.tcp_keepalive,
+                      retries={'total_max_attempts': 1})
+
     def get_instance(self):
+        if self.instance_id:
+            return self.get_remote_instance()
+
         log.info('Getting EC2 instance metadata.')
         try:
-            instance_id = ec2_metadata.instance_id
+            with self.timer.span('metadata'):
+                instance_id = self.metadata.instance_id()
             log.info(f'Running on {instance_id}')
-        except requests.exceptions.ConnectTimeout:
+        except MetadataError as e:
             log.error(
-                'Failled to get instance metadata, are you sure you are running on an EC2 instance?')
+                f'Failed to get instance metadata, are you sure you are running on an EC2 instance? {e}')
             sys.exit(1)
         except:
             t, v, _tb = sys.exc_info()
 
             sys.exit(1)
 
+        if self.transport == 'lean':
+            return self.get_lean_instance(instance_id)
+
         try:
-            self.session = boto3.session.Session(
-                region_name=ec2_metadata.region)
-            ec2 = self.session.resource('ec2')
-            instance = ec2.Instance(instance_id)
-            # We have to call load to see if we are really connected
-            instance.load()
+            self.session = make_session(region_name=self.metadata.region(),
+                                        metadata=self.metadata.client)
+            self.ec2_client = ApiClient(
+                self.session.client('ec2', config=self.config))
+            # Describe the instance through the API client to see if we are
+            # really connected, botocore itself only tries once.
+            return self.load_instance(lambda: self.describe_instance(instance_id), instance_id)
+        except:
+            t, v, _tb = sys.exc_info()
+            log.error(f'Unexpected Error {t}: {v}')
+            sys.exit(2)
+
+    def get_lean_instance(self, instance_id):
+        # Credentials come from the instance profile and the instance is
+        # described through the API client like on the other paths.
+        try:
+            self.region = self.metadata.region()
+            self.ec2_client = ApiClient(LeanEC2Client(
+                self.region, credentials=CredentialProvider(self.metadata.client),
+                max_pool_connections=self.max_pool_connections))
+
+            return self.load_instance(lambda: self.describe_instance(instance_id), instance_id)
         except:
             t, v, _tb = sys.exc_info()
             log.error(f'Unexpected Error {t}: {v}')
             sys.exit(2)
 
-        return instance
+    def load_instance(self, probe, instance_id):
+        # Every device needs the volume search and it only needs the instance
+        # id, so it runs while the instance is probed instead of after it.
+        self.inventory = VolumeInventory(self.ec2_client, instance_id, self.volume_tag)
 
-    def add_stateful_device(self, device_name):
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            search = pool.submit(self.prefetch_inventory, instance_id)
+
+            with self.timer.span('instance_load', instance=instance_id):
+                result = probe()
+
+            search.result()
+
+        return result
+
+    def prefetch_inventory(self, instance_id):
+        # A failed search is run again when the first device is added
+        try:
+            with self.timer.span('inventory', instance=instance_id):
+                self.inventory.load(concurrent=True)
+        except:
+            t, v, _tb = sys.exc_info()
+            log.warning(f'Failed to prefetch the volume search: {t.__name__}: {v}')
+
+    def get_remote_instance(self):
+        # The metadata service only knows about the instance we run on so
+        # everything has to come from the EC2 API. Errors are raised to the caller.
+        log.info(f'Managing {self.instance_id} remotely')
+
+        if not self.session:
+            self.session = make_session(region_name=self.region)
+
+        self.ec2_client = ApiClient(
+            self.session.client('ec2', config=self.config))
+
+        with self.timer.span('instance_load', instance=self.instance_id):
+            return self.describe_instance(self.instance_id)
+
+    def describe_instance(self, instance_id):
+        reservations = self.ec2_client.describe_instances(
+            InstanceIds=[instance_id])['Reservations']
+
+        return InstanceRecord(reservations[0]['Instances'][0])
+
+    def availability_zone(self):
+        if self.instance_id:
+            return self.instance.placement['AvailabilityZone']
+
+        return self.metadata.availability_zone()
+
+    def wait_until_running(self):
+        # Volumes can't be attached until a new instance leaves pending
+        def check():
+            self.instance = self.describe_instance(self.instance.id)
+
+            if self.instance.state in ['shutting-down', 'terminated', 'stopping', 'stopped']:
+                raise WaitFailed(
+                    f'{self.instance.id} is {self.instance.state}')
+
+            return self.instance.state == 'running'
+
+        with self.timer.span('wait_running', instance=self.instance.id):
+            self.poller.wait(check, f'{self.instance.id} to be running')
+
+    def add_stateful_device(self, device_name, overrides=None):
         log.info(f'Handling {device_name}')
-        sv = StatefulVolume(self.session, self.instance.id,
-                            device_name, self.volume_tag)
 
-        sv.get_status()
+        # All devices share one inventory so we only search for volumes once
+        if not self.inventory:
+            self.inventory = VolumeInventory(self.ec2_client,
+                                             self.instance.id,
+                                             self.volume_tag)
+
+        # and one waiter so concurrent waits are polled together
+        if not self.waiter:
+            self.waiter = ResourceWaiter(self.ec2_client, self.poller)
+
+        if not self.inventory.loaded:
+            with self.timer.span('inventory', instance=self.instance.id):
+                self.inventory.load()
+
+        sv = StatefulVolume(self.ec2_client, self.instance.id,
+                            device_name, self.volume_tag,
+                            inventory=self.inventory, waiter=self.waiter,
+                            overrides=overrides, fast_restore=self.fast_restore,
+                            init_rate=self.init_rate, cleanup=self.cleanup,
+                            reuse_snapshot=self.reuse_snapshot, timer=self.timer,
+                            journal=self.journal)
+
+        with self.timer.span('status', device=device_name):
+            sv.get_status()
 
         self.backup.append(sv)
 
     def tag_stateful_volumes(self):
         log.info(f'Tagging Volumes with control tag: {self.volume_tag}')
-        for sv in self.backup:
-            if sv.status not in ['Duplicate', 'Missing']:
-                sv.tag_volume()
+        with self.timer.span('tag'):
+            for sv in self.backup:
+                if sv.status not in ['Duplicate', 'Missing', 'Failed']:
+                    sv.tag_volume()
 
-    def attach_stateful_volumes(self):
+    def attach_stateful_volumes(self, parallel=1):
         log.info(f'Attaching Volumes to {self.instance.id}')
-        for sv in self.backup:
-            if sv.status == 'Not Attached':
-                sv.copy(ec2_metadata.availability_zone)
-                sv.attach()
+
+        with self.timer.span('availability_zone'):
+            target_az = self.availability_zone()
+        pending = [sv for sv in self.backup if sv.status == 'Not Attached']
+
+        # Devices snapshotted together are also created together
+        parallel = max(parallel, self.snapshot_groups(pending, target_az))
+
+        if parallel <= 1:
+            for sv in pending:
+                self.restore_volume(sv, target_az)
+
+            return []
+
+        log.info(f'Restoring {len(pending)} volumes with {parallel} workers')
+        failed = []
+
+        with ThreadPoolExecutor(max_workers=parallel) as executor:
+            futures = {executor.submit(self.restore_volume, sv, target_az): sv
+                       for sv in pending}
+
+            for future in as_completed(futures):
+                sv = futures[future]
+                try:
+                    future.result()
+                except:
+                    t, v, _tb = sys.exc_info()
+                    log.error(
+                        f'Failed to restore {sv.device_name}: {t.__name__}: {v}')
+                    sv.status = 'Failed'
+                    failed.append(sv)
+
+        return failed
+
+    def snapshot_groups(self, pending, target_az):
+        # Volumes still attached to the same instance are snapshotted with a
+        # single crash-consistent create_snapshots call.
+        groups = {}
+
+        for sv in pending:
+            if not sv.needs_copy(target_az):
+                continue
+
+            for attachment in sv.volume.attachments:
+                groups.setdefault(attachment['InstanceId'], []).append(sv)
+
+        largest = 0
+
+        for source_id, group in groups.items():
+            if len(group) < 2:
+                continue
+
+            try:
+                with self.timer.span('group_snapshot', instance=source_id):
+                    self.create_group_snapshot(source_id, group)
+                largest = max(largest, len(group))
+            except:
+                t, v, _tb = sys.exc_info()
+                log.warning(
+                    f'Could not snapshot volumes of {source_id} together, snapshotting one at a time: {t.__name__}: {v}')
+
+        return largest
+
+    def create_group_snapshot(self, source_id, group):
+        volume_ids = [sv.volume.volume_id for sv in group]
+
+        log.info(
+            f'Taking crash-consistent snapshots of {volume_ids} on {source_id}')
+
+        reservations = self.ec2_client.describe_instances(
+            InstanceIds=[source_id])['Reservations']
+        source = reservations[0]['Instances'][0]
+
+        # create_snapshots takes every volume on the instance unless excluded
+        exclude_boot = True
+        exclude = []
+
+        for mapping in source.get('BlockDeviceMappings', []):
+            volume_id = mapping.get('Ebs', {}).get('VolumeId')
+            root = mapping['DeviceName'] == source.get('RootDeviceName')
+
+            if volume_id in volume_ids:
+                exclude_boot = exclude_boot and not root
+            elif volume_id and not root:
+                exclude.append(volume_id)
+
+        specification = {'InstanceId': source_id,
+                         'ExcludeBootVolume': exclude_boot}
+
+        if exclude:
+            specification['ExcludeDataVolumeIds'] = exclude
+
+        response = self.ec2_client.create_snapshots(
+            InstanceSpecification=specification,
+            Description='Intermediate snapshot for SEBS.',
+            CopyTagsFromSource='volume'
+        )
+
+        snapshots = {snapshot['VolumeId']: snapshot['SnapshotId']
+                     for snapshot in response['Snapshots']}
+
+        # Anything left out is snapshotted on its own by copy
+        for sv in group:
+            sv.snapshot_id = snapshots.get(sv.volume.volume_id)
+
+        log.debug(f'Snapshots: {snapshots}')
+
+    def asg_name(self):
+        tags = {tag['Key']: tag['Value'] for tag in self.instance.tags or []}
+        group_name = tags.get('aws:autoscaling:groupName')
+
+        if not group_name:
+            log.warning(f'{self.instance.id} is not part of an autoscaling group')
+
+        return group_name
+
+    def autoscaling_client(self):
+        if not self.asg_client:
+            # The lean transport only covers EC2
+            if not self.session:
+                self.session = make_session(region_name=self.region,
+                                            metadata=self.metadata.client)
+
+            self.asg_client = ApiClient(
+                self.session.client('autoscaling', config=self.config or self.boto3_config()))
+
+        return self.asg_client
+
+    def asg_availability_zones(self):
+        group_name = self.asg_name()
+
+        if not group_name:
+            return []
+
+        groups = self.autoscaling_client().describe_auto_scaling_groups(
+            AutoScalingGroupNames=[group_name])['AutoScalingGroups']
+
+        return groups[0]['AvailabilityZones'] if groups else []
+
+    def snapshot_stateful_volumes(self):
+        # Used while this instance terminates so the next one can skip the snapshot
+        attached = [sv for sv in self.backup if sv.status == 'Attached']
+        failed = []
+
+        log.info('Flushing file system buffers')
+        os.sync()
+
+        snapshots = {}
+
+        for sv in attached:
+            try:
+                snapshots[sv] = sv.detach_and_snapshot()
+            except:
+                t, v, _tb = sys.exc_info()
+                log.error(
+                    f'Failed to snapshot {sv.device_name}: {t.__name__}: {v}')
+                failed.append(sv)
+
+        # The snapshots all progress at the same time so wait on them together
+        for sv, snapshot_id in snapshots.items():
+            try:
+                self.waiter.wait_for_snapshot(snapshot_id)
+                log.info(f'Final snapshot {snapshot_id} of {sv.device_name} is complete')
+            except:
+                t, v, _tb = sys.exc_info()
+                log.error(
+                    f'Failed waiting on {snapshot_id} of {sv.device_name}: {t.__name__}: {v}')
+                failed.append(sv)
+
+        return failed
+
+    def cleanup_resources(self):
+        with self.timer.span('cleanup'):
+            return self.cleanup.run()
+
+    def restore_volume(self, sv, target_az):
+        sv.restore(target_az)
+
+    def hydrate_stateful_volumes(self):
+        # Reading a whole volume can take many minutes, so it only starts once
+        # every device is attached, tagged and cleaned up after. Every copied
+        # volume is read at the same time, each by its own Hydrator workers.
+        if self.hydrate is None:
+            return
+
+        copied = [sv for sv in self.backup if sv.copied and sv.ready]
+
+        if not copied:
+            return
+
+        log.info(f'Hydrating {len(copied)} copied volumes')
+
+        with ThreadPoolExecutor(max_workers=len(copied)) as executor:
+            list(executor.map(self.hydrate_volume, copied))
+
+    def hydrate_volume(self, sv):
+        # Hydrating only speeds up the first reads of the volume, so a
+        # failure here should not fail the restore.
+        devices = []
+
+        def check():
+            devices.append(find_device(sv.device_name, sv.volume.volume_id))
+            return devices[-1] is not None
+
+        try:
+            with self.timer.span('hydrate', device=sv.device_name, volume=sv.volume.volume_id):
+                self.poller.wait(check, f'{sv.device_name} to show up', timeout=300)
+                Hydrator(devices[-1], **self.hydrate).run()
+        except:
+            t, v, _tb = sys.exc_info()
+            log.warning(
+                f'Failed to hydrate {sv.device_name}: {t.__name__}: {v}')
+
+
+class VolumeInventory:
+    def __init__(self, ec2_client, instance_id, tag_name):
+        self.ec2_client = ec2_client
+        self.instance_id = instance_id
+        self.tag_name = tag_name
+        self.loaded = False
+        # Volumes with our control tag, keyed by the device name in the tag
+        self.tagged = {}
+        # Volumes attached to this instance, keyed by device name
+        self.attached = {}
+
+    def load(self, concurrent=False):
+        log.info(
+            f'Searching for volumes with control tag {self.tag_name} or attached to {self.instance_id}')
+
+        if concurrent:
+            # Each search is its own round trip to EC2
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                tagged = pool.submit(self.search_tagged)
+                attached = pool.submit(self.search_attached)
+                self.tagged, self.attached = tagged.result(), attached.result()
+        else:
+            self.tagged = self.search_tagged()
+            self.attached = self.search_attached()
+
+        self.loaded = True
+
+    def search_tagged(self):
+        tagged = {}
+
+        for volume in self.describe_volumes([{
+            'Name': 'tag-key',
+            'Values': [
+                self.tag_name,
+            ]
+        }]):
+            for tag in volume.get('Tags', []):
+                if tag['Key'] == self.tag_name:
+                    tagged.setdefault(tag['Value'], []).append(volume)
+
+        return tagged
+
+    def search_attached(self):
+        attached = {}
+
+        for volume in self.describe_volumes([{
+            'Name': 'attachment.instance-id',
+            'Values': [
+                self.instance_id,
+            ]
+        }]):
+            for attachment in volume.get('Attachments', []):
+                if attachment['InstanceId'] == self.instance_id:
+                    attached[attachment['Device']] = volume
+
+        return attached
+
+    def describe_volumes(self, filters):
+        volumes = []
+        paginator = self.ec2_client.get_paginator('describe_volumes')
+
+        for page in paginator.paginate(Filters=filters):
+            log.debug(f'Response of volume search: {page}')
+            volumes.extend(page['Volumes'])
+
+        return volumes
+
+    def tagged_volumes(self, device_name):
+        if not self.loaded:
+            self.load()
+
+        return self.tagged.get(device_name, [])
+
+    def attached_volume(self, device_name):
+        if not self.loaded:
+            self.load()
+
+        return self.attached.get(device_name)
+
+
+class ResourceWaiter:
+    failed_states = {
+        'volume': ['deleting', 'deleted', 'error'],
+        'snapshot': ['error'],
+    }
+
+    def __init__(self, ec2_client, poller, max_age=1):
+        self.ec2_client = ec2_client
+        self.poller = poller
+        # Reuse a describe this many seconds old instead of calling again
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        # Resource ids being waited on, with how many waiters want each
+        self.pending = {'volume': {}, 'snapshot': {}}
+        self.states = {}
+        self.refreshed_at = None
+        # Counts the polls so each waiter can tell when there is a new one
+        self.generation = 0
+
+    def wait_for_volume(self, volume_id, state):
+        return self.wait('volume', volume_id, state)
+
+    def wait_for_snapshot(self, snapshot_id):
+        return self.wait('snapshot', snapshot_id, 'completed')
+
+    def wait(self, kind, resource_id, state):
+        # Only trust polls newer than the last one we looked at
+        seen = [self.watch(kind, resource_id)]
+
+        def check():
+            current, seen[0] = self.get_state(resource_id, seen[0])
+
+            if current in self.failed_states[kind]:
+                raise WaitFailed(f'{resource_id} is {current}')
+
+            return current == state
+
+        try:
+            return self.poller.wait(check, f'{resource_id} to be {state}')
+        finally:
+            self.unwatch(kind, resource_id)
+
+    def watch(self, kind, resource_id):
+        with self.lock:
+            pending = self.pending[kind]
+            pending[resource_id] = pending.get(resource_id, 0) + 1
+
+        return self.generation
+
+    def unwatch(self, kind, resource_id):
+        with self.lock:
+            pending = self.pending[kind]
+            pending[resource_id] -= 1
+
+            if not pending[resource_id]:
+                del pending[resource_id]
+                self.states.pop(resource_id, None)
+
+    def get_state(self, resource_id, seen):
+        # Only one thread describes at a time, the rest reuse its results
+        # as long as they are newer than anything the caller has seen.
+        with self.refresh_lock:
+            oldest = self.poller.clock() - self.max_age
+
+            if self.generation <= seen or self.refreshed_at < oldest:
+                self.refresh()
+
+            return self.states.get(resource_id), self.generation
+
+    def refresh(self):
+        started = self.poller.clock()
+
+        with self.lock:
+            volume_ids = sorted(self.pending['volume'])
+            snapshot_ids = sorted(self.pending['snapshot'])
+
+        states = {}
+
+        # Filters are used instead of ids so a volume or snapshot that
+        # isn't visible yet is just left out instead of failing the call
+        for batch in batches(volume_ids):
+            response = self.ec2_client.describe_volumes(
+                Filters=[{'Name': 'volume-id', 'Values': batch}])
+
+            for volume in response['Volumes']:
+                states[volume['VolumeId']] = volume['State']
+
+        for batch in batches(snapshot_ids):
+            response = self.ec2_client.describe_snapshots(
+                OwnerIds=['self'],
+                Filters=[{'Name': 'snapshot-id', 'Values': batch}])
+
+            for snapshot in response['Snapshots']:
+                states[snapshot['SnapshotId']] = snapshot['State']
+
+        log.debug(f'Polled {len(volume_ids)} volumes and {len(snapshot_ids)} snapshots: {states}')
+
+        with self.lock:
+            self.states = states
+
+        self.refreshed_at = started
+        self.generation += 1
+
+
+class InstanceRecord:
+    # Instance details from DescribeInstances with the same names as the
+    # boto3 Instance resource.
+    def __init__(self, data):
+        self.data = data
+        self.id = data['InstanceId']
+        self.placement = data.get('Placement', {})
+        self.state = data.get('State', {}).get('Name')
+        self.tags = data.get('Tags', [])
+
+
+class VolumeRecord:
+    # Volume details taken straight from a DescribeVolumes or CreateVolume
+    # response so we never have to load them again.
+    def __init__(self, data):
+        self.data = data
+        self.volume_id = data['VolumeId']
+        self.availability_zone = data.get('AvailabilityZone')
+        self.volume_type = data.get('VolumeType')
+        self.size = data.get('Size')
+        self.iops = data.get('Iops')
+        self.throughput = data.get('Throughput')
+        self.encrypted = data.get('Encrypted', False)
+        self.kms_key_id = data.get('KmsKeyId')
+        self.multi_attach_enabled = data.get('MultiAttachEnabled', False)
+        self.attachments = data.get('Attachments', [])
+        self.tags = {tag['Key']: tag['Value'] for tag in data.get('Tags', [])}
 
 
 class StatefulVolume:
-    def __init__(self, session, instance_id, device_name, tag_name):
-        # Use the existing session so we dont have to keep fetching creds
-        self.session = session
+    def __init__(self, ec2_client, instance_id, device_name, tag_name,
+                 inventory=None, waiter=None, overrides=None, fast_restore=False,
+                 init_rate=None, cleanup=None, reuse_snapshot=None, timer=None,
+                 journal=None):
+        # Use the shared client so we dont have to keep fetching creds
+        self.ec2_client = ec2_client
         self.instance_id = instance_id
         self.device_name = device_name
         self.ready = False
         self.status = 'Unknown'
         self.volume = None
+        # True once the volume has been restored from a snapshot
+        self.copied = False
         self.tag_name = tag_name
-        self.ec2_client = self.session.client('ec2')
-        self.ec2_resource = self.session.resource('ec2')
+        self.inventory = inventory
+        self.waiter = waiter or ResourceWaiter(self.ec2_client, Poller())
+        # Temporary resources are deleted after every device is attached
+        self.cleanup = cleanup or CleanupQueue()
+        # create_volume settings to change when copying to another AZ
+        self.overrides = overrides or {}
+        # Restore copies at full performance with Fast Snapshot Restore or
+        # by initializing them at this many MiB/s
+        self.fast_restore = fast_restore
+        self.init_rate = init_rate
+        # Restore from a standby snapshot up to this many seconds old when the
+        # old volume is no longer attached to anything
+        self.reuse_snapshot = reuse_snapshot
+        # Snapshot taken together with the other devices of the source instance
+        self.snapshot_id = None
+        # Launch volume detached from our device name
+        self.placeholder = None
+        # Start and end of each restore phase
+        self.timings = {}
+        self.timer = timer or Timer()
+        self.journal = journal or RestoreJournal()
+        # Copies left behind by a restore that was interrupted
+        self.interrupted = []
+
+    def get_inventory(self):
+        # Fall back to an inventory of our own when one wasn't shared with us
+        if not self.inventory:
+            self.inventory = VolumeInventory(self.ec2_client,
+                                             self.instance_id,
+                                             self.tag_name)
+
+        return self.inventory
 
     def get_status(self):
         log.info(f'Checking for previous volume of {self.device_name}')
-        response = self.ec2_client.describe_volumes(
-            Filters=[
-                {
-                    'Name': f'tag:{self.tag_name}',
-                    'Values': [
-                        self.device_name,
-                    ]
-                },
-            ]
-        )
+        tagged_volumes = self.get_inventory().tagged_volumes(self.device_name)
 
-        log.debug(f'Response of tag search: {response}')
-
-        if not response['Volumes']:
+        if not tagged_volumes:
             log.info(f'Did not find a previous volume for {self.device_name}')
             self.status = 'New'
             log.info(
                 f'Checking if {self.device_name} is mounted to {self.instance_id}.')
 
-            response = self.ec2_client.describe_volumes(
-                Filters=[
-                    {
-                        'Name': 'attachment.instance-id',
-                        'Values': [
-                            self.instance_id,
-                        ]
-                    },
-                    {
-                        'Name': 'attachment.device',
-                        'Values': [
-                            self.device_name,
-                        ]
-                    }
-                ]
-            )
-
-            log.debug(f'Reponse of local attachment search: {response}')
+            local_volume = self.inventory.attached_volume(self.device_name)
 
-            if not response['Volumes']:
+            if not local_volume:
                 log.error(
                     f"Could not find EBS volume mounted at {self.device_name} for {self.instance_id}")
 
                 self.status = 'Missing'
                 return self.status
 
-            volumeId = response['Volumes'][0]['VolumeId']
+            volumeId = local_volume['VolumeId']
             log.info(f'No pre-existing volume for {self.device_name}')
 
             self.status = 'Attached'
-            self.volume = self.ec2_resource.Volume(volumeId)
+            self.volume = VolumeRecord(local_volume)
             log.info(f'Current volume is {volumeId} and is {self.status}')
             self.tag_volume()
 
-        elif len(response['Volumes']) != 1:
-            vol1 = response['Volumes'][0]['VolumeId']
-            vol2 = response['Volumes'][1]['VolumeId']
+        elif not self.split_copies(tagged_volumes):
+            vol1 = tagged_volumes[0]['VolumeId']
+            vol2 = tagged_volumes[1]['VolumeId']
             log.error(
                 f"Found duplicate EBS volumes with tag {self.tag_name}: {vol1} and {vol2}")
 
             self.status = 'Duplicate'
         else:
-            volumeId = response['Volumes'][0]['VolumeId']
+            volumes = [VolumeRecord(volume)
+                       for volume in self.split_copies(tagged_volumes)]
+            volumeId = volumes[0].volume_id
 
             log.info(
                 f'Found existing Volume {volumeId} for {self.device_name}')
 
             self.status = 'Not Attached'
-            self.volume = self.ec2_resource.Volume(volumeId)
+            self.volume = volumes[0]
+            self.interrupted = volumes[1:]
 
-            for attachment in self.volume.attachments:
-                if attachment['InstanceId'] == self.instance_id:
-                    self.status = 'Attached'
+            for volume in volumes:
+                for attachment in volume.attachments:
+                    if attachment['InstanceId'] == self.instance_id:
+                        self.status = 'Attached'
+                        self.volume = volume
+
+            if self.interrupted:
+                log.info(
+                    f"Found copies of {volumeId} from an interrupted restore: {', '.join(volume.volume_id for volume in self.interrupted)}")
+
+            # The restore finished before it could clean up after itself
+            if self.status == 'Attached':
+                self.forget_source()
+
+                for volume in volumes:
+                    if volume is not self.volume:
+                        self.discard(volume)
+
+                self.interrupted = []
+                self.journal.clear(self.journal_key())
 
         return self.status
 
+    def split_copies(self, tagged_volumes):
+        # Copies made by an interrupted restore name the volume they were
+        # copied from, so they aren't mistaken for duplicates. The name is
+        # removed once a copy is attached, so a copy that was ever in use is a
+        # duplicate like any other. Returns the volume they were copied from
+        # followed by the copies.
+        ids = [volume['VolumeId'] for volume in tagged_volumes]
+        copies = [volume for volume in tagged_volumes
+                  if VolumeRecord(volume).tags.get(RESTORED_FROM_TAG) in ids]
+        originals = [volume for volume in tagged_volumes if volume not in copies]
+
+        if len(originals) != 1:
+            return None
+
+        if any(VolumeRecord(copy).tags[RESTORED_FROM_TAG] != originals[0]['VolumeId']
+               for copy in copies):
+            return None
+
+        return originals + copies
+
+    def journal_key(self):
+        return f'{self.tag_name}:{self.device_name}'
+
+    def forget_source(self):
+        # An attached copy is the device's volume from now on and must never
+        # be resumed or discarded as a leftover of an interrupted restore, so
+        # this can't wait for the cleanup queue. A promoted standby only
+        # gets the tag after it was described.
+        if not (self.copied or RESTORED_FROM_TAG in self.volume.tags):
+            return
+
+        # The copy is attached either way, and once the cleanup deletes the
+        # volume it was copied from the tag no longer matches anything
+        try:
+            self.ec2_client.delete_tags(
+                Resources=[self.volume.volume_id],
+                Tags=[{'Key': RESTORED_FROM_TAG}]
+            )
+        except:
+            t, v, _tb = sys.exc_info()
+            log.warning(
+                f'Failed to remove {RESTORED_FROM_TAG} from {self.volume.volume_id}: {t.__name__}: {v}')
+            return
+
+        self.volume.tags.pop(RESTORED_FROM_TAG, None)
+
+    def discard(self, volume):
+        # Remove a volume an interrupted restore left behind and the snapshot
+        # that restore was copying it from
+        self.cleanup.add(f'delete old volume {volume.volume_id}',
+                         self.ec2_client.delete_volume,
+                         VolumeId=volume.volume_id)
+
+        entry = self.journal.get(self.journal_key())
+        snapshot_ids = {volume.tags.get(FINAL_SNAPSHOT_TAG)}
+
+        if entry.get('source') == volume.volume_id:
+            snapshot_ids.add(entry.get('snapshot'))
+
+        for snapshot_id in sorted(snapshot_id for snapshot_id in snapshot_ids if snapshot_id):
+            self.cleanup.add(f'delete snapshot {snapshot_id}',
+                             self.ec2_client.delete_snapshot,
+                             SnapshotId=snapshot_id)
+
     def tag_volume(self):
         log.info(
             f'Tagging {self.volume.volume_id} with control tag {self.tag_name}.')
 
-        self.volume.create_tags(Tags=[
-            {
-                'Key': self.tag_name,
-                'Value': self.device_name
-            },
-        ])
+        self.ec2_client.create_tags(
+            Resources=[
+                self.volume.volume_id,
+            ],
+            Tags=[
+                {
+                    'Key': self.tag_name,
+                    'Value': self.device_name
+                },
+            ]
+        )
 
         self.ready = True
 
+    def restore(self, target_az):
+        started = time.monotonic()
+
+        if self.needs_copy(target_az):
+            # The launch volume can be detached while the copy is being made
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                detach = executor.submit(self.detach_placeholder)
+
+                try:
+                    self.copy(target_az)
+                except:
+                    # Put the launch volume back so the device still exists
+                    wait([detach])
+                    self.reattach_placeholder()
+                    raise
+
+                detach.result()
+
+        self.attach()
+
+        phases = ', '.join(f'{phase} {start - started:.1f}-{end - started:.1f}s'
+                           for phase, (start, end) in self.timings.items())
+        log.info(
+            f'Restored {self.device_name} in {time.monotonic() - started:.1f}s ({phases})')
+
+        return self.status
+
+    def record(self, phase, started, **tags):
+        self.timings[phase] = (started, time.monotonic())
+        tags.setdefault('volume', self.volume.volume_id if self.volume else None)
+        self.timer.add(phase, *self.timings[phase], device=self.device_name, **tags)
+
+        log.info(
+            f'{phase.capitalize()} for {self.device_name} took {self.timings[phase][1] - started:.1f}s')
+
+    def needs_copy(self, target_az):
+        # Only a volume in another AZ has to be copied
+        return self.status == 'Not Attached' and target_az != self.volume.availability_zone
+
     def copy(self, target_az):
-        if self.status != 'Not Attached':
+        if not self.needs_copy(target_az):
             return self.status
-        # If the current volume az is in the target AZ do nothing
-        if target_az == self.volume.availability_zone:
+
+        if self.resume_copy(target_az):
+            return self.status
+
+        if self.promote_standby_volume(target_az):
             return self.status
 
+        # Check the settings before anything is snapshotted
+        settings = self.volume_settings()
+
         log.info(f'Copying {self.volume.volume_id} to {target_az}')
+        started = time.monotonic()
 
-        snapshot = self.volume.create_snapshot(
-            Description='Intermediate snapshot for SEBS.',
-            TagSpecifications=[
-                {
-                    'ResourceType': 'snapshot',
-                    'Tags': [
-                        {
-                            'Key': self.tag_name,
-                            'Value': self.device_name
-                        },
-                    ]
-                },
-            ]
-        )
+        final_id = self.final_snapshot() or self.journaled_snapshot()
+        standby_id = None if final_id else self.latest_standby_snapshot()
+        snapshot_id = self.snapshot_id or final_id or standby_id
 
-        log.debug(f'Snapshot: {snapshot.snapshot_id}')
+        if not snapshot_id:
+            snapshot_id = self.create_snapshot()
+            self.remember_snapshot(snapshot_id)
 
-        # Not sure but we probably have to wait until its completed
-        snapshot.wait_until_completed()
+        log.debug(f'Snapshot: {snapshot_id}')
+
+        self.waiter.wait_for_snapshot(snapshot_id)
+
+        self.record('snapshot', started, snapshot=snapshot_id)
+
+        fast_restore = self.fast_restore and self.enable_fast_restore(
+            snapshot_id, target_az)
 
         # If we fail to create the volume we need to remove this temp snapshot
 
+        started = time.monotonic()
+        log.info(f'Creating volume in {target_az} with {settings}')
+
+        # The same token returns the same volume if a rerun asks again
         response = self.ec2_client.create_volume(
             AvailabilityZone=target_az,
-            SnapshotId=snapshot.snapshot_id,
-            VolumeType='' if not self.volume.volume_type else self.volume.volume_type,
+            SnapshotId=snapshot_id,
+            ClientToken=self.client_token(snapshot_id, target_az),
             TagSpecifications=[
                 {
                     'ResourceType': 'volume',
@@ -216,9 +998,14 @@ class StatefulVolume:
                             'Key': self.tag_name,
                             'Value': self.device_name,
                         },
+                        {
+                            'Key': RESTORED_FROM_TAG,
+                            'Value': self.volume.volume_id,
+                        },
                     ]
                 },
-            ]
+            ],
+            **settings
         )
 
         log.debug(f'New Volume: {response}')
@@ -226,78 +1013,567 @@ class StatefulVolume:
         # This should be the existing volume thats in the wrong AZ
         prev_volume = self.volume
 
-        self.volume = self.ec2_resource.Volume(response['VolumeId'])
+        self.volume = VolumeRecord(response)
+        self.copied = True
+        self.journal.update(self.journal_key(), phase='create',
+                            volume=self.volume.volume_id)
 
         log.info(f'Waiting on volume {self.volume.volume_id} to be avaliable.')
 
-        waiter = self.ec2_client.get_waiter('volume_available')
+        self.waiter.wait_for_volume(self.volume.volume_id, 'available')
 
-        waiter.wait(VolumeIds=[self.volume.volume_id])
+        self.record('create', started, snapshot=snapshot_id)
 
-        # Cleanup this temporary resources
-        prev_volume.delete()
-        snapshot.delete()
+        # Cleanup this temporary resources once every device is attached
+        if fast_restore:
+            self.cleanup.add(f'disable fast snapshot restore for {snapshot_id}',
+                             self.disable_fast_restore,
+                             snapshot_id=snapshot_id, target_az=target_az)
+
+        self.cleanup.add(f'delete old volume {prev_volume.volume_id}',
+                         self.ec2_client.delete_volume,
+                         VolumeId=prev_volume.volume_id)
+        # Standby snapshots are kept until the daemon on the new volume
+        # prunes them, they share the device's standby key
+        if snapshot_id != standby_id:
+            self.cleanup.add(f'delete snapshot {snapshot_id}',
+                             self.ec2_client.delete_snapshot,
+                             SnapshotId=snapshot_id)
 
         return self.status
 
-    def attach(self):
-        if self.status != 'Not Attached':
-            return self.status
+    def resume_copy(self, target_az):
+        # A copy an interrupted restore left in this AZ only has to be attached.
+        # Like a final snapshot it is only current while the volume stays
+        # detached, and a group snapshot already taken is used instead.
+        if self.snapshot_id or self.volume.attachments:
+            return False
 
-        log.info(f'Attaching {self.volume.volume_id} to {self.instance_id}')
+        copies = [volume for volume in self.interrupted
+                  if volume.availability_zone == target_az and not volume.attachments]
 
-        # Need to find and delete any current volumes
-        response = self.ec2_client.describe_volumes(
-            Filters=[
+        if not copies:
+            return False
+
+        started = time.monotonic()
+        copy = copies[0]
+
+        log.info(
+            f'Resuming restore of {self.device_name} with {copy.volume_id} copied from {self.volume.volume_id}')
+
+        self.waiter.wait_for_volume(copy.volume_id, 'available')
+
+        # A standby volume that was being promoted still has its standby tags
+        if STANDBY_VOLUME_TAG in copy.tags:
+            self.ec2_client.delete_tags(
+                Resources=[copy.volume_id],
+                Tags=[{'Key': STANDBY_VOLUME_TAG}, {'Key': STANDBY_SNAPSHOT_TAG},
+                      {'Key': STANDBY_TIME_TAG}]
+            )
+
+        self.discard(self.volume)
+        self.interrupted.remove(copy)
+        self.volume = copy
+        self.copied = True
+
+        self.record('resume', started)
+
+        return True
+
+    def client_token(self, snapshot_id, target_az):
+        key = '|'.join([self.tag_name, self.device_name, self.volume.volume_id,
+                        snapshot_id, target_az])
+
+        return f'sebs-{hashlib.sha256(key.encode()).hexdigest()[:40]}'
+
+    def remember_snapshot(self, snapshot_id):
+        self.journal.update(self.journal_key(), phase='snapshot',
+                            source=self.volume.volume_id, snapshot=snapshot_id)
+
+        # Another instance can only pick it up from the volume, but only a
+        # detached volume can't change after the snapshot is taken
+        if not self.volume.attachments:
+            self.ec2_client.create_tags(
+                Resources=[self.volume.volume_id],
+                Tags=[{'Key': FINAL_SNAPSHOT_TAG, 'Value': snapshot_id}]
+            )
+
+    def journaled_snapshot(self):
+        # Covers a run that stopped before it could tag the volume
+        entry = self.journal.get(self.journal_key())
+        snapshot_id = entry.get('snapshot')
+
+        if self.snapshot_id or self.volume.attachments or not snapshot_id:
+            return None
+
+        if entry.get('source') != self.volume.volume_id:
+            return None
+
+        snapshots = self.ec2_client.describe_snapshots(
+            OwnerIds=['self'],
+            Filters=[{'Name': 'snapshot-id', 'Values': [snapshot_id]}]
+        )['Snapshots']
+
+        if not any(snapshot['State'] in ['pending', 'completed'] for snapshot in snapshots):
+            return None
+
+        log.info(
+            f'Resuming restore of {self.device_name} from journaled snapshot {snapshot_id}')
+
+        return snapshot_id
+
+    def create_snapshot(self):
+        snapshot = self.ec2_client.create_snapshot(
+            VolumeId=self.volume.volume_id,
+            Description='Intermediate snapshot for SEBS.',
+            TagSpecifications=[
                 {
-                    'Name': 'attachment.instance-id',
-                    'Values': [
-                        self.instance_id,
+                    'ResourceType': 'snapshot',
+                    'Tags': [
+                        {
+                            'Key': self.tag_name,
+                            'Value': self.device_name
+                        },
                     ]
                 },
+            ]
+        )
+
+        return snapshot['SnapshotId']
+
+    def final_snapshot(self):
+        # Only trust it while the volume stays detached, nothing could have
+        # written to it since.
+        if self.snapshot_id or self.volume.attachments:
+            return None
+
+        snapshot_id = self.volume.tags.get(FINAL_SNAPSHOT_TAG)
+
+        if snapshot_id:
+            log.info(
+                f'Restoring {self.device_name} from final snapshot {snapshot_id}')
+
+        return snapshot_id
+
+    def detach_and_snapshot(self):
+        log.info(
+            f'Detaching {self.volume.volume_id} from {self.device_name} for a final snapshot')
+
+        self.ec2_client.detach_volume(
+            Device=self.device_name,
+            InstanceId=self.instance_id,
+            VolumeId=self.volume.volume_id
+        )
+
+        self.waiter.wait_for_volume(self.volume.volume_id, 'available')
+
+        snapshot = self.ec2_client.create_snapshot(
+            VolumeId=self.volume.volume_id,
+            Description='Final snapshot for SEBS.',
+            TagSpecifications=[
                 {
-                    'Name': 'attachment.device',
-                    'Values': [
-                        self.device_name,
+                    'ResourceType': 'snapshot',
+                    'Tags': [
+                        {
+                            'Key': self.tag_name,
+                            'Value': self.device_name
+                        },
                     ]
                 },
             ]
         )
 
-        log.debug(f'Existing Volume: {response}')
+        snapshot_id = snapshot['SnapshotId']
 
-        if response['Volumes']:
-            prev_volume = self.ec2_resource.Volume(
-                response['Volumes'][0]['VolumeId'])
+        # The next instance finds the snapshot through the volume it was taken of
+        self.ec2_client.create_tags(
+            Resources=[self.volume.volume_id],
+            Tags=[{'Key': FINAL_SNAPSHOT_TAG, 'Value': snapshot_id}]
+        )
+
+        self.status = 'Not Attached'
+
+        return snapshot_id
+
+    def create_standby_snapshot(self):
+        snapshot = self.ec2_client.create_snapshot(
+            VolumeId=self.volume.volume_id,
+            Description='Standby snapshot for SEBS.',
+            TagSpecifications=[
+                {
+                    'ResourceType': 'snapshot',
+                    'Tags': [
+                        {
+                            'Key': self.tag_name,
+                            'Value': self.device_name
+                        },
+                        {
+                            'Key': STANDBY_TAG,
+                            'Value': self.standby_key()
+                        },
+                    ]
+                },
+            ]
+        )
+
+        return snapshot['SnapshotId']
+
+    def standby_snapshots(self):
+        # Oldest first
+        snapshots = []
+        paginator = self.ec2_client.get_paginator('describe_snapshots')
+
+        for page in paginator.paginate(OwnerIds=['self'], Filters=[
+            {'Name': f'tag:{STANDBY_TAG}', 'Values': [self.standby_key()]},
+        ]):
+            snapshots.extend(page['Snapshots'])
+
+        return sorted(snapshots, key=lambda snapshot: snapshot['StartTime'])
+
+    def can_reuse_standby(self):
+        # A volume still attached somewhere may have newer data so it always
+        # gets a final snapshot, and one that already has a final snapshot
+        # has everything that was written to it.
+        return not (self.snapshot_id or self.reuse_snapshot is None or self.volume.attachments
+                    or FINAL_SNAPSHOT_TAG in self.volume.tags)
+
+    def latest_standby_snapshot(self):
+        if not self.can_reuse_standby():
+            return None
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+
+        for snapshot in reversed(self.standby_snapshots()):
+            if snapshot['State'] != 'completed':
+                continue
+
+            age = (now - snapshot['StartTime']).total_seconds()
+
+            if age > self.reuse_snapshot:
+                break
 
             log.info(
-                f'Detaching curent Volume {prev_volume.volume_id} attached to {self.instance_id}')
+                f"Restoring {self.device_name} from standby snapshot {snapshot['SnapshotId']} taken {age:.0f}s ago")
+
+            return snapshot['SnapshotId']
+
+        return None
+
+    def standby_key(self):
+        return f'{self.tag_name}:{self.device_name}'
 
-            prev_volume.detach_from_instance(
+    def standby_volumes(self, target_az):
+        return self.get_inventory().describe_volumes([
+            {'Name': f'tag:{STANDBY_VOLUME_TAG}', 'Values': [self.standby_key()]},
+            {'Name': 'availability-zone', 'Values': [target_az]},
+        ])
+
+    def create_standby_volume(self, target_az, snapshot):
+        response = self.ec2_client.create_volume(
+            AvailabilityZone=target_az,
+            SnapshotId=snapshot['SnapshotId'],
+            TagSpecifications=[
+                {
+                    'ResourceType': 'volume',
+                    'Tags': [
+                        {
+                            'Key': STANDBY_VOLUME_TAG,
+                            'Value': self.standby_key(),
+                        },
+                        {
+                            'Key': STANDBY_SNAPSHOT_TAG,
+                            'Value': snapshot['SnapshotId'],
+                        },
+                        {
+                            'Key': STANDBY_TIME_TAG,
+                            'Value': str(int(snapshot['StartTime'].timestamp())),
+                        },
+                    ]
+                },
+            ],
+            **self.volume_settings()
+        )
+
+        return response['VolumeId']
+
+    def promote_standby_volume(self, target_az):
+        # Same rules as restoring from a standby snapshot
+        if not self.can_reuse_standby():
+            return False
+
+        started = time.monotonic()
+        now = time.time()
+        candidates = []
+
+        for volume in self.standby_volumes(target_az):
+            tags = {tag['Key']: tag['Value'] for tag in volume.get('Tags', [])}
+
+            if volume['State'] != 'available' or STANDBY_TIME_TAG not in tags:
+                continue
+
+            candidates.append((now - int(tags[STANDBY_TIME_TAG]), volume))
+
+        if not candidates:
+            return False
+
+        age, standby = min(candidates, key=lambda candidate: candidate[0])
+
+        if age > self.reuse_snapshot:
+            log.info(
+                f"Standby volume {standby['VolumeId']} for {self.device_name} is {age:.0f}s old, copying instead")
+            return False
+
+        log.info(
+            f"Promoting standby volume {standby['VolumeId']} for {self.device_name} made from a snapshot {age:.0f}s old")
+
+        # Give it the control tag first so the device is never left without one
+        self.ec2_client.create_tags(
+            Resources=[standby['VolumeId']],
+            Tags=[{'Key': self.tag_name, 'Value': self.device_name},
+                  {'Key': RESTORED_FROM_TAG, 'Value': self.volume.volume_id}]
+        )
+
+        self.ec2_client.delete_tags(
+            Resources=[standby['VolumeId']],
+            Tags=[{'Key': STANDBY_VOLUME_TAG}, {'Key': STANDBY_SNAPSHOT_TAG},
+                  {'Key': STANDBY_TIME_TAG}]
+        )
+
+        prev_volume = self.volume
+
+        self.volume = VolumeRecord(standby)
+        self.copied = True
+
+        self.cleanup.add(f'delete old volume {prev_volume.volume_id}',
+                         self.ec2_client.delete_volume,
+                         VolumeId=prev_volume.volume_id)
+
+        self.record('promote', started)
+
+        return True
+
+    def enable_fast_restore(self, snapshot_id, target_az):
+        # Fast restore only speeds things up, so if it can't be enabled we
+        # carry on with a normal restore instead of failing the copy.
+        log.info(
+            f'Enabling fast snapshot restore for {snapshot_id} in {target_az}')
+        started = time.monotonic()
+
+        # A missing permission or the account's fast restore limit
+        try:
+            response = self.ec2_client.enable_fast_snapshot_restores(
+                AvailabilityZones=[target_az],
+                SourceSnapshotIds=[snapshot_id]
+            )
+        except:
+            t, v, _tb = sys.exc_info()
+            log.warning(
+                f'Could not enable fast snapshot restore for {snapshot_id}: {t.__name__}: {v}')
+            return False
+
+        failures = response.get('Unsuccessful', [])
+
+        if failures:
+            for failure in failures:
+                for error in failure.get('FastSnapshotRestoreStateErrors', []):
+                    log.warning(
+                        f"Could not enable fast snapshot restore for {snapshot_id}: {error['Error']['Message']}")
+
+            return False
+
+        def check():
+            response = self.ec2_client.describe_fast_snapshot_restores(
+                Filters=[
+                    {
+                        'Name': 'snapshot-id',
+                        'Values': [snapshot_id]
+                    },
+                    {
+                        'Name': 'availability-zone',
+                        'Values': [target_az]
+                    },
+                ]
+            )
+
+            states = [restore['State']
+                      for restore in response['FastSnapshotRestores']]
+
+            if 'disabling' in states or 'disabled' in states:
+                raise WaitFailed(
+                    f'Fast snapshot restore for {snapshot_id} was disabled')
+
+            return 'enabled' in states
+
+        try:
+            self.waiter.poller.wait(
+                check, f'fast snapshot restore of {snapshot_id} in {target_az}')
+        except (WaitFailed, WaitTimeout) as e:
+            log.warning(f'Restoring without fast snapshot restore: {e}')
+
+            try:
+                self.disable_fast_restore(snapshot_id, target_az)
+            except:
+                t, v, _tb = sys.exc_info()
+                log.warning(
+                    f'Failed to disable fast snapshot restore for {snapshot_id}: {t.__name__}: {v}')
+
+            return False
+
+        log.info(
+            f'Fast snapshot restore for {snapshot_id} took {time.monotonic() - started:.1f}s')
+
+        return True
+
+    def disable_fast_restore(self, snapshot_id, target_az):
+        log.info(
+            f'Disabling fast snapshot restore for {snapshot_id} in {target_az}')
+
+        self.ec2_client.disable_fast_snapshot_restores(
+            AvailabilityZones=[target_az],
+            SourceSnapshotIds=[snapshot_id]
+        )
+
+    def volume_settings(self):
+        # Carry the size, performance and encryption of the current volume
+        # over to the copy, then apply any overrides for this device.
+        settings = {
+            'VolumeType': self.volume.volume_type,
+            'Size': self.volume.size,
+        }
+
+        # Provisioned performance only makes sense for the same volume type
+        if self.overrides.get('VolumeType', self.volume.volume_type) == self.volume.volume_type:
+            settings['Iops'] = self.volume.iops
+            settings['Throughput'] = self.volume.throughput
+
+        if self.volume.encrypted:
+            # Snapshots of encrypted volumes only restore to encrypted volumes
+            if self.overrides.get('Encrypted') is False:
+                raise ValueError(
+                    f'{self.volume.volume_id} is encrypted and can not be copied with encrypted=false')
+
+            settings['Encrypted'] = True
+            settings['KmsKeyId'] = self.volume.kms_key_id
+
+        if self.volume.multi_attach_enabled:
+            settings['MultiAttachEnabled'] = True
+
+        if self.init_rate:
+            settings['VolumeInitializationRate'] = self.init_rate
+
+        settings.update(self.overrides)
+
+        # Only these volume types accept the performance settings
+        if settings['VolumeType'] not in PROVISIONED_IOPS_TYPES:
+            settings.pop('Iops', None)
+
+        if settings['VolumeType'] not in PROVISIONED_THROUGHPUT_TYPES:
+            settings.pop('Throughput', None)
+
+        return {key: value for key, value in settings.items() if value is not None}
+
+    def detach_placeholder(self):
+        # Free up our device name by detaching the volume the instance launched with
+        if self.placeholder:
+            return self.placeholder
+
+        local_volume = self.get_inventory().attached_volume(self.device_name)
+
+        log.debug(f'Existing Volume: {local_volume}')
+
+        if not local_volume:
+            return None
+
+        started = time.monotonic()
+        placeholder = VolumeRecord(local_volume)
+
+        log.info(
+            f'Detaching curent Volume {placeholder.volume_id} attached to {self.instance_id}')
+
+        self.ec2_client.detach_volume(
+            Device=self.device_name,
+            InstanceId=self.instance_id,
+            VolumeId=placeholder.volume_id
+        )
+
+        log.info('Waiting on detachment.')
+
+        self.waiter.wait_for_volume(placeholder.volume_id, 'available')
+
+        self.placeholder = placeholder
+        self.record('detach', started, volume=placeholder.volume_id)
+
+        return self.placeholder
+
+    def reattach_placeholder(self):
+        if not self.placeholder:
+            return
+
+        log.info(
+            f'Reattaching launch Volume {self.placeholder.volume_id} to {self.device_name}')
+
+        try:
+            self.ec2_client.attach_volume(
                 Device=self.device_name,
-                InstanceId=self.instance_id
+                InstanceId=self.instance_id,
+                VolumeId=self.placeholder.volume_id
             )
 
-            waiter = self.ec2_client.get_waiter('volume_available')
+            self.waiter.wait_for_volume(self.placeholder.volume_id, 'in-use')
+            self.placeholder = None
+        except:
+            t, v, _tb = sys.exc_info()
+            log.error(
+                f'Failed to reattach {self.placeholder.volume_id}: {t.__name__}: {v}')
 
-            waiter.wait(VolumeIds=[prev_volume.volume_id])
+    def attach(self):
+        if self.status != 'Not Attached':
+            return self.status
+
+        log.info(f'Attaching {self.volume.volume_id} to {self.instance_id}')
 
-            log.info('Waiting on detachment and then deleting.')
+        # Need to find and delete any current volumes
+        placeholder = self.detach_placeholder()
 
-            prev_volume.delete()
+        started = time.monotonic()
 
         log.info(
             f'Attaching sebs {self.volume.volume_id} to {self.instance_id}')
 
-        self.volume.attach_to_instance(
+        self.ec2_client.attach_volume(
             Device=self.device_name,
-            InstanceId=self.instance_id
+            InstanceId=self.instance_id,
+            VolumeId=self.volume.volume_id
         )
 
-        waiter = self.ec2_client.get_waiter('volume_in_use')
-
-        waiter.wait(VolumeIds=[self.volume.volume_id])
+        self.waiter.wait_for_volume(self.volume.volume_id, 'in-use')
+        self.forget_source()
 
         self.status = 'Attached'
+        self.record('attach', started)
+        self.journal.clear(self.journal_key())
+
+        # Copies from an interrupted restore that we didn't need
+        for volume in self.interrupted:
+            self.discard(volume)
+
+        self.interrupted = []
+
+        # Once attached the volume can change so an old final snapshot is useless
+        final_id = self.volume.tags.get(FINAL_SNAPSHOT_TAG)
+
+        if final_id:
+            self.cleanup.add(f'delete final snapshot {final_id}',
+                             self.ec2_client.delete_snapshot,
+                             SnapshotId=final_id)
+            self.cleanup.add(f'untag {self.volume.volume_id}',
+                             self.ec2_client.delete_tags,
+                             Resources=[self.volume.volume_id],
+                             Tags=[{'Key': FINAL_SNAPSHOT_TAG}])
+
+        if placeholder:
+            self.cleanup.add(f'delete launch volume {placeholder.volume_id}',
+                             self.ec2_client.delete_volume,
+                             VolumeId=placeholder.volume_id)
 
         return self.status
@@ -0,0 +1,22 @@
+import os
+
+
+def write_atomic(path, text, sync=False):
+    # Writes next to the file and renames it over the old one, so readers
+    # never see half of it. Errors are left to the caller.
+    directory = os.path.dirname(path)
+
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    partial = f'{path}.{os.getpid()}.tmp'
+
+    with open(partial, 'w') as output:
+        output.write(text)
+
+        # Only needed for files that have to survive a crash
+        if sync:
+            output.flush()
+            os.fsync(output.fileno())
+
+    os.replace(partial, path)
@@ -0,0 +1,242 @@
+import sys
+import json
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from sebs.api import ApiClient
+from sebs.cleanup import CleanupQueue
+from sebs.cli import app_name
+from sebs.ec2 import StatefulVolume, VolumeInventory, ResourceWaiter, batches, Config
+from sebs.poller import Poller
+
+log = logging.getLogger('sebs')
+
+# DescribeAutoScalingGroups takes at most this many names per call
+GROUP_BATCH_SIZE = 50
+
+# Instances that belong to their group and may need volumes
+ACTIVE_STATES = ['Pending', 'Pending:Wait', 'Pending:Proceed', 'InService']
+
+
+def load_groups(path):
+    # A JSON list of {"asg": ..., "name": ..., "backup": [...]} entries
+    with open(path) as config:
+        groups = json.load(config)
+
+    if not isinstance(groups, list):
+        raise ValueError(f'{path} should contain a list of groups')
+
+    for group in groups:
+        if not group.get('asg') or not group.get('backup'):
+            raise ValueError(f'Every group in {path} needs an asg and backup devices')
+
+        group['name'] = app_name(group.get('name') or 'sebs')
+
+    names = [group['name'] for group in groups]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+
+    # Groups sharing a control tag would restore each other's volumes
+    if duplicates:
+        raise ValueError(f"Control tags used by more than one group: {', '.join(duplicates)}")
+
+    return groups
+
+
+class FleetInventory(VolumeInventory):
+    def __init__(self, ec2_client, instance_ids, tag_names):
+        # One search for every control tag and instance in the fleet instead
+        # of two per instance.
+        super().__init__(ec2_client, None, None)
+        self.instance_ids = instance_ids
+        self.tag_names = tag_names
+
+    def load(self):
+        log.info(
+            f'Searching for volumes of {len(self.tag_names)} control tags and {len(self.instance_ids)} instances')
+
+        self.tagged = {}
+        self.attached = {}
+
+        for batch in batches(self.tag_names):
+            for volume in self.describe_volumes([{'Name': 'tag-key', 'Values': batch}]):
+                for tag in volume.get('Tags', []):
+                    if tag['Key'] in batch:
+                        self.tagged.setdefault(
+                            (tag['Key'], tag['Value']), []).append(volume)
+
+        for batch in batches(self.instance_ids):
+            for volume in self.describe_volumes([{'Name': 'attachment.instance-id', 'Values': batch}]):
+                for attachment in volume.get('Attachments', []):
+                    self.attached[(attachment['InstanceId'],
+                                   attachment['Device'])] = volume
+
+        self.loaded = True
+
+    def view(self, instance_id, tag_name):
+        return InventoryView(self, instance_id, tag_name)
+
+
+class InventoryView:
+    # What a single instance and control tag see of the fleet inventory
+    def __init__(self, fleet, instance_id, tag_name):
+        self.fleet = fleet
+        self.instance_id = instance_id
+        self.tag_name = tag_name
+
+    def describe_volumes(self, filters):
+        return self.fleet.describe_volumes(filters)
+
+    def tagged_volumes(self, device_name):
+        if not self.fleet.loaded:
+            self.fleet.load()
+
+        return self.fleet.tagged.get((self.tag_name, device_name), [])
+
+    def attached_volume(self, device_name):
+        if not self.fleet.loaded:
+            self.fleet.load()
+
+        return self.fleet.attached.get((self.instance_id, device_name))
+
+
+class FleetController:
+    def __init__(self, session, groups, concurrency=20, max_pool_connections=None,
+                 tcp_keepalive=True, poller=None, fast_restore=False, init_rate=None,
+                 reuse_snapshot=None, limits=None):
+        # Each group is a dict with the asg, the control tag name and the
+        # devices to back up.
+        self.groups = groups
+        self.concurrency = concurrency
+        # One client and one waiter for the whole fleet so every pending
+        # volume and snapshot is polled together.
+        self.config = Config(max_pool_connections=max_pool_connections or concurrency,
+                             tcp_keepalive=tcp_keepalive,
+                             retries={'total_max_attempts': 1})
+        # Every instance shares the request rate limits of the process
+        self.ec2_client = ApiClient(session.client('ec2', config=self.config),
+                                    limits=limits)
+        self.autoscaling_client = ApiClient(
+            session.client('autoscaling', config=self.config), limits=limits)
+        self.waiter = ResourceWaiter(self.ec2_client, poller or Poller())
+        self.cleanup = CleanupQueue()
+        self.fast_restore = fast_restore
+        self.init_rate = init_rate
+        self.reuse_snapshot = reuse_snapshot
+
+    def find_instances(self):
+        names = [group['asg'] for group in self.groups]
+        found = {}
+        paginator = self.autoscaling_client.get_paginator(
+            'describe_auto_scaling_groups')
+
+        for start in range(0, len(names), GROUP_BATCH_SIZE):
+            batch = names[start:start + GROUP_BATCH_SIZE]
+
+            for page in paginator.paginate(AutoScalingGroupNames=batch):
+                for asg in page['AutoScalingGroups']:
+                    found[asg['AutoScalingGroupName']] = asg
+
+        targets = []
+
+        for group in self.groups:
+            asg = found.get(group['asg'])
+
+            if not asg:
+                log.warning(f"Could not find autoscaling group {group['asg']}")
+                continue
+
+            instances = [instance for instance in asg['Instances']
+                         if instance['LifecycleState'] in ACTIVE_STATES]
+
+            # Two instances would fight over the same volumes
+            if len(instances) > 1:
+                log.error(
+                    f"{group['asg']} has {len(instances)} instances, only single instance groups are managed")
+                continue
+
+            if instances:
+                targets.append((group, instances[0]['InstanceId'],
+                                instances[0]['AvailabilityZone']))
+
+        running = self.running_instances([target[1] for target in targets])
+
+        for group, instance_id, _az in targets:
+            if instance_id not in running:
+                log.info(f"Waiting on {instance_id} of {group['asg']} to be running")
+
+        return [target for target in targets if target[1] in running]
+
+    def running_instances(self, instance_ids):
+        running = set()
+        paginator = self.ec2_client.get_paginator('describe_instances')
+
+        for batch in batches(instance_ids):
+            for page in paginator.paginate(Filters=[
+                {'Name': 'instance-id', 'Values': batch},
+                {'Name': 'instance-state-name', 'Values': ['running']},
+            ]):
+                for reservation in page['Reservations']:
+                    for instance in reservation['Instances']:
+                        running.add(instance['InstanceId'])
+
+        return running
+
+    def run(self, interval=None):
+        while True:
+            results, cleanup_failed = self.reconcile()
+
+            if not interval:
+                return results, cleanup_failed
+
+            time.sleep(interval)
+
+    def reconcile(self):
+        targets = self.find_instances()
+
+        inventory = FleetInventory(self.ec2_client,
+                                   [target[1] for target in targets],
+                                   sorted({target[0]['name'] for target in targets}))
+
+        if targets:
+            inventory.load()
+
+        # Each instance is restored by a worker that mostly sleeps in the
+        # shared waiter, which polls for all of them at once
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            results = list(executor.map(lambda target: self.manage_instance(inventory, *target),
+                                        targets))
+
+        cleanup_failed = self.cleanup.run()
+
+        failed = [result for result in results if 'Failed' in result['devices'].values()]
+        log.info(
+            f'Managed {len(results)} instances, {len(failed)} with failed devices')
+        log.info(f'EC2 API usage: {self.ec2_client.summary()}')
+
+        return results, cleanup_failed
+
+    def manage_instance(self, inventory, group, instance_id, target_az):
+        view = inventory.view(instance_id, group['name'])
+        devices = {}
+
+        for device_name in group['backup']:
+            sv = StatefulVolume(self.ec2_client, instance_id, device_name, group['name'],
+                                inventory=view, waiter=self.waiter, cleanup=self.cleanup,
+                                fast_restore=self.fast_restore, init_rate=self.init_rate,
+                                reuse_snapshot=self.reuse_snapshot)
+
+            try:
+                sv.get_status()
+
+                # Copies and attached volumes already carry the control tag
+                if sv.status == 'Not Attached':
+                    sv.restore(target_az)
+            except:
+                t, v, _tb = sys.exc_info()
+                log.error(
+                    f'Failed to restore {device_name} of {instance_id}: {t.__name__}: {v}')
+                sv.status = 'Failed'
+
+            devices[device_name] = sv.status
+
+        return {'asg': group['asg'], 'instance_id': instance_id, 'devices': devices}
@@ -0,0 +1,131 @@
+import os
+import json
+import logging
+from sebs.cli import app_name
+from sebs.ec2 import Instance
+from sebs.lifecycle import LifecycleAction
+from sebs.poller import Poller, Deadline
+from sebs.timing import Timer, write_reports
+
+log = logging.getLogger('sebs')
+
+LAUNCHING = 'autoscaling:EC2_INSTANCE_LAUNCHING'
+
+# Seconds left for completing the lifecycle action before Lambda stops us
+SAFETY_MARGIN = 30
+
+
+def parse_event(event):
+    # EventBridge puts the lifecycle action in detail and SNS in a JSON message
+    if 'detail' in event:
+        return event['detail']
+
+    if 'Records' in event:
+        return json.loads(event['Records'][0]['Sns']['Message'])
+
+    return event
+
+
+def load_settings(action):
+    # The hook's notification metadata wins over the environment
+    metadata = action.get('NotificationMetadata') or '{}'
+    settings = json.loads(metadata) if isinstance(metadata, str) else metadata
+
+    if not settings.get('backup'):
+        settings['backup'] = [device for device in os.environ.get(
+            'SEBS_BACKUP', '').split(',') if device]
+
+    settings['name'] = app_name(
+        settings.get('name') or os.environ.get('SEBS_NAME', 'sebs'))
+
+    return settings
+
+
+def make_poller(context):
+    if context is None:
+        return Poller()
+
+    remaining = context.get_remaining_time_in_millis() / 1000 - SAFETY_MARGIN
+
+    return Poller(deadline=Deadline(max(remaining, 0)))
+
+
+def handler(event, context=None, session=None, poller=None):
+    action = parse_event(event)
+
+    if action.get('LifecycleTransition') != LAUNCHING:
+        log.info(f"Ignoring {action.get('LifecycleTransition')} event")
+        return {'status': 'Ignored'}
+
+    instance_id = action['EC2InstanceId']
+    settings = load_settings(action)
+
+    if not settings['backup']:
+        raise ValueError(
+            'No devices to restore, set backup in the hook metadata or SEBS_BACKUP')
+
+    log.info(f"Restoring {', '.join(settings['backup'])} for {instance_id}")
+
+    timer = Timer()
+    timer.tags['instance_id'] = instance_id
+
+    server = Instance(settings['name'],
+                      poller=poller or make_poller(context),
+                      fast_restore=settings.get('fast_restore', False),
+                      init_rate=settings.get('init_rate'),
+                      reuse_snapshot=settings.get('reuse_snapshot'),
+                      instance_id=instance_id,
+                      session=session,
+                      timer=timer)
+
+    lifecycle = LifecycleAction(server.autoscaling_client(),
+                                action['LifecycleHookName'],
+                                action['AutoScalingGroupName'],
+                                instance_id,
+                                token=action.get('LifecycleActionToken'))
+
+    lifecycle.start()
+    # The instance only goes in service once every device is attached
+    result = 'ABANDON'
+
+    try:
+        for device in settings['backup']:
+            server.add_stateful_device(device)
+
+        server.wait_until_running()
+
+        # Every device gets a worker, there is no boot to hold up
+        with timer.span('restore'):
+            failed = server.attach_stateful_volumes(
+                settings.get('parallel', len(settings['backup'])))
+
+        server.tag_stateful_volumes()
+
+        if all(sv.ready for sv in server.backup):
+            result = 'CONTINUE'
+
+        cleanup_failed = server.cleanup_resources()
+    finally:
+        lifecycle.stop()
+        # Nothing on the instance retries a device we couldn't attach, so the
+        # group replaces the instance instead of starting it without its data
+        lifecycle.complete(result)
+
+    log.info(f'EC2 API usage: {server.ec2_client.summary()}')
+
+    status = 'Ready' if result == 'CONTINUE' else 'Failed'
+    report = timer.report(status)
+
+    # Lambda sends embedded metrics printed to stdout on to CloudWatch
+    if settings.get('emf'):
+        write_reports(report, emf_path='-')
+
+    return {
+        'status': status,
+        'instance_id': instance_id,
+        'ready': [sv.device_name for sv in server.backup if sv.ready],
+        'failed': [sv.device_name for sv in failed],
+        'cleanup_failed': cleanup_failed,
+        'api': server.ec2_client.stats(),
+        'timings': report,
+    }
@@ -0,0 +1,161 @@
+import os
+import glob
+import mmap
+import time
+import logging
+import threading
+
+log = logging.getLogger('sebs')
+
+MiB = 1024 * 1024
+
+
+def find_device(device_name, volume_id, sys_root='/sys'):
+    # On Nitro instances the device shows up as NVMe with the volume id as
+    # its serial number instead of under the name it was attached as.
+    if os.path.exists(device_name):
+        return device_name
+
+    serial = volume_id.replace('-', '')
+
+    for path in glob.glob(os.path.join(sys_root, 'block', 'nvme*n*', 'device', 'serial')):
+        with open(path) as f:
+            if f.read().strip() == serial:
+                return os.path.join('/dev', path.split(os.sep)[-3])
+
+    return None
+
+
+class RateLimiter:
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        # Bytes per second shared by every reader
+        self.rate = rate
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.next_free = None
+
+    def acquire(self, size):
+        with self.lock:
+            now = self.clock()
+            start = now if self.next_free is None else max(now, self.next_free)
+            self.next_free = start + size / self.rate
+
+        if start > now:
+            self.sleep(start - now)
+
+
+class Hydrator:
+    def __init__(self, path, workers=8, block_size=MiB, rate=None, direct=True,
+                 progress_interval=10, clock=time.monotonic, sleep=time.sleep):
+        self.path = path
+        self.workers = workers
+        # Reads must be a multiple of the sector size for O_DIRECT
+        self.block_size = block_size
+        # Optional cap in MiB/s so hydration doesn't starve the application
+        self.limiter = RateLimiter(rate * MiB, clock, sleep) if rate else None
+        self.direct = direct
+        self.progress_interval = progress_interval
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.size = 0
+        self.next_offset = 0
+        self.bytes_read = 0
+        self.started = None
+        self.reported = None
+        self.errors = []
+
+    def open(self):
+        # O_DIRECT skips the page cache so we don't evict the app's data, but
+        # not every file system supports it.
+        if self.direct and hasattr(os, 'O_DIRECT') and hasattr(os, 'preadv'):
+            try:
+                return os.open(self.path, os.O_RDONLY | os.O_DIRECT), True
+            except OSError as e:
+                log.debug(f'Could not open {self.path} with O_DIRECT: {e}')
+
+        return os.open(self.path, os.O_RDONLY), False
+
+    def run(self):
+        fd, direct = self.open()
+
+        try:
+            self.size = os.lseek(fd, 0, os.SEEK_END)
+            self.started = self.reported = self.clock()
+
+            log.info(
+                f'Hydrating {self.path} ({self.size / MiB:.0f} MiB) with {self.workers} readers')
+
+            readers = [threading.Thread(target=self.read, args=(fd, direct))
+                       for _ in range(self.workers)]
+
+            for reader in readers:
+                reader.start()
+
+            for reader in readers:
+                reader.join()
+        finally:
+            os.close(fd)
+
+        if self.errors:
+            raise self.errors[0]
+
+        elapsed = self.clock() - self.started
+        log.info(
+            f'Hydrated {self.path} in {elapsed:.1f}s at {self.throughput(elapsed):.1f} MiB/s')
+
+        return self.bytes_read, elapsed
+
+    def next_block(self):
+        with self.lock:
+            if self.errors or self.next_offset >= self.size:
+                return None
+
+            offset = self.next_offset
+            self.next_offset += self.block_size
+
+            return offset
+
+    def read(self, fd, direct):
+        # An anonymous mmap is page aligned which is what O_DIRECT needs
+        buffer = mmap.mmap(-1, self.block_size) if direct else None
+
+        try:
+            while True:
+                offset = self.next_block()
+
+                if offset is None:
+                    return
+
+                if self.limiter:
+                    self.limiter.acquire(min(self.block_size, self.size - offset))
+
+                if direct:
+                    count = os.preadv(fd, [buffer], offset)
+                else:
+                    count = len(os.pread(fd, self.block_size, offset))
+
+                self.progress(count)
+        except OSError as e:
+            with self.lock:
+                self.errors.append(e)
+        finally:
+            if buffer:
+                buffer.close()
+
+    def progress(self, count):
+        with self.lock:
+            self.bytes_read += count
+            now = self.clock()
+
+            if now - self.reported < self.progress_interval:
+                return
+
+            self.reported = now
+            elapsed = now - self.started
+
+        log.info(
+            f'Hydrating {self.path}: {100 * self.bytes_read / self.size:.0f}% at {self.throughput(elapsed):.1f} MiB/s')
+
+    def throughput(self, elapsed):
+        return self.bytes_read / MiB / elapsed if elapsed else 0
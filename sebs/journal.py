@@ -0,0 +1,63 @@
+import sys
+import json
+import logging
+import threading
+from sebs.files import write_atomic
+
+log = logging.getLogger('sebs')
+
+# Kept on the root volume so it survives a reboot in the middle of a restore
+JOURNAL_PATH = '/var/lib/sebs/journal.json'
+
+
+class RestoreJournal:
+    def __init__(self, path=None):
+        # Remembers how far each device's restore got so a rerun can pick up
+        # where the last one stopped. Without a path it only lives in memory.
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = self.read()
+
+    def read(self):
+        if not self.path:
+            return {}
+
+        try:
+            with open(self.path) as journal:
+                entries = json.load(journal)
+
+            log.info(f'Loaded restore journal {self.path} with {len(entries)} entries')
+
+            return entries
+        except FileNotFoundError:
+            return {}
+        except:
+            t, v, _tb = sys.exc_info()
+            log.warning(f'Ignoring unreadable restore journal {self.path}: {t.__name__}: {v}')
+
+            return {}
+
+    def get(self, key):
+        with self.lock:
+            return dict(self.entries.get(key, {}))
+
+    def update(self, key, **fields):
+        with self.lock:
+            self.entries.setdefault(key, {}).update(fields)
+            self.write()
+
+    def clear(self, key):
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self.write()
+
+    def write(self):
+        if not self.path:
+            return
+
+        # The journal only saves work, failing to write it never fails a restore
+        try:
+            write_atomic(self.path, json.dumps(self.entries, indent=2), sync=True)
+        except:
+            t, v, _tb = sys.exc_info()
+            log.warning(f'Failed to write restore journal {self.path}: {t.__name__}: {v}')
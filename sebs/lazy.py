@@ -0,0 +1,35 @@
+import importlib
+
+
+class LazyImport:
+    # Stands in for a module, or something in a module, and only imports it
+    # the first time it is used. boto3 and friends take longer to import than
+    # most sebs commands take to run, so they are loaded when AWS is first
+    # called instead of when sebs starts.
+    def __init__(self, module, attribute=None):
+        self._module = module
+        self._attribute = attribute
+        self._target = None
+
+    def _load(self):
+        if self._target is None:
+            target = importlib.import_module(self._module)
+
+            if self._attribute:
+                target = getattr(target, self._attribute)
+
+            self._target = target
+
+        return self._target
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+    def __repr__(self):
+        name = f'{self._module}.{self._attribute}' if self._attribute else self._module
+        state = 'loaded' if self._target is not None else 'not loaded'
+
+        return f'<LazyImport {name} ({state})>'
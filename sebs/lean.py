@@ -0,0 +1,380 @@
+import os
+import hmac
+import queue
+import hashlib
+import logging
+import datetime
+import threading
+import http.client
+import urllib.parse
+import xml.etree.ElementTree as ElementTree
+from contextlib import contextmanager
+from sebs.metadata import MetadataClient
+
+log = logging.getLogger('sebs')
+
+EC2_API_VERSION = '2016-11-15'
+
+# The only EC2 actions sebs calls, anything else stays with boto3
+OPERATIONS = [
+    'describe_instances', 'describe_volumes', 'describe_snapshots',
+    'create_snapshot', 'create_snapshots', 'delete_snapshot',
+    'create_volume', 'delete_volume', 'attach_volume', 'detach_volume',
+    'create_tags', 'delete_tags', 'enable_fast_snapshot_restores',
+    'disable_fast_snapshot_restores', 'describe_fast_snapshot_restores',
+]
+
+# List parameters whose query name isn't the parameter without its s
+LIST_NAMES = {
+    'Resources': 'ResourceId',
+    'OwnerIds': 'Owner',
+}
+
+# Response elements whose boto3 name isn't just the element capitalized
+RESPONSE_NAMES = {
+    'reservationSet': 'Reservations',
+    'instancesSet': 'Instances',
+    'instanceState': 'State',
+    'volumeSet': 'Volumes',
+    'snapshotSet': 'Snapshots',
+    'attachmentSet': 'Attachments',
+    'tagSet': 'Tags',
+    'groupSet': 'Groups',
+    'blockDeviceMapping': 'BlockDeviceMappings',
+    'fastSnapshotRestoreSet': 'FastSnapshotRestores',
+    'fastSnapshotRestoreStateErrorSet': 'FastSnapshotRestoreStateErrors',
+    # Volumes, attachments and snapshots all call their state status
+    'status': 'State',
+}
+
+# Lists that are sent as an empty element when there is nothing in them
+LIST_ELEMENTS = ['blockDeviceMapping', 'successful', 'unsuccessful']
+
+# Response fields that are not strings in boto3
+INTEGER_FIELDS = ['Size', 'Iops', 'Throughput', 'VolumeSize', 'VolumeInitializationRate',
+                  'AmiLaunchIndex']
+BOOLEAN_FIELDS = ['Encrypted', 'MultiAttachEnabled', 'DeleteOnTermination', 'Return',
+                  'FastRestored', 'EbsOptimized']
+TIMESTAMP_FIELDS = ['CreateTime', 'StartTime', 'AttachTime', 'LaunchTime', 'EnablingTime',
+                    'OptimizingTime', 'EnabledTime', 'DisablingTime', 'DisabledTime']
+
+# Refresh credentials this long before they expire
+CREDENTIAL_MARGIN = datetime.timedelta(minutes=5)
+
+
+class LeanClientError(Exception):
+    # Looks enough like botocore's ClientError for error_code() and the logs
+    def __init__(self, code, message, operation, status=None):
+        super().__init__(
+            f'An error occurred ({code}) when calling the {operation} operation: {message}')
+        self.response = {'Error': {'Code': code, 'Message': message},
+                         'ResponseMetadata': {'HTTPStatusCode': status}}
+        self.operation_name = operation
+
+
+class LeanConnectionError(ConnectionError):
+    pass
+
+
+def action_name(operation):
+    return ''.join(part.capitalize() for part in operation.split('_'))
+
+
+def serialize(params, prefix=''):
+    # Flattens boto3 style parameters into EC2 query parameters,
+    # Filters=[{'Name': 'a', 'Values': ['b']}] becomes Filter.1.Name=a and
+    # Filter.1.Value.1=b
+    pairs = []
+
+    for key, value in params.items():
+        if isinstance(value, (list, tuple)):
+            name = LIST_NAMES.get(key, key[:-1] if key.endswith('s') else key)
+
+            for index, item in enumerate(value, 1):
+                pairs.extend(serialize_value(f'{prefix}{name}.{index}', item))
+        else:
+            pairs.extend(serialize_value(f'{prefix}{key}', value))
+
+    return pairs
+
+
+def serialize_value(name, value):
+    if isinstance(value, dict):
+        return serialize(value, f'{name}.')
+
+    if isinstance(value, bool):
+        return [(name, 'true' if value else 'false')]
+
+    return [(name, str(value))]
+
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def response_name(tag):
+    return RESPONSE_NAMES.get(tag, tag[:1].upper() + tag[1:])
+
+
+def parse_timestamp(value):
+    # AWS timestamps are always UTC
+    value = value[:-1] if value.endswith('Z') else value.replace('+00:00', '')
+    layout = '%Y-%m-%dT%H:%M:%S.%f' if '.' in value else '%Y-%m-%dT%H:%M:%S'
+
+    return datetime.datetime.strptime(value, layout).replace(tzinfo=datetime.timezone.utc)
+
+
+def convert(name, value):
+    if not isinstance(value, str):
+        return value
+
+    if name in INTEGER_FIELDS:
+        return int(value)
+
+    if name in BOOLEAN_FIELDS:
+        return value == 'true'
+
+    if name in TIMESTAMP_FIELDS:
+        return parse_timestamp(value)
+
+    return value
+
+
+def parse_element(element):
+    children = list(element)
+    tag = local_name(element.tag)
+
+    if children and all(local_name(child.tag) == 'item' for child in children):
+        return [parse_element(child) for child in children]
+
+    if children:
+        parsed = {}
+
+        for child in children:
+            name = response_name(local_name(child.tag))
+            parsed[name] = convert(name, parse_element(child))
+
+        return parsed
+
+    # An empty list looks the same as an empty string
+    if tag.endswith('Set') or tag in LIST_ELEMENTS:
+        return []
+
+    return element.text or ''
+
+
+def parse_response(body):
+    response = parse_element(ElementTree.fromstring(body))
+    response.pop('RequestId', None)
+
+    return response
+
+
+def parse_error(body, operation, status):
+    try:
+        root = ElementTree.fromstring(body)
+        error = next(element for element in root.iter() if local_name(element.tag) == 'Error')
+        fields = {local_name(child.tag): child.text for child in error}
+
+        return LeanClientError(fields.get('Code'), fields.get('Message'), operation, status)
+    except:
+        return LeanClientError(f'HTTP{status}', body[:200], operation, status)
+
+
+def hmac_sha256(key, message):
+    return hmac.new(key, message.encode(), hashlib.sha256).digest()
+
+
+def sign(credentials, region, service, host, body, now):
+    # Signature Version 4 for a form encoded POST to /
+    amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+    date = now.strftime('%Y%m%d')
+    headers = {
+        'content-type': 'application/x-www-form-urlencoded; charset=utf-8',
+        'host': host,
+        'x-amz-date': amz_date,
+    }
+
+    if credentials.token:
+        headers['x-amz-security-token'] = credentials.token
+
+    signed_headers = ';'.join(sorted(headers))
+    canonical_request = '\n'.join([
+        'POST',
+        '/',
+        '',
+        ''.join(f'{name}:{headers[name].strip()}\n' for name in sorted(headers)),
+        signed_headers,
+        hashlib.sha256(body.encode()).hexdigest(),
+    ])
+
+    scope = f'{date}/{region}/{service}/aws4_request'
+    string_to_sign = '\n'.join([
+        'AWS4-HMAC-SHA256',
+        amz_date,
+        scope,
+        hashlib.sha256(canonical_request.encode()).hexdigest(),
+    ])
+
+    key = f'AWS4{credentials.secret_key}'.encode()
+
+    for part in [date, region, service, 'aws4_request']:
+        key = hmac_sha256(key, part)
+
+    signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+    headers['authorization'] = (f'AWS4-HMAC-SHA256 Credential={credentials.access_key}/{scope}, '
+                                f'SignedHeaders={signed_headers}, Signature={signature}')
+
+    return headers
+
+
+class Credentials:
+    def __init__(self, access_key, secret_key, token=None, expires=None):
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.token = token
+        self.expires = expires
+
+
+class CredentialProvider:
+    def __init__(self, metadata=None, environ=None, now=None):
+        # Only the environment and the instance profile are supported, which
+        # is where credentials come from on an instance at boot.
+        self.metadata = metadata or MetadataClient()
+        self.environ = os.environ if environ is None else environ
+        self.now = now or (lambda: datetime.datetime.now(datetime.timezone.utc))
+        self.lock = threading.Lock()
+        self.credentials = None
+
+    def get(self):
+        with self.lock:
+            expires = self.credentials and self.credentials.expires
+
+            if not self.credentials or (expires and self.now() > expires - CREDENTIAL_MARGIN):
+                self.credentials = self.from_environment() or self.from_metadata()
+
+            return self.credentials
+
+    def from_environment(self):
+        if not self.environ.get('AWS_ACCESS_KEY_ID'):
+            return None
+
+        return Credentials(self.environ['AWS_ACCESS_KEY_ID'],
+                           self.environ['AWS_SECRET_ACCESS_KEY'],
+                           self.environ.get('AWS_SESSION_TOKEN'))
+
+    def from_metadata(self):
+        role, data = self.metadata.instance_profile()
+        expires = data.get('Expiration')
+
+        log.debug(f'Using instance profile credentials of {role}')
+
+        return Credentials(data['AccessKeyId'], data['SecretAccessKey'], data.get('Token'),
+                           parse_timestamp(expires) if expires else None)
+
+
+class ConnectionPool:
+    def __init__(self, endpoint, size=10, timeout=60):
+        # Keeps up to size idle keep-alive connections to the endpoint
+        parsed = urllib.parse.urlsplit(endpoint)
+        self.secure = parsed.scheme == 'https'
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.netloc = parsed.netloc
+        self.size = size
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        self.opened = 0
+
+    def new_connection(self):
+        connection_class = http.client.HTTPSConnection if self.secure else http.client.HTTPConnection
+        self.opened += 1
+
+        return connection_class(self.host, self.port, timeout=self.timeout)
+
+    @contextmanager
+    def connection(self, new=False):
+        # A connection that raised is closed instead of being kept
+        try:
+            if new:
+                raise queue.Empty()
+
+            connection, reused = self.idle.get_nowait(), True
+        except queue.Empty:
+            connection, reused = self.new_connection(), False
+
+        try:
+            yield connection, reused
+        except:
+            connection.close()
+            raise
+
+        if self.idle.qsize() < self.size:
+            self.idle.put(connection)
+        else:
+            connection.close()
+
+    def close(self):
+        while not self.idle.empty():
+            self.idle.get_nowait().close()
+
+
+class LeanEC2Client:
+    def __init__(self, region, credentials=None, endpoint=None, max_pool_connections=10,
+                 timeout=60, now=None):
+        # A small EC2 query API client for the calls sebs makes. It takes the
+        # same parameters and returns the same response shapes as the boto3
+        # client without loading boto3 or its service models.
+        self.region = region
+        self.credentials = credentials or CredentialProvider()
+        self.endpoint = endpoint or f'https://ec2.{region}.amazonaws.com'
+        self.pool = ConnectionPool(self.endpoint, max_pool_connections, timeout)
+        self.now = now or (lambda: datetime.datetime.now(datetime.timezone.utc))
+
+    def __getattr__(self, name):
+        if name not in OPERATIONS:
+            raise AttributeError(f'{type(self).__name__} does not support {name}')
+
+        return lambda **kwargs: self.call(name, **kwargs)
+
+    def call(self, operation, **params):
+        action = action_name(operation)
+        body = urllib.parse.urlencode(
+            [('Action', action), ('Version', EC2_API_VERSION)] + serialize(params))
+        headers = sign(self.credentials.get(), self.region, 'ec2',
+                       self.pool.netloc, body, self.now())
+        headers['user-agent'] = 'sebs-lean'
+
+        status, response_body = self.send(body, headers, action)
+
+        if status != 200:
+            raise parse_error(response_body, action, status)
+
+        return parse_response(response_body)
+
+    def send(self, body, headers, action):
+        for attempt in range(2):
+            reused = False
+
+            try:
+                with self.pool.connection(new=bool(attempt)) as (connection, reused):
+                    connection.request('POST', '/', body=body, headers=headers)
+                    response = connection.getresponse()
+                    return response.status, response.read().decode()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError) as e:
+                # The server closed an idle connection, which is safe to retry
+                # once on a new one since the request never arrived.
+                if reused and not attempt:
+                    log.debug(f'Reconnecting to {self.pool.netloc} for {action}')
+                    continue
+
+                error = e
+            except (OSError, http.client.HTTPException) as e:
+                error = e
+
+            raise LeanConnectionError(
+                f'{action} failed to reach {self.endpoint}: {type(error).__name__}: {error}') from error
+
+    def close(self):
+        self.pool.close()
@@ -0,0 +1,62 @@
+import sys
+import logging
+import threading
+
+log = logging.getLogger('sebs')
+
+
+class LifecycleAction:
+    def __init__(self, autoscaling_client, hook_name, group_name, instance_id, interval=60,
+                 token=None):
+        # Keeps the autoscaling group waiting on us until we complete the action
+        self.autoscaling_client = autoscaling_client
+        self.hook_name = hook_name
+        self.group_name = group_name
+        self.instance_id = instance_id
+        self.interval = interval
+        # Only set when we were told about the action through an event
+        self.token = token
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def params(self):
+        params = {
+            'LifecycleHookName': self.hook_name,
+            'AutoScalingGroupName': self.group_name,
+            'InstanceId': self.instance_id,
+        }
+
+        if self.token:
+            params['LifecycleActionToken'] = self.token
+
+        return params
+
+    def start(self):
+        log.info(
+            f'Sending lifecycle heartbeats for {self.hook_name} every {self.interval}s')
+
+        self.thread = threading.Thread(target=self.send_heartbeats, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+        if self.thread:
+            self.thread.join()
+
+    def send_heartbeats(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.autoscaling_client.record_lifecycle_action_heartbeat(
+                    **self.params())
+                log.debug(f'Sent lifecycle heartbeat for {self.instance_id}')
+            except:
+                t, v, _tb = sys.exc_info()
+                log.warning(
+                    f'Failed to send lifecycle heartbeat: {t.__name__}: {v}')
+
+    def complete(self, result='CONTINUE'):
+        log.info(f'Completing lifecycle action {self.hook_name} with {result}')
+
+        self.autoscaling_client.complete_lifecycle_action(
+            LifecycleActionResult=result, **self.params())
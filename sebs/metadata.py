@@ -0,0 +1,222 @@
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import threading
+import http.client
+import urllib.parse
+from sebs.files import write_atomic
+
+log = logging.getLogger('sebs')
+
+IMDS_ENDPOINT = 'http://169.254.169.254'
+
+# Seconds an IMDSv2 token is asked to live for, the most IMDS allows
+TOKEN_TTL = 21600
+
+# Seconds to wait on the metadata service, it answers in milliseconds on EC2
+METADATA_TIMEOUT = 1.0
+
+IDENTITY_PATH = 'dynamic/instance-identity/document'
+
+# Changes on every boot, so a cached identity never outlives the boot it was
+# read on even if the cache file ends up in an AMI
+BOOT_ID_PATH = '/proc/sys/kernel/random/boot_id'
+
+
+class MetadataError(Exception):
+    pass
+
+
+class MetadataTimeout(MetadataError):
+    # Connected but never answered
+    pass
+
+
+class MetadataClient:
+    def __init__(self, endpoint=None, timeout=METADATA_TIMEOUT, ttl=TOKEN_TTL, clock=time.monotonic):
+        # Talks IMDSv2 to the instance metadata service. The token is fetched
+        # once and used for every request until it is about to expire.
+        self.disabled = os.environ.get('AWS_EC2_METADATA_DISABLED', '').lower() == 'true'
+        endpoint = endpoint or os.environ.get(
+            'AWS_EC2_METADATA_SERVICE_ENDPOINT', IMDS_ENDPOINT)
+        parsed = urllib.parse.urlsplit(endpoint)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.timeout = timeout
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.cached_token = None
+        self.token_expires = 0
+        # Set once a token request goes unanswered, see token()
+        self.tokenless = False
+
+    def request(self, method, path, headers):
+        if self.disabled:
+            raise MetadataError('Instance metadata is disabled by AWS_EC2_METADATA_DISABLED')
+
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+        # Off EC2 nothing answers at all, so there is no point in retrying
+        try:
+            connection.connect()
+        except OSError as e:
+            connection.close()
+            raise MetadataError(f'Instance metadata is unreachable: {type(e).__name__}: {e}') from e
+
+        try:
+            connection.request(method, path, headers=headers)
+            response = connection.getresponse()
+            return response.status, response.read().decode()
+        except socket.timeout as e:
+            raise MetadataTimeout(f'Instance metadata did not answer {method} {path} '
+                                  f'within {self.timeout}s') from e
+        except (OSError, http.client.HTTPException) as e:
+            raise MetadataError(f'Instance metadata request failed: {type(e).__name__}: {e}') from e
+        finally:
+            connection.close()
+
+    def token(self, refresh=False):
+        with self.lock:
+            if self.tokenless:
+                return None
+
+            # Renew a minute early so a token never expires mid request
+            if refresh or not self.cached_token or self.clock() > self.token_expires - 60:
+                try:
+                    status, body = self.request(
+                        'PUT', '/latest/api/token',
+                        {'X-aws-ec2-metadata-token-ttl-seconds': str(self.ttl)})
+                except MetadataTimeout:
+                    # The token response is sent with the hop limit of the
+                    # instance, in a container one hop away it is dropped.
+                    # Carry on without a token like botocore does, which
+                    # works unless the instance requires IMDSv2.
+                    log.warning('No IMDSv2 token within the metadata timeout, '
+                                'the hop limit may be too low for a container. '
+                                'Falling back to IMDSv1.')
+                    self.tokenless = True
+                    return None
+
+                if status != 200:
+                    raise MetadataError(f'Failed to get an IMDSv2 token: HTTP {status}')
+
+                self.cached_token = body
+                self.token_expires = self.clock() + self.ttl
+
+            return self.cached_token
+
+    def get(self, path):
+        for refresh in [False, True]:
+            token = self.token(refresh)
+            headers = {'X-aws-ec2-metadata-token': token} if token else {}
+            status, body = self.request('GET', f'/latest/{path}', headers)
+
+            # The token was rejected, it may have expired early
+            if status == 401 and token and not refresh:
+                continue
+
+            if status == 401:
+                raise MetadataError(f'Failed to get {path} from instance metadata: HTTP 401, '
+                                    'IMDSv2 is required but no token could be had, '
+                                    'raise the hop limit of the instance')
+
+            if status != 200:
+                raise MetadataError(f'Failed to get {path} from instance metadata: HTTP {status}')
+
+            return body
+
+    def instance_profile(self):
+        # The role of the instance profile and its credentials document
+        role = self.get('meta-data/iam/security-credentials/').split()[0]
+
+        return role, json.loads(self.get(f'meta-data/iam/security-credentials/{role}'))
+
+
+def boot_id():
+    try:
+        with open(BOOT_ID_PATH) as boot:
+            return boot.read().strip()
+    except OSError:
+        return ''
+
+
+class InstanceMetadata:
+    def __init__(self, client=None, cache_path=None):
+        # Everything sebs needs to know about the instance it runs on comes
+        # from the identity document, read once with one token and kept for
+        # the rest of the process. With a cache_path it is also kept on disk
+        # for the next run on the same boot.
+        self.client = client or MetadataClient()
+        self.cache_path = cache_path
+        self.lock = threading.Lock()
+        self.document = None
+
+    def identity(self):
+        with self.lock:
+            if self.document is None:
+                self.document = self.read_cache() or self.fetch()
+
+            return self.document
+
+    def fetch(self):
+        try:
+            document = json.loads(self.client.get(IDENTITY_PATH))
+        except ValueError as e:
+            raise MetadataError(f'Unreadable instance identity document: {e}') from e
+
+        self.write_cache(document)
+
+        return document
+
+    def read_cache(self):
+        if not self.cache_path:
+            return None
+
+        try:
+            with open(self.cache_path) as cached:
+                cache = json.load(cached)
+        except FileNotFoundError:
+            return None
+        except:
+            t, v, _tb = sys.exc_info()
+            log.warning(f'Ignoring unreadable metadata cache {self.cache_path}: {t.__name__}: {v}')
+            return None
+
+        if not isinstance(cache, dict) or cache.get('boot_id') != boot_id():
+            log.debug(f'Ignoring metadata cache {self.cache_path} from another boot')
+            return None
+
+        document = cache.get('document')
+
+        if not isinstance(document, dict) or \
+                not all(key in document for key in ['instanceId', 'region', 'availabilityZone']):
+            log.warning(f'Ignoring incomplete metadata cache {self.cache_path}')
+            return None
+
+        log.debug(f'Using cached instance metadata from {self.cache_path}')
+
+        return document
+
+    def write_cache(self, document):
+        # A cache that can't be written only costs the next run a request
+        if not self.cache_path:
+            return
+
+        try:
+            write_atomic(self.cache_path, json.dumps({'boot_id': boot_id(), 'document': document}))
+        except:
+            t, v, _tb = sys.exc_info()
+            log.warning(f'Failed to cache instance metadata in {self.cache_path}: {t.__name__}: {v}')
+
+    def instance_id(self):
+        return self.identity()['instanceId']
+
+    def region(self):
+        return self.identity()['region']
+
+    def availability_zone(self):
+        return self.identity()['availabilityZone']
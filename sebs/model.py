@@ -0,0 +1,187 @@
+import os
+import sys
+import json
+import hashlib
+import logging
+import threading
+import botocore
+import botocore.session
+import botocore.loaders
+import botocore.credentials
+import boto3.session
+from sebs.files import write_atomic
+from sebs.lean import OPERATIONS, action_name
+from sebs.metadata import MetadataError
+
+log = logging.getLogger('sebs')
+
+# Operations kept in the trimmed EC2 model, the same ones the lean client
+# knows. Anything else sebs would call must be added to both.
+EC2_OPERATIONS = [action_name(operation) for operation in OPERATIONS]
+
+# Keys that only hold documentation, most of the size of the model
+DOCUMENTATION_KEYS = ['documentation', 'documentationUrl']
+
+# Bump whenever the trimmers change what they keep, so old caches are rebuilt
+MODEL_FORMAT = 1
+
+
+def cache_directory():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+
+    return os.environ.get('SEBS_MODEL_CACHE') or os.path.join(base, 'sebs', 'models')
+
+
+def model_key():
+    # Part of the cache name so a cache built for other operations or by an
+    # older trimmer is never loaded
+    key = json.dumps([MODEL_FORMAT, sorted(EC2_OPERATIONS)])
+
+    return hashlib.sha256(key.encode()).hexdigest()[:12]
+
+
+def strip_documentation(value):
+    if isinstance(value, dict):
+        return {key: strip_documentation(item) for key, item in value.items()
+                if key not in DOCUMENTATION_KEYS}
+
+    if isinstance(value, list):
+        return [strip_documentation(item) for item in value]
+
+    return value
+
+
+def add_shape(shapes, name, found):
+    if name in found:
+        return
+
+    found.add(name)
+    shape = shapes[name]
+    refs = [shape.get('member'), shape.get('key'), shape.get('value')]
+    refs.extend(shape.get('members', {}).values())
+
+    for ref in refs:
+        if ref:
+            add_shape(shapes, ref['shape'], found)
+
+
+def trim_service_model(model, operations=None):
+    # Keeps the operations and every shape they can reach
+    kept = {name: model['operations'][name] for name in operations or EC2_OPERATIONS}
+    found = set()
+
+    for operation in kept.values():
+        refs = [operation.get('input'), operation.get('output')] + operation.get('errors', [])
+
+        for ref in refs:
+            if ref:
+                add_shape(model['shapes'], ref['shape'], found)
+
+    return strip_documentation({
+        'version': model.get('version'),
+        'metadata': model['metadata'],
+        'operations': kept,
+        'shapes': {name: model['shapes'][name] for name in sorted(found)},
+    })
+
+
+# Model types that are trimmed for EC2
+TRIMMERS = {
+    'service-2': trim_service_model,
+}
+
+
+class ModelLoader(botocore.loaders.Loader):
+    def __init__(self, cache_dir=None, **kwargs):
+        # Loads a trimmed EC2 model from a cache instead of parsing the full
+        # model on every start. The cache is built from the full model the
+        # first time and is keyed by the botocore version and the operations
+        # it keeps so an upgrade always builds a new one.
+        super().__init__(**kwargs)
+        self.cache_dir = cache_dir or cache_directory()
+        self.lock = threading.Lock()
+
+    def cache_path(self, type_name, api_version):
+        return os.path.join(self.cache_dir,
+                            f'ec2-{type_name}-{api_version}-botocore-{botocore.__version__}-{model_key()}.json')
+
+    def load_service_model(self, service_name, type_name, api_version=None):
+        if service_name != 'ec2' or type_name not in TRIMMERS:
+            return super().load_service_model(service_name, type_name, api_version)
+
+        api_version = api_version or self.determine_latest_version(service_name, type_name)
+        path = self.cache_path(type_name, api_version)
+
+        with self.lock:
+            try:
+                with open(path) as cached:
+                    return json.load(cached)
+            except FileNotFoundError:
+                pass
+            except:
+                t, v, _tb = sys.exc_info()
+                log.warning(f'Rebuilding unreadable model cache {path}: {t.__name__}: {v}')
+
+            model = TRIMMERS[type_name](
+                super().load_service_model(service_name, type_name, api_version))
+            self.write_cache(path, model)
+
+            return model
+
+    def write_cache(self, path, model):
+        # A cache that can't be written only costs the next run some time
+        try:
+            write_atomic(path, json.dumps(model, separators=(',', ':')))
+            log.debug(f'Cached the trimmed EC2 model in {path}')
+        except:
+            t, v, _tb = sys.exc_info()
+            log.warning(f'Failed to cache the EC2 model in {path}: {t.__name__}: {v}')
+
+
+class MetadataCredentialProvider(botocore.credentials.CredentialProvider):
+    # Takes the place of botocore's instance profile provider so credentials
+    # are read with the token sebs already has instead of a new one
+    METHOD = 'sebs-iam-role'
+    CANONICAL_NAME = 'Ec2InstanceMetadata'
+
+    def __init__(self, metadata):
+        self.metadata = metadata
+
+    def load(self):
+        try:
+            credentials = self.fetch()
+        except MetadataError as e:
+            log.debug(f'No instance profile credentials: {e}')
+            return None
+
+        return botocore.credentials.RefreshableCredentials.create_from_metadata(
+            metadata=credentials, refresh_using=self.fetch, method=self.METHOD)
+
+    def fetch(self):
+        _role, data = self.metadata.instance_profile()
+
+        return {
+            'access_key': data['AccessKeyId'],
+            'secret_key': data['SecretAccessKey'],
+            'token': data['Token'],
+            'expiry_time': data['Expiration'],
+        }
+
+
+def make_session(region_name=None, cache_dir=None, metadata=None):
+    # A boto3 session whose EC2 clients use the trimmed model.
+    # Given a MetadataClient, instance profile credentials are read with it.
+    botocore_session = botocore.session.get_session()
+    # Honor AWS_DATA_PATH the same way botocore's own loader does
+    data_path = botocore_session.get_config_variable('data_path')
+    search_paths = [os.path.expanduser(os.path.expandvars(path))
+                    for path in data_path.split(os.pathsep)] if data_path else []
+    loader = ModelLoader(cache_dir=cache_dir, extra_search_paths=search_paths)
+    botocore_session.register_component('data_loader', loader)
+
+    if metadata:
+        resolver = botocore_session.get_component('credential_provider')
+        resolver.insert_before('iam-role', MetadataCredentialProvider(metadata))
+        resolver.remove('iam-role')
+
+    return boto3.session.Session(region_name=region_name, botocore_session=botocore_session)
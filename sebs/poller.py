@@ -0,0 +1,89 @@
+import time
+import random
+import logging
+
+log = logging.getLogger('sebs')
+
+
+class WaitTimeout(Exception):
+    pass
+
+
+class WaitFailed(Exception):
+    pass
+
+
+class Deadline:
+    def __init__(self, timeout=None, clock=time.monotonic):
+        self.clock = clock
+        self.timeout = timeout
+        self.expires = None if timeout is None else clock() + timeout
+
+    def remaining(self):
+        if self.expires is None:
+            return None
+
+        return self.expires - self.clock()
+
+    def expired(self):
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+
+class Poller:
+    def __init__(self, initial_interval=1, max_interval=15, backoff=1.5,
+                 jitter=0.2, timeout=1800, deadline=None,
+                 clock=time.monotonic, sleep=time.sleep, rand=random.random):
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        # How long a single wait may take
+        self.timeout = timeout
+        # How long the whole run may take, shared by every wait
+        self.deadline = deadline or Deadline(clock=clock)
+        self.clock = clock
+        self.sleep = sleep
+        self.rand = rand
+
+    def remaining(self, operation):
+        remaining = [r for r in [operation.remaining(), self.deadline.remaining()]
+                     if r is not None]
+
+        return min(remaining) if remaining else None
+
+    def delay(self, interval):
+        # Spread the polls out so parallel waiters don't call the API in lock step
+        return interval * (1 + self.jitter * (2 * self.rand() - 1))
+
+    def wait(self, check, description, timeout=None):
+        operation = Deadline(self.timeout if timeout is None else timeout,
+                             self.clock)
+        interval = self.initial_interval
+        start = self.clock()
+        attempts = 0
+
+        while True:
+            attempts += 1
+
+            if check():
+                log.debug(
+                    f'Finished waiting for {description} after {attempts} checks in {self.clock() - start:.1f}s')
+                return attempts
+
+            remaining = self.remaining(operation)
+
+            if remaining is not None and remaining <= 0:
+                reason = 'run deadline' if self.deadline.expired() else 'timeout'
+                raise WaitTimeout(
+                    f'Gave up waiting for {description} after {self.clock() - start:.1f}s ({reason})')
+
+            delay = self.delay(interval)
+
+            if remaining is not None:
+                delay = min(delay, remaining)
+
+            log.debug(f'Waiting {delay:.1f}s for {description}')
+            self.sleep(delay)
+
+            interval = min(interval * self.backoff, self.max_interval)
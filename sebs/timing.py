@@ -0,0 +1,180 @@
+import sys
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from sebs.files import write_atomic
+
+log = logging.getLogger('sebs')
+
+
+class Timer:
+    def __init__(self, clock=time.monotonic, wall=time.time):
+        # Collects a span for every phase of a run so the run can be reported
+        # on once it is over.
+        self.clock = clock
+        self.wall = wall
+        self.started = clock()
+        self.started_at = wall()
+        # Tags that apply to the whole run, like the instance id
+        self.tags = {}
+        self.spans = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **tags):
+        started = self.clock()
+        error = None
+
+        try:
+            yield
+        except BaseException as e:
+            error = f'{type(e).__name__}: {e}'
+            raise
+        finally:
+            self.add(name, started, self.clock(), error=error, **tags)
+
+    def add(self, name, started, ended, error=None, **tags):
+        span = {
+            'name': name,
+            'start': round(started - self.started, 3),
+            'duration': round(ended - started, 3),
+            'tags': {key: value for key, value in tags.items() if value is not None},
+        }
+
+        if error:
+            span['error'] = error
+
+        with self.lock:
+            self.spans.append(span)
+
+    def report(self, status):
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span: span['start'])
+
+        return {
+            'status': status,
+            'started': self.started_at,
+            'duration': round(self.clock() - self.started, 3),
+            'tags': dict(self.tags),
+            'spans': spans,
+        }
+
+
+def phase_durations(report):
+    # Total seconds of each phase and device, a phase can run more than once
+    durations = {}
+
+    for span in report['spans']:
+        key = (span['name'], span['tags'].get('device', ''))
+        durations[key] = round(durations.get(key, 0) + span['duration'], 3)
+
+    return durations
+
+
+def label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text(report):
+    ready = 1 if report['status'] == 'Ready' else 0
+    lines = [
+        '# HELP sebs_phase_duration_seconds Seconds spent in each phase of the last sebs run.',
+        '# TYPE sebs_phase_duration_seconds gauge',
+    ]
+
+    for (phase, device), duration in sorted(phase_durations(report).items()):
+        lines.append(
+            f'sebs_phase_duration_seconds{{phase="{label(phase)}",device="{label(device)}"}} {duration}')
+
+    lines.extend([
+        '# HELP sebs_run_duration_seconds Seconds the last sebs run took.',
+        '# TYPE sebs_run_duration_seconds gauge',
+        f"sebs_run_duration_seconds {report['duration']}",
+        '# HELP sebs_run_success Whether every device of the last sebs run is ready.',
+        '# TYPE sebs_run_success gauge',
+        f'sebs_run_success {ready}',
+        '# HELP sebs_run_timestamp_seconds When the last sebs run started.',
+        '# TYPE sebs_run_timestamp_seconds gauge',
+        f"sebs_run_timestamp_seconds {report['started']}",
+    ])
+
+    return '\n'.join(lines) + '\n'
+
+
+def emf_lines(report, namespace='sebs'):
+    # One CloudWatch embedded metric document per phase with the phase as the
+    # only dimension, devices and ids stay properties to keep cardinality low.
+    timestamp = int(report['started'] * 1000)
+    documents = []
+
+    for (phase, device), duration in sorted(phase_durations(report).items()):
+        documents.append({
+            '_aws': {
+                'Timestamp': timestamp,
+                'CloudWatchMetrics': [{
+                    'Namespace': namespace,
+                    'Dimensions': [['Phase']],
+                    'Metrics': [{'Name': 'PhaseDuration', 'Unit': 'Seconds'}],
+                }],
+            },
+            'Phase': phase,
+            'Device': device,
+            'PhaseDuration': duration,
+            **report['tags'],
+        })
+
+    documents.append({
+        '_aws': {
+            'Timestamp': timestamp,
+            'CloudWatchMetrics': [{
+                'Namespace': namespace,
+                'Dimensions': [[]],
+                'Metrics': [{'Name': 'RunDuration', 'Unit': 'Seconds'},
+                            {'Name': 'RunFailed', 'Unit': 'Count'}],
+            }],
+        },
+        'RunDuration': report['duration'],
+        'RunFailed': 0 if report['status'] == 'Ready' else 1,
+        'Status': report['status'],
+        **report['tags'],
+    })
+
+    return [json.dumps(document, default=str) for document in documents]
+
+
+def write_output(path, text, append=False):
+    if path == '-':
+        sys.stdout.write(text)
+        sys.stdout.flush()
+        return
+
+    # Log files tailed by an agent are only ever added to
+    if append:
+        with open(path, 'a') as output:
+            output.write(text)
+
+        return
+
+    write_atomic(path, text)
+
+
+def write_reports(report, json_path=None, prometheus_path=None, emf_path=None):
+    outputs = [
+        (json_path, lambda: json.dumps(report, indent=2, default=str) + '\n', False),
+        (prometheus_path, lambda: prometheus_text(report), False),
+        (emf_path, lambda: '\n'.join(emf_lines(report)) + '\n', True),
+    ]
+
+    for path, render, append in outputs:
+        if not path:
+            continue
+
+        # A report that can't be written should never fail the run
+        try:
+            write_output(path, render(), append)
+            log.info(f'Wrote run report to {path}')
+        except:
+            t, v, _tb = sys.exc_info()
+            log.warning(f'Failed to write run report to {path}: {t.__name__}: {v}')
@@ -36,15 +36,13 @@ setuptools.setup(
         "Intended Audience :: Developers",
         "Intended Audience :: System Administrators",
         "Natural Language :: English",
-        "Programming Language :: Python :: 3.6",
         "Programming Language :: Python :: 3.7",
         "Programming Language :: Python :: 3.8",
     ],
     install_requires=[
-        'boto3',
-        'ec2-metadata',
+        'boto3 >= 1.26',
         'importlib-metadata ~= 1.0 ; python_version < "3.8"'
     ],
     scripts=['bin/sebs'],
-    python_requires='>=3.6',
+    python_requires='>=3.7',
 )
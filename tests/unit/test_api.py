@@ -0,0 +1,167 @@
+import logging
+import unittest
+from unittest.mock import MagicMock
+from botocore.exceptions import ClientError, EndpointConnectionError
+from sebs.api import ApiClient, TokenBucket, category
+from tests.unit.test_poller import FakeClock
+
+
+def client_error(code, operation='DescribeVolumes'):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, operation)
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(2, 3, clock=self.clock, sleep=self.clock.sleep)
+
+        delays = [bucket.take() for _ in range(5)]
+
+        # The burst is free, then each call waits for its own token
+        self.assertEqual(delays, [0, 0, 0, 0.5, 0.5])
+        self.assertEqual(self.clock.now, 1.0)
+
+    def test_refill(self):
+        bucket = TokenBucket(2, 3, clock=self.clock, sleep=self.clock.sleep)
+
+        for _ in range(3):
+            bucket.take()
+
+        self.clock.now += 10
+
+        self.assertEqual(bucket.take(), 0)
+        self.assertEqual(bucket.tokens, 2, 'Should never refill past capacity.')
+
+    def test_adaptive_rate(self):
+        bucket = TokenBucket(10, 10, clock=self.clock, sleep=self.clock.sleep)
+
+        bucket.throttled()
+
+        self.assertEqual(bucket.rate, 5)
+        self.assertEqual(bucket.tokens, 0, 'Should give up the burst.')
+
+        for _ in range(10):
+            bucket.throttled()
+
+        self.assertEqual(bucket.rate, 0.5, 'Should never stop calling.')
+
+        for _ in range(20):
+            bucket.succeeded()
+
+        self.assertEqual(bucket.rate, 10, 'Should recover the full rate.')
+
+
+class TestApiClient(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+        self.clock = FakeClock()
+        self.client = MagicMock(name='ec2')
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def make_api(self, **kwargs):
+        return ApiClient(self.client, clock=self.clock, sleep=self.clock.sleep,
+                         rand=lambda: 0.5, **kwargs)
+
+    def test_category(self):
+        self.assertEqual(category('describe_volumes'), 'describe')
+        self.assertEqual(category('get_paginator'), 'describe')
+        self.assertEqual(category('create_volume'), 'resource')
+        self.assertEqual(category('attach_volume'), 'resource')
+        self.assertEqual(category('create_tags'), 'mutate')
+        self.assertEqual(category('complete_lifecycle_action'), 'mutate')
+
+    def test_passes_calls_through(self):
+        api = self.make_api()
+        self.client.describe_volumes.return_value = {'Volumes': []}
+        self.client.exceptions = 'exceptions'
+
+        response = api.describe_volumes(Filters=[])
+
+        self.assertEqual(response, {'Volumes': []})
+        self.client.describe_volumes.assert_called_once_with(Filters=[])
+        self.assertEqual(api.exceptions, 'exceptions')
+        self.assertEqual(api.stats(), {'calls': 1, 'retries': 0, 'throttles': 0})
+
+    def test_retry_throttling(self):
+        api = self.make_api()
+        self.client.create_snapshot.side_effect = [
+            client_error('RequestLimitExceeded', 'CreateSnapshot'),
+            client_error('RequestLimitExceeded', 'CreateSnapshot'),
+            {'SnapshotId': 'sn-1234'},
+        ]
+
+        response = api.create_snapshot(VolumeId='vol-1234')
+
+        self.assertEqual(response, {'SnapshotId': 'sn-1234'})
+        self.assertEqual(api.stats(), {'calls': 3, 'retries': 2, 'throttles': 2})
+        self.assertEqual(api.throttles['create_snapshot'], 2)
+        # Each backoff is followed by a wait on the slowed down bucket
+        self.assertEqual(self.clock.sleeps, [0.5, 0.5, 1.0, 1.0])
+        # Halved twice and then recovering after the success
+        self.assertAlmostEqual(api.buckets['resource'].rate, 0.7)
+
+    def test_retry_transient(self):
+        api = self.make_api()
+        self.client.describe_volumes.side_effect = [
+            client_error('InternalError'),
+            EndpointConnectionError(endpoint_url='https://ec2'),
+            {'Volumes': []},
+        ]
+
+        self.assertEqual(api.describe_volumes(), {'Volumes': []})
+        self.assertEqual(api.stats(), {'calls': 3, 'retries': 2, 'throttles': 0})
+        self.assertEqual(api.buckets['describe'].rate, 20,
+                         'Should only slow down when throttled.')
+
+    def test_raise_other_errors(self):
+        api = self.make_api()
+        self.client.delete_volume.side_effect = client_error(
+            'InvalidVolume.NotFound', 'DeleteVolume')
+
+        with self.assertRaises(ClientError):
+            api.delete_volume(VolumeId='vol-1234')
+
+        self.assertEqual(api.stats(), {'calls': 1, 'retries': 0, 'throttles': 0})
+
+    def test_give_up(self):
+        api = self.make_api(attempts=3)
+        self.client.describe_volumes.side_effect = client_error('Throttling')
+
+        with self.assertRaises(ClientError):
+            api.describe_volumes()
+
+        self.assertEqual(api.stats(), {'calls': 3, 'retries': 2, 'throttles': 3})
+
+    def test_backoff_cap(self):
+        api = self.make_api(attempts=10, cap=4)
+        self.client.describe_volumes.side_effect = client_error('Throttling')
+
+        with self.assertRaises(ClientError):
+            api.describe_volumes()
+
+        backoff = [delay for delay in self.clock.sleeps if delay in (0.5, 1.0, 2.0)]
+        self.assertEqual(max(backoff), 2.0)
+
+    def test_paginate(self):
+        api = self.make_api()
+        self.client.describe_snapshots.side_effect = [
+            {'Snapshots': [1], 'NextToken': 'page-2'},
+            {'Snapshots': [2]},
+        ]
+
+        pages = list(api.get_paginator('describe_snapshots').paginate(OwnerIds=['self']))
+
+        self.assertEqual([page['Snapshots'] for page in pages], [[1], [2]])
+        self.client.describe_snapshots.assert_called_with(OwnerIds=['self'], NextToken='page-2')
+        self.assertEqual(api.stats()['calls'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
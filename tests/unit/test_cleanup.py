@@ -0,0 +1,78 @@
+import logging
+import unittest
+from botocore.exceptions import ClientError
+from sebs.cleanup import CleanupQueue
+from tests.unit.test_poller import FakeClock
+
+
+def client_error(code):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, 'DeleteVolume')
+
+
+class TestCleanupQueue(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+        self.clock = FakeClock()
+        self.calls = []
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def record(self, **kwargs):
+        self.calls.append(kwargs)
+
+    def test_runs_in_order(self):
+        queue = CleanupQueue(sleep=self.clock.sleep)
+
+        queue.add('delete volume', self.record, VolumeId='vol-1111')
+        queue.add('delete snapshot', self.record, SnapshotId='sn-12345')
+
+        self.assertEqual(self.calls, [], 'Should not run anything when added.')
+        self.assertEqual(queue.run(), [])
+        self.assertEqual(self.calls, [{'VolumeId': 'vol-1111'},
+                                      {'SnapshotId': 'sn-12345'}])
+        self.assertEqual(queue.tasks, [], 'Should empty the queue.')
+
+    def test_retries_with_backoff(self):
+        errors = [client_error('IncorrectState'), client_error('RequestLimitExceeded')]
+
+        def flaky(**kwargs):
+            if errors:
+                raise errors.pop(0)
+            self.record(**kwargs)
+
+        queue = CleanupQueue(attempts=3, delay=2, sleep=self.clock.sleep)
+        queue.add('delete snapshot', flaky, SnapshotId='sn-12345')
+
+        self.assertEqual(queue.run(), [])
+        self.assertEqual(self.clock.sleeps, [2, 4])
+        self.assertEqual(self.calls, [{'SnapshotId': 'sn-12345'}])
+
+    def test_gives_up(self):
+        def broken(**kwargs):
+            raise client_error('IncorrectState')
+
+        queue = CleanupQueue(attempts=2, sleep=self.clock.sleep)
+        queue.add('delete volume vol-1111', broken, VolumeId='vol-1111')
+        queue.add('delete snapshot', self.record, SnapshotId='sn-12345')
+
+        self.assertEqual(queue.run(), ['delete volume vol-1111'],
+                         'Should report the task that never finished.')
+        self.assertEqual(self.calls, [{'SnapshotId': 'sn-12345'}],
+                         'Should keep going after a failure.')
+
+    def test_already_gone(self):
+        def missing(**kwargs):
+            raise client_error('InvalidVolume.NotFound')
+
+        queue = CleanupQueue(sleep=self.clock.sleep)
+        queue.add('delete volume', missing, VolumeId='vol-1111')
+
+        self.assertEqual(queue.run(), [], 'A missing resource is already clean.')
+        self.assertEqual(self.clock.sleeps, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
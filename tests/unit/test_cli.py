@@ -46,6 +46,249 @@ class TestArugmentParsing(unittest.TestCase):
 
         self.assertEqual(args.name, 'not-default-sebs')
 
+    def test_default_parallel(self):
+        args = parse_args(['-b', 'test1'])
+
+        self.assertEqual(args.parallel, 1)
+
+    def test_parallel(self):
+        args = parse_args(['-b', 'test1', '-b', 'test2', '--parallel', '2'])
+
+        self.assertEqual(args.parallel, 2)
+
+    def test_invalid_parallel(self):
+        with patch('sys.stderr', new=StringIO()):
+            with self.assertRaises(SystemExit):
+                parse_args(['-b', 'test1', '-p', '0'])
+
+    def test_connection_options(self):
+        args = parse_args(['-b', 'test1'])
+
+        self.assertEqual(args.max_connections, 10)
+        self.assertTrue(args.keepalive)
+
+        args = parse_args(
+            ['-b', 'test1', '--max-connections', '4', '--no-keepalive'])
+
+        self.assertEqual(args.max_connections, 4)
+        self.assertFalse(args.keepalive)
+
+    def test_wait_options(self):
+        args = parse_args(['-b', 'test1'])
+
+        self.assertEqual(args.wait_timeout, 1800)
+        self.assertIsNone(args.deadline)
+
+        args = parse_args(
+            ['-b', 'test1', '--wait-timeout', '60', '--deadline', '300'])
+
+        self.assertEqual(args.wait_timeout, 60)
+        self.assertEqual(args.deadline, 300)
+
+    def test_no_overrides(self):
+        args = parse_args(['-b', 'test1'])
+
+        self.assertEqual(args.overrides, {})
+
+    def test_overrides(self):
+        args = parse_args(['-b', '/dev/xvdf', '-b', '/dev/xvdg',
+                           '-o', '/dev/xvdf:type=gp3,iops=16000',
+                           '--override', '/dev/xvdf:throughput=1000',
+                           '-o', '/dev/xvdg:encrypted=true,kms-key=alias/app,size=100'])
+
+        self.assertEqual(args.overrides, {
+            '/dev/xvdf': {'VolumeType': 'gp3', 'Iops': 16000, 'Throughput': 1000},
+            '/dev/xvdg': {'Encrypted': True, 'KmsKeyId': 'alias/app', 'Size': 100},
+        })
+
+    def test_invalid_overrides(self):
+        invalid = [
+            ['-b', '/dev/xvdf', '-o', '/dev/xvdf'],
+            ['-b', '/dev/xvdf', '-o', '/dev/xvdf:speed=fast'],
+            ['-b', '/dev/xvdf', '-o', '/dev/xvdf:iops=lots'],
+            ['-b', '/dev/xvdf', '-o', '/dev/xvdf:encrypted=yes'],
+            ['-b', '/dev/xvdf', '-o', '/dev/xvdf:multi-attach=1'],
+            ['-b', '/dev/xvdf', '-o', '/dev/xvdg:type=gp3'],
+        ]
+
+        for args in invalid:
+            with patch('sys.stderr', new=StringIO()):
+                with self.assertRaises(SystemExit, msg=args):
+                    parse_args(args)
+
+    def test_restore_options(self):
+        args = parse_args(['-b', 'test1'])
+
+        self.assertFalse(args.fast_restore)
+        self.assertIsNone(args.init_rate)
+
+        args = parse_args(['-b', 'test1', '--fast-restore'])
+
+        self.assertTrue(args.fast_restore)
+
+        args = parse_args(['-b', 'test1', '--init-rate', '300'])
+
+        self.assertEqual(args.init_rate, 300)
+
+        # Only one way of initializing a volume can be used
+        with patch('sys.stderr', new=StringIO()):
+            with self.assertRaises(SystemExit):
+                parse_args(['-b', 'test1', '--fast-restore',
+                            '--init-rate', '300'])
+
+    def test_hydrate_options(self):
+        args = parse_args(['-b', 'test1'])
+
+        self.assertFalse(args.hydrate)
+        self.assertEqual(args.hydrate_workers, 8)
+        self.assertIsNone(args.hydrate_rate)
+
+        args = parse_args(['-b', 'test1', '--hydrate', '--hydrate-workers', '16',
+                           '--hydrate-rate', '200'])
+
+        self.assertTrue(args.hydrate)
+        self.assertEqual(args.hydrate_workers, 16)
+        self.assertEqual(args.hydrate_rate, 200)
+
+    def test_reuse_snapshot(self):
+        args = parse_args(['-b', 'test1'])
+
+        self.assertEqual(args.command, 'restore')
+        self.assertIsNone(args.reuse_snapshot)
+
+        args = parse_args(['-b', 'test1', '--reuse-snapshot', '900'])
+
+        self.assertEqual(args.reuse_snapshot, 900)
+
+    def test_report_options(self):
+        args = parse_args(['-b', 'test1'])
+
+        self.assertIsNone(args.report)
+        self.assertIsNone(args.prometheus)
+        self.assertIsNone(args.emf)
+
+        args = parse_args(['-b', 'test1', '--report', '/var/log/sebs.json',
+                           '--prometheus', '/var/lib/node_exporter/sebs.prom', '--emf', '-'])
+
+        self.assertEqual(args.report, '/var/log/sebs.json')
+        self.assertEqual(args.prometheus, '/var/lib/node_exporter/sebs.prom')
+        self.assertEqual(args.emf, '-')
+
+    def test_journal_options(self):
+        args = parse_args(['-b', 'test1'])
+
+        self.assertEqual(args.journal, '/var/lib/sebs/journal.json')
+
+        args = parse_args(['-b', 'test1', '--journal', '/tmp/journal.json'])
+
+        self.assertEqual(args.journal, '/tmp/journal.json')
+
+        args = parse_args(['-b', 'test1', '--no-journal'])
+
+        self.assertIsNone(args.journal)
+
+    def test_metadata_options(self):
+        args = parse_args(['-b', 'test1'])
+
+        self.assertEqual(args.metadata_timeout, 1.0)
+        self.assertIsNone(args.metadata_cache)
+
+        args = parse_args(['on-terminate', '-b', 'test1', '--hook', 'drain',
+                           '--metadata-timeout', '0.5', '--metadata-cache', '/run/sebs/identity.json'])
+
+        self.assertEqual(args.metadata_timeout, 0.5)
+        self.assertEqual(args.metadata_cache, '/run/sebs/identity.json')
+
+        with patch('sys.stderr', new=StringIO()):
+            with self.assertRaises(SystemExit):
+                parse_args(['daemon', '-b', 'test1', '--metadata-timeout', '0'])
+
+    def test_daemon(self):
+        args = parse_args(['daemon', '-b', 'test1', '-n', 'app'])
+
+        self.assertEqual(args.command, 'daemon')
+        self.assertEqual(args.backup, ['test1'])
+        self.assertEqual(args.name, 'app-sebs')
+        self.assertEqual(args.interval, 3600)
+        self.assertEqual(args.retain, 3)
+
+        args = parse_args(['daemon', '-b', 'test1', '--interval', '600',
+                           '--retain', '6'])
+
+        self.assertEqual(args.interval, 600)
+        self.assertEqual(args.retain, 6)
+        self.assertEqual(args.standby_az, [])
+        self.assertFalse(args.standby_asg)
+
+        args = parse_args(['daemon', '-b', 'test1', '--standby-az', 'us-east-1b',
+                           '--standby-az', 'us-east-1c', '--standby-asg'])
+
+        self.assertEqual(args.standby_az, ['us-east-1b', 'us-east-1c'])
+        self.assertTrue(args.standby_asg)
+
+    def test_invalid_daemon(self):
+        invalid = [
+            ['daemon'],
+            ['daemon', '-b', 'test1', '--retain', '0'],
+            ['daemon', '-b', 'test1', '--interval', '0'],
+            ['daemon', '-b', 'test1', '--hydrate'],
+        ]
+
+        for args in invalid:
+            with patch('sys.stderr', new=StringIO()):
+                with self.assertRaises(SystemExit, msg=args):
+                    parse_args(args)
+
+    def test_on_terminate(self):
+        args = parse_args(['on-terminate', '-b', 'test1', '--hook', 'drain'])
+
+        self.assertEqual(args.command, 'on-terminate')
+        self.assertEqual(args.hook, 'drain')
+        self.assertIsNone(args.asg)
+        self.assertEqual(args.heartbeat, 60)
+
+        args = parse_args(['on-terminate', '-b', 'test1', '--hook', 'drain',
+                           '--asg', 'app-asg', '--heartbeat', '30'])
+
+        self.assertEqual(args.asg, 'app-asg')
+        self.assertEqual(args.heartbeat, 30)
+
+        # The hook can't be guessed
+        with patch('sys.stderr', new=StringIO()):
+            with self.assertRaises(SystemExit):
+                parse_args(['on-terminate', '-b', 'test1'])
+
+    def test_fleet(self):
+        args = parse_args(['fleet', '-c', 'groups.json'])
+
+        self.assertEqual(args.command, 'fleet')
+        self.assertEqual(args.config, 'groups.json')
+        self.assertEqual(args.concurrency, 20)
+        self.assertIsNone(args.interval)
+        self.assertIsNone(args.region)
+
+        args = parse_args(['fleet', '--config', 'groups.json', '--concurrency', '50',
+                           '--interval', '300', '--region', 'us-east-2',
+                           '--reuse-snapshot', '3600'])
+
+        self.assertEqual(args.concurrency, 50)
+        self.assertEqual(args.interval, 300)
+        self.assertEqual(args.region, 'us-east-2')
+        self.assertEqual(args.reuse_snapshot, 3600)
+
+    def test_invalid_fleet(self):
+        invalid = [
+            ['fleet'],
+            ['fleet', '-c', 'groups.json', '--concurrency', '0'],
+            ['fleet', '-c', 'groups.json', '--interval', '0'],
+            ['fleet', '-c', 'groups.json', '-b', 'test1'],
+        ]
+
+        for args in invalid:
+            with patch('sys.stderr', new=StringIO()):
+                with self.assertRaises(SystemExit, msg=args):
+                    parse_args(args)
+
     def test_verbose_level(self):
         args = parse_args(['-b', 'test1', '-b', 'test2', '-vvv'])
 
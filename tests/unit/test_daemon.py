@@ -0,0 +1,200 @@
+import logging
+import datetime
+import unittest
+from unittest.mock import MagicMock
+from sebs.daemon import SnapshotDaemon
+from sebs.ec2 import StatefulVolume, VolumeRecord
+from tests.unit.test_poller import FakeClock
+from tests.utils.fake_ec2 import FakeEC2
+
+
+def snapshot(snapshot_id, state, hour):
+    return {'SnapshotId': snapshot_id, 'State': state,
+            'StartTime': datetime.datetime(2020, 5, 1, hour, tzinfo=datetime.timezone.utc)}
+
+
+class TestSnapshotDaemon(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+        self.server = MagicMock(name='server')
+        self.volume = MagicMock(name='volume', status='Attached',
+                                device_name='/dev/xvdf')
+        self.volume.create_standby_snapshot.return_value = 'sn-new'
+        self.server.backup = [self.volume]
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_snapshot_and_prune(self):
+        self.volume.standby_snapshots.return_value = [
+            snapshot('sn-1', 'completed', 1),
+            snapshot('sn-2', 'error', 2),
+            snapshot('sn-3', 'completed', 3),
+            snapshot('sn-4', 'completed', 4),
+        ]
+
+        daemon = SnapshotDaemon(self.server, retain=2)
+        daemon.snapshot_volumes()
+
+        self.volume.create_standby_snapshot.assert_called_once()
+        # Only the oldest completed snapshot is past the retention
+        self.server.ec2_client.delete_snapshot.assert_called_once_with(
+            SnapshotId='sn-1')
+
+    def test_skip_pending(self):
+        self.volume.standby_snapshots.return_value = [
+            snapshot('sn-1', 'completed', 1),
+            snapshot('sn-2', 'pending', 2),
+        ]
+
+        daemon = SnapshotDaemon(self.server, retain=1)
+        daemon.snapshot_volumes()
+
+        self.volume.create_standby_snapshot.assert_not_called()
+        self.server.ec2_client.delete_snapshot.assert_not_called()
+
+    def test_skip_detached_and_failures(self):
+        detached = MagicMock(name='detached', status='Not Attached')
+        self.volume.standby_snapshots.side_effect = Exception('Throttled')
+        self.server.backup = [detached, self.volume]
+
+        daemon = SnapshotDaemon(self.server)
+        daemon.snapshot_volumes()
+
+        detached.standby_snapshots.assert_not_called()
+        self.volume.create_standby_snapshot.assert_not_called()
+
+    def test_run_interval(self):
+        clock = FakeClock()
+        self.volume.standby_snapshots.return_value = []
+
+        daemon = SnapshotDaemon(self.server, interval=60, clock=clock)
+        daemon.stopped = MagicMock(name='stopped')
+        daemon.stopped.is_set.return_value = False
+
+        def slow_snapshot():
+            clock.now += 15
+            return 'sn-new'
+
+        self.volume.create_standby_snapshot.side_effect = slow_snapshot
+
+        daemon.run(rounds=2)
+
+        self.assertEqual(self.volume.create_standby_snapshot.call_count, 2)
+        # Time spent snapshotting counts towards the interval
+        daemon.stopped.wait.assert_called_with(45)
+
+    def test_stop(self):
+        daemon = SnapshotDaemon(self.server)
+        daemon.stop()
+
+        daemon.run()
+
+        self.volume.standby_snapshots.assert_not_called()
+
+
+class TestStandbyVolumes(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+        self.hour = 0
+        self.ec2 = FakeEC2(clock=self.next_hour)
+        self.volume_id = self.ec2.add_volume('az-a', {'app-sebs': '/dev/xvdf'},
+                                             attached_to='i-1111', device='/dev/xvdf',
+                                             VolumeType='gp3', Iops=4000)
+
+        sv = StatefulVolume(self.ec2, 'i-1111', '/dev/xvdf', 'app-sebs')
+        sv.status = 'Attached'
+        sv.volume = VolumeRecord(self.ec2.volumes[self.volume_id])
+
+        self.server = MagicMock(name='server', ec2_client=self.ec2, backup=[sv])
+        self.daemon = SnapshotDaemon(self.server, retain=2,
+                                     standby_azs=['az-a', 'az-b', 'az-c'])
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def next_hour(self):
+        self.hour += 1
+        return datetime.datetime(2020, 5, 1, self.hour, tzinfo=datetime.timezone.utc)
+
+    def standby_volumes(self, az=None):
+        return {volume_id: volume for volume_id, volume in self.ec2.volumes.items()
+                if 'sebs:standby-volume' in self.ec2.tags(volume_id)
+                and az in (None, volume['AvailabilityZone'])}
+
+    def round(self):
+        self.daemon.snapshot_volumes()
+        self.ec2.finish()
+
+    def test_standby_lifecycle(self):
+        # Nothing to copy until the first snapshot completes
+        self.round()
+        self.assertEqual(self.standby_volumes(), {})
+
+        self.round()
+        first = self.standby_volumes()
+        first_snapshot = min(self.ec2.snapshots)
+
+        self.assertEqual(sorted(volume['AvailabilityZone'] for volume in first.values()),
+                         ['az-b', 'az-c'], 'Should not make a standby in our own AZ.')
+
+        for volume_id, volume in first.items():
+            tags = self.ec2.tags(volume_id)
+            self.assertEqual(tags['sebs:standby-volume'], 'app-sebs:/dev/xvdf')
+            self.assertEqual(tags['sebs:snapshot'], first_snapshot)
+            self.assertEqual(tags['sebs:snapshot-time'], str(int(
+                datetime.datetime(2020, 5, 1, 1, tzinfo=datetime.timezone.utc).timestamp())))
+            self.assertEqual(volume['SnapshotId'], first_snapshot)
+            self.assertEqual((volume['VolumeType'], volume['Iops']), ('gp3', 4000),
+                             'Should keep the settings of the volume.')
+            self.assertNotIn('app-sebs', tags,
+                             'A standby must never look like the stateful volume.')
+
+        # The old standby stays until its replacement is ready
+        self.round()
+        self.assertEqual(len(self.standby_volumes('az-b')), 2)
+
+        self.round()
+        remaining = self.standby_volumes('az-b')
+
+        self.assertEqual(len(remaining), 2)
+        self.assertFalse(set(first) & set(self.standby_volumes()),
+                         'Should replace standby volumes of older snapshots.')
+        self.assertLessEqual(len([snapshot for snapshot in self.ec2.snapshots.values()
+                                  if snapshot['State'] == 'completed']), 3)
+
+    def test_prunes_previous_volume(self):
+        # Left by the daemon on the instance before the device was restored
+        # onto a new volume in another AZ
+        old = [self.ec2.add_snapshot('vol-old', {'sebs:standby': 'app-sebs:/dev/xvdf'})
+               for _ in range(3)]
+
+        self.daemon.standby_azs = []
+
+        for _ in range(3):
+            self.round()
+
+        self.assertFalse(set(old) & set(self.ec2.snapshots),
+                         'Should prune the snapshots of the previous volume.')
+        self.assertEqual(len(self.ec2.snapshots), 3)
+
+    def test_standby_in_own_az(self):
+        # Left over after this device was restored into our AZ
+        leftover = self.ec2.add_volume('az-a', {'sebs:standby-volume': 'app-sebs:/dev/xvdf',
+                                                'sebs:snapshot-time': '0'})
+
+        self.daemon.standby_azs = ['az-a']
+        self.ec2.add_snapshot(self.volume_id, {'sebs:standby': 'app-sebs:/dev/xvdf'})
+
+        self.round()
+
+        self.assertNotIn(leftover, self.ec2.volumes)
+        self.assertEqual(self.standby_volumes(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+import os
+import json
+import logging
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+from botocore.exceptions import ClientError
+from sebs.fleet import FleetController, load_groups
+from sebs.poller import Poller
+from tests.unit.test_poller import FakeClock
+from tests.utils.fake_ec2 import FakeEC2, FakePaginator
+
+
+class FakeAutoScaling:
+
+    def __init__(self):
+        self.groups = {}
+        self.calls = []
+
+    def get_paginator(self, name):
+        return FakePaginator(getattr(self, name))
+
+    def add_group(self, name, *instances):
+        self.groups[name] = {'AutoScalingGroupName': name, 'Instances': [
+            {'InstanceId': instance_id, 'AvailabilityZone': az, 'LifecycleState': state}
+            for instance_id, az, state in instances]}
+
+    def describe_auto_scaling_groups(self, AutoScalingGroupNames):
+        self.calls.append(AutoScalingGroupNames)
+
+        return {'AutoScalingGroups': [self.groups[name] for name in AutoScalingGroupNames
+                                      if name in self.groups]}
+
+
+class FakeSession:
+
+    def __init__(self, ec2, autoscaling):
+        self.clients = {'ec2': ec2, 'autoscaling': autoscaling}
+
+    def client(self, name, config=None):
+        return self.clients[name]
+
+
+class TestFleetController(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+        self.ec2 = FakeEC2(auto_finish=True)
+        self.autoscaling = FakeAutoScaling()
+        self.session = FakeSession(self.ec2, self.autoscaling)
+
+        clock = FakeClock()
+        self.poller = Poller(clock=clock, sleep=clock.sleep)
+        self.groups = []
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def add_group(self, name, old_az, new_az, state='running', lifecycle='InService'):
+        # A replaced instance with its launch volume and the old tagged volume
+        instance_id = self.ec2.add_instance(new_az, state=state)
+        self.ec2.add_volume(new_az, attached_to=instance_id, device='/dev/xvdf')
+
+        if old_az:
+            self.ec2.add_volume(old_az, {f'{name}-sebs': '/dev/xvdf'})
+
+        self.autoscaling.add_group(f'{name}-asg', (instance_id, new_az, lifecycle))
+        self.groups.append({'asg': f'{name}-asg', 'name': f'{name}-sebs',
+                            'backup': ['/dev/xvdf']})
+
+        return instance_id
+
+    def reconcile(self, **kwargs):
+        controller = FleetController(self.session, self.groups, poller=self.poller, **kwargs)
+
+        return controller.run()
+
+    def attached_volume(self, instance_id):
+        return [volume for volume in self.ec2.volumes.values()
+                if volume['Attachments'] and volume['Attachments'][0]['InstanceId'] == instance_id]
+
+    def test_restore_groups(self):
+        moved = self.add_group('moved', 'az-a', 'az-b')
+        same = self.add_group('same', 'az-a', 'az-a')
+        new = self.add_group('new', None, 'az-a')
+
+        results, cleanup_failed = self.reconcile()
+
+        self.assertEqual(cleanup_failed, [])
+        self.assertEqual([result['devices'] for result in results],
+                         [{'/dev/xvdf': 'Attached'}] * 3)
+
+        for instance_id, name in [(moved, 'moved-sebs'), (same, 'same-sebs'), (new, 'new-sebs')]:
+            volumes = self.attached_volume(instance_id)
+
+            self.assertEqual(len(volumes), 1)
+            self.assertEqual(self.ec2.tags(volumes[0]['VolumeId'])[name], '/dev/xvdf')
+
+        # Only the attached volumes are left
+        self.assertEqual(len(self.ec2.volumes), 3)
+        self.assertEqual(self.ec2.snapshots, {})
+
+    def test_shared_inventory(self):
+        for index in range(30):
+            self.add_group(f'app{index}', 'az-a', 'az-a')
+
+        searches = []
+        describe_volumes = self.ec2.describe_volumes
+
+        def record(Filters=(), **kwargs):
+            searches.append(Filters[0]['Name'])
+            return describe_volumes(Filters=Filters, **kwargs)
+
+        self.ec2.describe_volumes = record
+
+        results, _cleanup_failed = self.reconcile(concurrency=5, limits={
+            'describe': (1000, 1000), 'mutate': (1000, 1000), 'resource': (1000, 1000)})
+
+        self.assertEqual(len(results), 30)
+        # One search for the control tags and one for the attachments, the
+        # rest are the shared waiter following the attachments
+        self.assertEqual(searches.count('tag-key'), 1)
+        self.assertEqual(searches.count('attachment.instance-id'), 1)
+        self.assertEqual(self.ec2.calls.count('DescribeInstances'), 1)
+        self.assertEqual(len(self.autoscaling.calls), 1)
+
+    def test_skip_groups(self):
+        crowded = self.ec2.add_instance('az-a')
+        self.autoscaling.add_group('crowded-asg', (crowded, 'az-a', 'InService'),
+                                   ('i-other', 'az-a', 'InService'))
+        self.groups.append({'asg': 'crowded-asg', 'name': 'crowded-sebs', 'backup': ['/dev/xvdf']})
+        self.groups.append({'asg': 'missing-asg', 'name': 'missing-sebs', 'backup': ['/dev/xvdf']})
+        booting = self.add_group('booting', 'az-a', 'az-b', state='pending')
+        leaving = self.add_group('leaving', 'az-a', 'az-b', lifecycle='Terminating')
+
+        results, _cleanup_failed = self.reconcile()
+
+        self.assertEqual(results, [])
+        self.assertNotIn('AttachVolume', self.ec2.calls)
+        self.assertEqual(len(self.attached_volume(booting)), 1)
+        self.assertEqual(len(self.attached_volume(leaving)), 1)
+
+    def test_failed_instance(self):
+        failing = self.add_group('failing', 'az-a', 'az-b')
+        working = self.add_group('working', 'az-a', 'az-a')
+
+        self.ec2.create_snapshot = MagicMock(side_effect=ClientError(
+            {'Error': {'Code': 'SnapshotLimitExceeded', 'Message': 'Too many'}}, 'CreateSnapshot'))
+
+        results, _cleanup_failed = self.reconcile()
+
+        self.assertEqual({result['instance_id']: result['devices']['/dev/xvdf'] for result in results},
+                         {failing: 'Failed', working: 'Attached'})
+        # The launch volume is put back on the failed instance
+        self.assertEqual(self.ec2.tags(self.attached_volume(failing)[0]['VolumeId']), {})
+
+
+class TestLoadGroups(unittest.TestCase):
+
+    def write(self, groups):
+        config = tempfile.NamedTemporaryFile('w', suffix='.json', delete=False)
+        self.addCleanup(os.remove, config.name)
+
+        with config:
+            json.dump(groups, config)
+
+        return config.name
+
+    def test_load_groups(self):
+        path = self.write([{'asg': 'db-asg', 'name': 'db', 'backup': ['/dev/xvdf']},
+                           {'asg': 'cache-asg', 'backup': ['/dev/xvdg']}])
+
+        groups = load_groups(path)
+
+        self.assertEqual([group['name'] for group in groups], ['db-sebs', 'sebs'])
+
+    def test_invalid_groups(self):
+        invalid = [
+            {'asg': 'db-asg'},
+            [{'asg': 'db-asg', 'name': 'db'}],
+            [{'asg': 'db-asg', 'name': 'db', 'backup': ['/dev/xvdf']},
+             {'asg': 'db2-asg', 'name': 'db-sebs', 'backup': ['/dev/xvdf']}],
+        ]
+
+        for groups in invalid:
+            with self.assertRaises(ValueError, msg=groups):
+                load_groups(self.write(groups))
+
+
+if __name__ == '__main__':
+    unittest.main()
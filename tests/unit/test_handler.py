@@ -0,0 +1,170 @@
+import json
+import logging
+import unittest
+from io import StringIO
+from unittest.mock import MagicMock, patch
+from sebs.handler import handler, parse_event
+from sebs.poller import Poller
+from tests.unit.test_poller import FakeClock
+from tests.utils.fake_ec2 import FakeEC2
+
+
+class FakeSession:
+
+    def __init__(self, ec2):
+        self.clients = {'ec2': ec2, 'autoscaling': MagicMock(name='autoscaling')}
+
+    def client(self, name, config=None):
+        return self.clients[name]
+
+
+def launch_event(instance_id, metadata=None):
+    if metadata is None:
+        metadata = {'backup': ['/dev/xvdf'], 'name': 'app'}
+
+    return {
+        'detail-type': 'EC2 Instance-launch Lifecycle Action',
+        'source': 'aws.autoscaling',
+        'detail': {
+            'LifecycleActionToken': 'token-1234',
+            'AutoScalingGroupName': 'app-asg',
+            'LifecycleHookName': 'restore',
+            'EC2InstanceId': instance_id,
+            'LifecycleTransition': 'autoscaling:EC2_INSTANCE_LAUNCHING',
+            'NotificationMetadata': json.dumps(metadata),
+        },
+    }
+
+
+class TestHandler(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+        self.ec2 = FakeEC2(auto_finish=True)
+        self.session = FakeSession(self.ec2)
+        self.autoscaling = self.session.clients['autoscaling']
+
+        clock = FakeClock()
+        self.poller = Poller(clock=clock, sleep=clock.sleep)
+
+        # The old instance is gone and left its volume in another AZ
+        self.old_volume = self.ec2.add_volume('az-a', {'app-sebs': '/dev/xvdf'})
+        self.instance_id = self.ec2.add_instance('az-b', state='pending')
+        self.placeholder = self.ec2.add_volume('az-b', attached_to=self.instance_id,
+                                               device='/dev/xvdf')
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def run_handler(self, event):
+        with patch('sebs.ec2.InstanceMetadata') as mock_metadata:
+            response = handler(event, session=self.session, poller=self.poller)
+
+        # Nothing may come from the metadata of the machine we run on
+        self.assertEqual(mock_metadata.return_value.mock_calls, [])
+
+        return response
+
+    def test_restore_while_booting(self):
+        response = self.run_handler(launch_event(self.instance_id))
+
+        self.assertEqual(response['status'], 'Ready')
+        self.assertEqual(response['ready'], ['/dev/xvdf'])
+
+        attached = [volume for volume in self.ec2.volumes.values()
+                    if volume['Attachments']]
+
+        self.assertEqual(len(attached), 1)
+        self.assertEqual(attached[0]['AvailabilityZone'], 'az-b')
+        self.assertEqual(attached[0]['Attachments'][0]['InstanceId'], self.instance_id)
+        self.assertEqual(self.ec2.tags(attached[0]['VolumeId'])['app-sebs'], '/dev/xvdf')
+
+        # The launch volume, old volume and intermediate snapshot are cleaned up
+        self.assertEqual(list(self.ec2.volumes), [attached[0]['VolumeId']])
+        self.assertEqual(self.ec2.snapshots, {})
+
+        self.autoscaling.complete_lifecycle_action.assert_called_once_with(
+            LifecycleHookName='restore', AutoScalingGroupName='app-asg',
+            InstanceId=self.instance_id, LifecycleActionToken='token-1234',
+            LifecycleActionResult='CONTINUE')
+
+        phases = {span['name'] for span in response['timings']['spans']}
+        self.assertTrue({'instance_load', 'wait_running', 'inventory', 'snapshot', 'create',
+                         'detach', 'attach', 'restore', 'tag', 'cleanup'} <= phases,
+                        'Should time every phase of the restore.')
+        self.assertEqual(response['timings']['tags'], {'instance_id': self.instance_id})
+
+    def test_embedded_metrics(self):
+        event = launch_event(self.instance_id, metadata={'backup': ['/dev/xvdf'], 'name': 'app', 'emf': True})
+
+        with patch('sys.stdout', new=StringIO()) as stdout:
+            self.run_handler(event)
+
+        documents = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertIn('attach', [document.get('Phase') for document in documents])
+        self.assertEqual(documents[-1]['RunFailed'], 0)
+
+    def test_same_az(self):
+        self.ec2.volumes[self.old_volume]['AvailabilityZone'] = 'az-b'
+
+        response = self.run_handler(launch_event(self.instance_id))
+
+        self.assertEqual(response['status'], 'Ready')
+        self.assertNotIn('CreateSnapshot', self.ec2.calls)
+        self.assertEqual(self.ec2.volumes[self.old_volume]['Attachments'][0]['InstanceId'],
+                         self.instance_id)
+
+    def test_terminated_instance(self):
+        self.ec2.instances[self.instance_id]['State']['Name'] = 'terminated'
+
+        with self.assertRaises(Exception):
+            self.run_handler(launch_event(self.instance_id))
+
+        # The group should never be left waiting on us
+        self.autoscaling.complete_lifecycle_action.assert_called_once_with(
+            LifecycleHookName='restore', AutoScalingGroupName='app-asg',
+            InstanceId=self.instance_id, LifecycleActionToken='token-1234',
+            LifecycleActionResult='ABANDON')
+
+    def test_failed_device(self):
+        # Nothing was ever attached at /dev/xvdg to restore from
+        event = launch_event(self.instance_id, metadata={'backup': ['/dev/xvdf', '/dev/xvdg'],
+                                                         'name': 'app'})
+
+        response = self.run_handler(event)
+
+        self.assertEqual(response['status'], 'Failed')
+        self.assertEqual(response['ready'], ['/dev/xvdf'])
+        self.autoscaling.complete_lifecycle_action.assert_called_once_with(
+            LifecycleHookName='restore', AutoScalingGroupName='app-asg',
+            InstanceId=self.instance_id, LifecycleActionToken='token-1234',
+            LifecycleActionResult='ABANDON')
+
+    def test_ignores_other_events(self):
+        event = launch_event(self.instance_id)
+        event['detail']['LifecycleTransition'] = 'autoscaling:EC2_INSTANCE_TERMINATING'
+
+        self.assertEqual(self.run_handler(event), {'status': 'Ignored'})
+        self.assertEqual(self.ec2.calls, [])
+
+    def test_settings_from_environment(self):
+        event = launch_event(self.instance_id, metadata={})
+
+        with patch.dict('os.environ', {'SEBS_BACKUP': '/dev/xvdf', 'SEBS_NAME': 'app'}):
+            response = self.run_handler(event)
+
+        self.assertEqual(response['ready'], ['/dev/xvdf'])
+
+        with self.assertRaises(ValueError):
+            self.run_handler(event)
+
+    def test_sns_event(self):
+        detail = launch_event(self.instance_id)['detail']
+        event = {'Records': [{'Sns': {'Message': json.dumps(detail)}}]}
+
+        self.assertEqual(parse_event(event), detail)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import os
+import logging
+import tempfile
+import unittest
+from sebs.hydrate import Hydrator, RateLimiter, find_device, MiB
+from tests.unit.test_poller import FakeClock
+
+
+class TestHydrator(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+        # A sparse file stands in for a freshly restored block device
+        self.tmp = tempfile.TemporaryDirectory()
+        self.device = os.path.join(self.tmp.name, 'xvdz')
+        self.size = 8 * MiB + 4096
+
+        with open(self.device, 'wb') as f:
+            f.truncate(self.size)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+        self.tmp.cleanup()
+
+    def test_reads_every_block(self):
+        hydrator = Hydrator(self.device, workers=4, direct=False)
+
+        bytes_read, _elapsed = hydrator.run()
+
+        self.assertEqual(bytes_read, self.size, 'Should read the whole device.')
+
+    def test_direct_reads(self):
+        # Falls back to normal reads if the file system lacks O_DIRECT
+        hydrator = Hydrator(self.device, workers=3, block_size=MiB)
+
+        bytes_read, _elapsed = hydrator.run()
+
+        self.assertEqual(bytes_read, self.size, 'Should read the whole device.')
+
+    def test_rate_limit(self):
+        clock = FakeClock()
+        hydrator = Hydrator(self.device, workers=1, rate=2, direct=False,
+                            clock=clock, sleep=clock.sleep)
+
+        hydrator.run()
+
+        # 8 MiB at 2 MiB/s with the first read free
+        self.assertAlmostEqual(clock.now, 4, places=2,
+                               msg='Should read no faster than the limit.')
+
+    def test_progress(self):
+        clock = FakeClock()
+        hydrator = Hydrator(self.device, workers=1, rate=1, direct=False,
+                            progress_interval=2, clock=clock, sleep=clock.sleep)
+
+        logging.disable(logging.NOTSET)
+
+        with self.assertLogs('sebs', level='INFO') as logs:
+            hydrator.run()
+
+        progress = [line for line in logs.output if '%' in line]
+
+        self.assertEqual(len(progress), 4, 'Should report every 2 seconds.')
+        self.assertIn('37% at 1.5 MiB/s', progress[0])
+
+    def test_missing_device(self):
+        hydrator = Hydrator(os.path.join(self.tmp.name, 'missing'))
+
+        with self.assertRaises(OSError):
+            hydrator.run()
+
+    def test_find_device(self):
+        self.assertEqual(find_device(self.device, 'vol-1234'), self.device,
+                         'Should use the device name when it exists.')
+
+        # Nitro instances expose the volume as an NVMe device
+        serial = os.path.join(self.tmp.name, 'block',
+                              'nvme1n1', 'device', 'serial')
+        os.makedirs(os.path.dirname(serial))
+
+        with open(serial, 'w') as f:
+            f.write('vol1234  \n')
+
+        self.assertEqual(find_device('/dev/sebs-missing', 'vol-1234', self.tmp.name),
+                         '/dev/nvme1n1')
+        self.assertIsNone(find_device(
+            '/dev/sebs-missing', 'vol-9999', self.tmp.name))
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_spaces_out_reads(self):
+        clock = FakeClock()
+        limiter = RateLimiter(100, clock, clock.sleep)
+
+        limiter.acquire(100)
+        limiter.acquire(100)
+        limiter.acquire(50)
+
+        self.assertEqual(clock.sleeps, [1, 1])
+        self.assertEqual(clock.now, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 import unittest
-from sebs.ec2 import Instance
-from unittest.mock import patch, MagicMock, call, PropertyMock
+from sebs.ec2 import Instance, supports_init_rate
+from sebs.poller import Poller
+from unittest.mock import patch, MagicMock, call
 
 
 class TestInstance(unittest.TestCase):
@@ -9,6 +10,7 @@ class TestInstance(unittest.TestCase):
         self.default_tag = 'sebs'
         self.device_name = '/dev/xdf'
         self.mock_instance = MagicMock(name='mock_instance', id='in-1111')
+        self.mock_client = MagicMock(name='mock_client')
 
     def tearDown(self):
         pass
@@ -24,9 +26,80 @@ class TestInstance(unittest.TestCase):
         self.assertEqual(server.volume_tag, self.default_tag,
                          'Should set volume_tag field.')
         self.assertEqual(server.backup, [], 'Should have empty backup list.')
+        self.assertIsNone(server.inventory,
+                          'Should not search for volumes until a device is added.')
 
         mock_method.assert_called_once()
 
+    @patch('sebs.ec2.Instance.get_instance')
+    def test_connection_config(self, mock_method):
+        server = Instance(self.default_tag, max_pool_connections=25)
+
+        self.assertEqual(server.config.max_pool_connections, 25,
+                         'Should size the shared connection pool.')
+        self.assertTrue(server.config.tcp_keepalive,
+                        'Should keep connections alive by default.')
+
+        server = Instance(self.default_tag, tcp_keepalive=False)
+
+        self.assertEqual(server.config.max_pool_connections, 10)
+        self.assertFalse(server.config.tcp_keepalive)
+
+    @patch('sebs.ec2.InstanceMetadata')
+    @patch('sebs.ec2.make_session')
+    def test_shared_client(self, mock_make_session, mock_metadata):
+        mock_session = mock_make_session.return_value
+        mock_client = mock_session.client.return_value
+        mock_client.describe_volumes.return_value = {'Volumes': []}
+        mock_client.describe_instances.return_value = {'Reservations': [
+            {'Instances': [{'InstanceId': 'i-1234', 'State': {'Name': 'running'}}]}]}
+
+        server = Instance(self.default_tag)
+
+        mock_session.client.assert_called_once_with(
+            'ec2', config=server.config)
+        mock_session.resource.assert_not_called()
+        self.assertEqual(server.ec2_client.client, mock_client)
+        self.assertEqual(server.config.retries, {'total_max_attempts': 1},
+                         'Retries should be left to the API client.')
+        mock_client.describe_instances.assert_called_once_with(
+            InstanceIds=[mock_metadata.return_value.instance_id.return_value])
+        self.assertEqual(server.ec2_client.calls['describe_instances'], 1,
+                         'The probe should be retried by the API client.')
+        self.assertEqual(server.instance.id, 'i-1234')
+        self.assertTrue(server.inventory.loaded,
+                        'Should search for volumes while the instance loads.')
+        mock_make_session.assert_called_once_with(
+            region_name=mock_metadata.return_value.region.return_value,
+            metadata=mock_metadata.return_value.client)
+
+    @patch('sebs.ec2.supports_init_rate')
+    @patch('sebs.ec2.Instance.get_instance')
+    def test_init_rate_unsupported(self, mock_method, mock_supports):
+        mock_supports.return_value = False
+
+        with self.assertRaises(SystemExit):
+            Instance(self.default_tag, init_rate=300)
+
+        with self.assertRaises(ValueError):
+            Instance(self.default_tag, init_rate=300, instance_id='i-1234')
+
+        # Without the flag it doesn't matter
+        Instance(self.default_tag)
+
+    def test_supports_init_rate(self):
+        mock_client = MagicMock(name='mock_client')
+        mock_client.meta.service_model.operation_model.return_value.input_shape.members = {
+            'SnapshotId': None, 'Size': None}
+
+        self.assertFalse(supports_init_rate(mock_client))
+
+        mock_client.meta.service_model.operation_model.return_value.input_shape.members[
+            'VolumeInitializationRate'] = None
+
+        self.assertTrue(supports_init_rate(mock_client))
+        self.assertTrue(supports_init_rate(None), 'The lean client has no model to check.')
+
     @patch('sebs.ec2.StatefulVolume')
     @patch('sebs.ec2.Instance.get_instance')
     def test_add_device(self, mock_method, mock_volume_class):
@@ -35,19 +108,25 @@ class TestInstance(unittest.TestCase):
         mock_volume_class.return_value = mock_volume
 
         server = Instance(self.default_tag)
+        server.ec2_client = self.mock_client
 
         server.add_stateful_device(self.device_name)
 
         mock_method.assert_called_once()
         mock_volume_class.assert_called_once()
 
-        # Instead of None it should be a session...
-        # but I can't figure out how to make a mock method (get_instance)
-        # set a class field self.session as a side effect.
-        mock_volume_class.assert_called_once_with(None,
+        mock_volume_class.assert_called_once_with(self.mock_client,
                                                   self.mock_instance.id,
                                                   self.device_name,
-                                                  self.default_tag)
+                                                  self.default_tag,
+                                                  inventory=server.inventory,
+                                                  waiter=server.waiter,
+                                                  overrides=None,
+                                                  fast_restore=False,
+                                                  init_rate=None,
+                                                  cleanup=server.cleanup,
+                                                  reuse_snapshot=None,
+                                                  timer=server.timer, journal=server.journal)
         self.assertIn(mock_volume, server.backup,
                       'Should put our device in the backup list.')
         mock_volume.get_status.assert_called_once()
@@ -60,18 +139,33 @@ class TestInstance(unittest.TestCase):
         mock_volume_class.return_value = mock_volume
 
         server = Instance(self.default_tag)
+        server.ec2_client = self.mock_client
 
         server.add_stateful_device(self.device_name)
-        server.add_stateful_device('/dev/2')
+        server.add_stateful_device('/dev/2', {'VolumeType': 'gp3'})
 
         mock_method.assert_called_once()
         self.assertEqual(mock_volume_class.call_count, 2,
                          'Should create two volumes.')
 
-        # Same as above test, need to replace None with session
         mock_volume_class.assert_has_calls(
-            [call(None, self.mock_instance.id, self.device_name, self.default_tag),
-             call(None, self.mock_instance.id, '/dev/2', self.default_tag)])
+            [call(self.mock_client, self.mock_instance.id,
+                  self.device_name, self.default_tag, inventory=server.inventory,
+                  waiter=server.waiter, overrides=None, fast_restore=False,
+                  init_rate=None, cleanup=server.cleanup, reuse_snapshot=None,
+                  timer=server.timer, journal=server.journal),
+             call(self.mock_client, self.mock_instance.id,
+                  '/dev/2', self.default_tag, inventory=server.inventory,
+                  waiter=server.waiter, overrides={'VolumeType': 'gp3'},
+                  fast_restore=False, init_rate=None, cleanup=server.cleanup,
+                  reuse_snapshot=None, timer=server.timer, journal=server.journal)])
+
+        # Every device should share a single inventory
+        self.assertIsNotNone(server.inventory)
+        self.assertEqual(server.inventory.ec2_client, self.mock_client,
+                         'Inventory should use the shared client.')
+        self.assertEqual(server.waiter.poller, server.poller,
+                         'Waiter should use the shared poller.')
 
         self.assertEqual(len(server.backup), 2, 'Should have two volumes.')
         self.assertEqual(mock_volume.get_status.call_count, 2,
@@ -91,12 +185,11 @@ class TestInstance(unittest.TestCase):
         mock_volume.tag_volume.assert_called_once()
         mock_volume2.tag_volume.assert_not_called()
 
-    @patch('sebs.ec2.ec2_metadata')
+    @patch('sebs.ec2.InstanceMetadata')
     @patch('sebs.ec2.Instance.get_instance')
     def test_attach_volumes(self, mock_method, mock_metadata):
 
-        p = PropertyMock(return_value='AZ2')
-        type(mock_metadata).availability_zone = p
+        mock_metadata.return_value.availability_zone.return_value = 'AZ2'
 
         mock_volume = MagicMock(name='mock_volume_1', status='Not Attached')
         mock_volume2 = MagicMock(name='mock_volume_2', status='Missing')
@@ -106,11 +199,208 @@ class TestInstance(unittest.TestCase):
         server.attach_stateful_volumes()
 
         # Should Attach one volume but not the other.
-        mock_volume.copy.assert_called_once_with('AZ2')
-        mock_volume.attach.assert_called_once()
+        mock_volume.restore.assert_called_once_with('AZ2')
+
+        mock_volume2.restore.assert_not_called()
+
+    @patch('sebs.ec2.Hydrator')
+    @patch('sebs.ec2.find_device')
+    @patch('sebs.ec2.InstanceMetadata')
+    @patch('sebs.ec2.Instance.get_instance')
+    def test_attach_volumes_hydrate(self, mock_method, mock_metadata, mock_find, mock_hydrator):
+
+        mock_metadata.return_value.availability_zone.return_value = 'AZ2'
+        mock_find.side_effect = [None, '/dev/nvme1n1']
+
+        mock_volume = MagicMock(name='mock_volume_1', status='Not Attached',
+                                device_name='/dev/xvdz', copied=True)
+        mock_volume.volume.volume_id = 'vol-1234'
+        mock_volume2 = MagicMock(name='mock_volume_2', status='Not Attached',
+                                 copied=False)
+
+        server = Instance(self.default_tag,
+                          poller=Poller(initial_interval=0),
+                          hydrate={'workers': 4, 'rate': None})
+        server.backup = [mock_volume, mock_volume2]
+        server.attach_stateful_volumes()
+
+        # Every device is attached before anything is hydrated
+        mock_volume2.restore.assert_called_once_with('AZ2')
+        mock_find.assert_not_called()
+
+        server.hydrate_stateful_volumes()
+
+        # Only volumes restored from a snapshot need hydrating
+        mock_find.assert_called_with('/dev/xvdz', 'vol-1234')
+        mock_hydrator.assert_called_once_with(
+            '/dev/nvme1n1', workers=4, rate=None)
+        mock_hydrator.return_value.run.assert_called_once()
+
+    @patch('sebs.ec2.Hydrator')
+    @patch('sebs.ec2.find_device')
+    @patch('sebs.ec2.InstanceMetadata')
+    @patch('sebs.ec2.Instance.get_instance')
+    def test_hydrate_failure(self, mock_method, mock_metadata, mock_find, mock_hydrator):
+
+        mock_metadata.return_value.availability_zone.return_value = 'AZ2'
+        mock_find.return_value = '/dev/xvdz'
+        mock_hydrator.return_value.run.side_effect = OSError('I/O error')
+
+        mock_volume = MagicMock(name='mock_volume_1', status='Not Attached',
+                                copied=True)
+
+        server = Instance(self.default_tag, hydrate={})
+        server.backup = [mock_volume]
+        failed = server.attach_stateful_volumes(parallel=2)
+        server.hydrate_stateful_volumes()
+
+        # The volume is attached so the restore still worked
+        self.assertEqual(failed, [])
+        mock_volume.restore.assert_called_once()
+        mock_hydrator.return_value.run.assert_called_once()
+
+    @patch('sebs.ec2.InstanceMetadata')
+    @patch('sebs.ec2.Instance.get_instance')
+    def test_attach_volumes_parallel(self, mock_method, mock_metadata):
+
+        mock_metadata.return_value.availability_zone.return_value = 'AZ2'
+
+        mock_volume = MagicMock(name='mock_volume_1', status='Not Attached')
+        mock_volume2 = MagicMock(name='mock_volume_2', status='Not Attached')
+        mock_volume3 = MagicMock(name='mock_volume_3', status='Attached')
+
+        server = Instance(self.default_tag)
+        server.backup = [mock_volume, mock_volume2, mock_volume3]
+        failed = server.attach_stateful_volumes(parallel=2)
+
+        self.assertEqual(failed, [], 'Should not have any failures.')
+        mock_volume.restore.assert_called_once_with('AZ2')
+        mock_volume2.restore.assert_called_once_with('AZ2')
+        mock_volume3.restore.assert_not_called()
+
+    @patch('sebs.ec2.InstanceMetadata')
+    @patch('sebs.ec2.Instance.get_instance')
+    def test_attach_volumes_parallel_failure(self, mock_method, mock_metadata):
+
+        mock_metadata.return_value.availability_zone.return_value = 'AZ2'
+
+        mock_volume = MagicMock(name='mock_volume_1', status='Not Attached')
+        mock_volume2 = MagicMock(name='mock_volume_2', status='Not Attached')
+        mock_volume.restore.side_effect = Exception('Snapshot failed')
+
+        server = Instance(self.default_tag)
+        server.backup = [mock_volume, mock_volume2]
+        failed = server.attach_stateful_volumes(parallel=2)
+
+        # A failed device should not stop the others
+        self.assertEqual(failed, [mock_volume], 'Should report the failure.')
+        self.assertEqual(mock_volume.status, 'Failed')
+        mock_volume2.restore.assert_called_once()
+
+        server.tag_stateful_volumes()
+        mock_volume.tag_volume.assert_not_called()
+
+    def grouped_volume(self, name, volume_id, source_id='i-old'):
+        sv = MagicMock(name=name, status='Not Attached', snapshot_id=None)
+        sv.needs_copy.return_value = True
+        sv.volume.volume_id = volume_id
+        sv.volume.attachments = [{'InstanceId': source_id}]
+        return sv
+
+    @patch('sebs.ec2.InstanceMetadata')
+    @patch('sebs.ec2.Instance.get_instance')
+    def test_group_snapshots(self, mock_method, mock_metadata):
+        data = self.grouped_volume('data', 'vol-1111')
+        wal = self.grouped_volume('wal', 'vol-2222')
+        other = self.grouped_volume('other', 'vol-3333', 'i-other')
+
+        self.mock_client.describe_instances.return_value = {'Reservations': [{'Instances': [{
+            'RootDeviceName': '/dev/xvda',
+            'BlockDeviceMappings': [
+                {'DeviceName': '/dev/xvda', 'Ebs': {'VolumeId': 'vol-root'}},
+                {'DeviceName': '/dev/xvdb', 'Ebs': {'VolumeId': 'vol-1111'}},
+                {'DeviceName': '/dev/xvdc', 'Ebs': {'VolumeId': 'vol-2222'}},
+                {'DeviceName': '/dev/xvdd', 'Ebs': {'VolumeId': 'vol-scratch'}},
+            ]}]}]}
+        self.mock_client.create_snapshots.return_value = {'Snapshots': [
+            {'SnapshotId': 'sn-1111', 'VolumeId': 'vol-1111'},
+            {'SnapshotId': 'sn-2222', 'VolumeId': 'vol-2222'}]}
+
+        server = Instance(self.default_tag)
+        server.ec2_client = self.mock_client
+
+        largest = server.snapshot_groups([data, wal, other], 'AZ2')
+
+        self.assertEqual(largest, 2, 'Should restore the group together.')
+        self.mock_client.describe_instances.assert_called_once_with(
+            InstanceIds=['i-old'])
+        self.mock_client.create_snapshots.assert_called_once_with(
+            InstanceSpecification={'InstanceId': 'i-old',
+                                   'ExcludeBootVolume': True,
+                                   'ExcludeDataVolumeIds': ['vol-scratch']},
+            Description='Intermediate snapshot for SEBS.',
+            CopyTagsFromSource='volume')
+
+        self.assertEqual(data.snapshot_id, 'sn-1111')
+        self.assertEqual(wal.snapshot_id, 'sn-2222')
+        self.assertIsNone(other.snapshot_id,
+                          'A single volume is snapshotted on its own.')
+
+    @patch('sebs.ec2.InstanceMetadata')
+    @patch('sebs.ec2.Instance.get_instance')
+    def test_group_snapshots_failure(self, mock_method, mock_metadata):
+        data = self.grouped_volume('data', 'vol-1111')
+        wal = self.grouped_volume('wal', 'vol-2222')
+
+        self.mock_client.describe_instances.side_effect = Exception(
+            'InvalidInstanceID.NotFound')
+
+        server = Instance(self.default_tag)
+        server.ec2_client = self.mock_client
+
+        self.assertEqual(server.snapshot_groups([data, wal], 'AZ2'), 0)
+        self.assertIsNone(data.snapshot_id,
+                          'Should fall back to a snapshot per volume.')
+
+    @patch('sebs.ec2.Instance.get_instance')
+    def test_asg_availability_zones(self, mock_method):
+        server = Instance(self.default_tag)
+        server.instance = self.mock_instance
+        server.session = MagicMock(name='session')
+        autoscaling = server.session.client.return_value
+
+        self.mock_instance.tags = [{'Key': 'aws:autoscaling:groupName', 'Value': 'app'}]
+        autoscaling.describe_auto_scaling_groups.return_value = {'AutoScalingGroups': [
+            {'AvailabilityZones': ['us-east-1a', 'us-east-1b']}]}
+
+        self.assertEqual(server.asg_availability_zones(), ['us-east-1a', 'us-east-1b'])
+        autoscaling.describe_auto_scaling_groups.assert_called_once_with(
+            AutoScalingGroupNames=['app'])
+
+        self.mock_instance.tags = None
+
+        self.assertEqual(server.asg_availability_zones(), [],
+                         'Should not look up a group for a lone instance.')
+
+    @patch('sebs.ec2.os')
+    @patch('sebs.ec2.Instance.get_instance')
+    def test_snapshot_volumes(self, mock_method, mock_os):
+        attached = MagicMock(name='attached', status='Attached')
+        attached.detach_and_snapshot.return_value = 'sn-1111'
+        broken = MagicMock(name='broken', status='Attached')
+        broken.detach_and_snapshot.side_effect = Exception('IncorrectState')
+        missing = MagicMock(name='missing', status='Missing')
+
+        server = Instance(self.default_tag)
+        server.waiter = MagicMock(name='waiter')
+        server.backup = [attached, broken, missing]
+
+        failed = server.snapshot_stateful_volumes()
 
-        mock_volume2.copy.assert_not_called()
-        mock_volume2.attach.assert_not_called()
+        self.assertEqual(failed, [broken])
+        mock_os.sync.assert_called_once()
+        missing.detach_and_snapshot.assert_not_called()
+        server.waiter.wait_for_snapshot.assert_called_once_with('sn-1111')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,75 @@
+import os
+import json
+import logging
+import tempfile
+import unittest
+from sebs.journal import RestoreJournal
+
+
+class TestRestoreJournal(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'sebs', 'journal.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+        logging.disable(logging.NOTSET)
+
+    def test_survives_restart(self):
+        journal = RestoreJournal(self.path)
+        journal.update('sebs:/dev/xvdf', phase='snapshot', source='vol-1', snapshot='sn-1')
+        journal.update('sebs:/dev/xvdf', phase='create', volume='vol-2')
+
+        entry = RestoreJournal(self.path).get('sebs:/dev/xvdf')
+
+        self.assertEqual(entry, {'phase': 'create', 'source': 'vol-1',
+                                 'snapshot': 'sn-1', 'volume': 'vol-2'})
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ['journal.json'],
+                         'Should not leave the partial file behind.')
+
+    def test_clear(self):
+        journal = RestoreJournal(self.path)
+        journal.update('sebs:/dev/xvdf', snapshot='sn-1')
+        journal.update('sebs:/dev/xvdg', snapshot='sn-2')
+
+        journal.clear('sebs:/dev/xvdf')
+        journal.clear('sebs:/dev/xvdh')
+
+        with open(self.path) as saved:
+            self.assertEqual(json.load(saved), {'sebs:/dev/xvdg': {'snapshot': 'sn-2'}})
+
+    def test_get_copy(self):
+        journal = RestoreJournal()
+        journal.update('sebs:/dev/xvdf', snapshot='sn-1')
+
+        journal.get('sebs:/dev/xvdf')['snapshot'] = 'sn-2'
+
+        self.assertEqual(journal.get('sebs:/dev/xvdf'), {'snapshot': 'sn-1'})
+        self.assertEqual(journal.get('sebs:/dev/xvdg'), {})
+
+    def test_corrupt_file(self):
+        os.makedirs(os.path.dirname(self.path))
+
+        with open(self.path, 'w') as saved:
+            saved.write('{"sebs:/dev/xvdf": ')
+
+        journal = RestoreJournal(self.path)
+
+        self.assertEqual(journal.get('sebs:/dev/xvdf'), {}, 'Should start over.')
+
+    def test_unwritable(self):
+        blocker = os.path.join(self.directory.name, 'file')
+        open(blocker, 'w').close()
+
+        journal = RestoreJournal(os.path.join(blocker, 'journal.json'))
+        journal.update('sebs:/dev/xvdf', snapshot='sn-1')
+
+        self.assertEqual(journal.get('sebs:/dev/xvdf'), {'snapshot': 'sn-1'},
+                         'Should keep going in memory.')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,324 @@
+import json
+import time
+import socket
+import http.client
+import logging
+import datetime
+import unittest
+import botocore.auth
+import botocore.awsrequest
+import botocore.credentials
+from unittest.mock import patch
+from sebs.api import ApiClient
+from sebs.cleanup import error_code
+from sebs.ec2 import Instance
+from sebs.metadata import MetadataClient, InstanceMetadata, IDENTITY_PATH
+from sebs.lean import (LeanEC2Client, LeanConnectionError, CredentialProvider, Credentials,
+                       serialize, parse_response, parse_timestamp, sign)
+from tests.unit.test_poller import FakeClock
+from tests.utils.fake_aws_server import FakeAwsServer, ec2_response, ec2_error
+
+NOW = datetime.datetime(2020, 5, 23, 12, 30, tzinfo=datetime.timezone.utc)
+
+VOLUMES = """<volumeSet><item>
+  <volumeId>vol-1234</volumeId><size>50</size><snapshotId/><availabilityZone>us-east-1a</availabilityZone>
+  <status>in-use</status><createTime>2020-05-23T12:00:00.000Z</createTime>
+  <attachmentSet><item><volumeId>vol-1234</volumeId><instanceId>i-1234</instanceId>
+    <device>/dev/xvdf</device><status>attached</status><deleteOnTermination>false</deleteOnTermination>
+  </item></attachmentSet>
+  <tagSet><item><key>sebs</key><value>/dev/xvdf</value></item></tagSet>
+  <volumeType>gp3</volumeType><iops>3000</iops><encrypted>true</encrypted><multiAttachEnabled>false</multiAttachEnabled>
+</item><item>
+  <volumeId>vol-5678</volumeId><size>10</size><availabilityZone>us-east-1b</availabilityZone>
+  <status>available</status><attachmentSet/><volumeType>gp2</volumeType>
+</item></volumeSet>"""
+
+INSTANCES = """<reservationSet><item><reservationId>r-1234</reservationId><instancesSet><item>
+  <instanceId>i-1234</instanceId><instanceState><code>16</code><name>running</name></instanceState>
+  <placement><availabilityZone>us-east-1a</availabilityZone><tenancy>default</tenancy></placement>
+  <blockDeviceMapping><item><deviceName>/dev/xvda</deviceName>
+    <ebs><volumeId>vol-root</volumeId><status>attached</status></ebs></item></blockDeviceMapping>
+  <tagSet><item><key>aws:autoscaling:groupName</key><value>app-asg</value></item></tagSet>
+</item></instancesSet></item></reservationSet>"""
+
+
+class StaticCredentials:
+    def get(self):
+        return Credentials('AKIDEXAMPLE', 'wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY', 'session-token')
+
+
+class TestQueryProtocol(unittest.TestCase):
+
+    def test_serialize(self):
+        pairs = serialize({
+            'Filters': [{'Name': 'tag-key', 'Values': ['sebs', 'app-sebs']}],
+            'OwnerIds': ['self'],
+            'Resources': ['vol-1234'],
+            'TagSpecifications': [{'ResourceType': 'volume',
+                                   'Tags': [{'Key': 'sebs', 'Value': '/dev/xvdf'}]}],
+            'InstanceSpecification': {'InstanceId': 'i-1234', 'ExcludeBootVolume': True,
+                                      'ExcludeDataVolumeIds': ['vol-5678']},
+            'Size': 50,
+        })
+
+        self.assertEqual(pairs, [
+            ('Filter.1.Name', 'tag-key'),
+            ('Filter.1.Value.1', 'sebs'),
+            ('Filter.1.Value.2', 'app-sebs'),
+            ('Owner.1', 'self'),
+            ('ResourceId.1', 'vol-1234'),
+            ('TagSpecification.1.ResourceType', 'volume'),
+            ('TagSpecification.1.Tag.1.Key', 'sebs'),
+            ('TagSpecification.1.Tag.1.Value', '/dev/xvdf'),
+            ('InstanceSpecification.InstanceId', 'i-1234'),
+            ('InstanceSpecification.ExcludeBootVolume', 'true'),
+            ('InstanceSpecification.ExcludeDataVolumeId.1', 'vol-5678'),
+            ('Size', '50'),
+        ])
+
+    def test_parse_volumes(self):
+        response = parse_response(ec2_response('DescribeVolumes', VOLUMES)[1])
+
+        self.assertEqual(response['Volumes'][0], {
+            'VolumeId': 'vol-1234', 'Size': 50, 'SnapshotId': '',
+            'AvailabilityZone': 'us-east-1a', 'State': 'in-use',
+            'CreateTime': datetime.datetime(2020, 5, 23, 12, tzinfo=datetime.timezone.utc),
+            'Attachments': [{'VolumeId': 'vol-1234', 'InstanceId': 'i-1234', 'Device': '/dev/xvdf',
+                             'State': 'attached', 'DeleteOnTermination': False}],
+            'Tags': [{'Key': 'sebs', 'Value': '/dev/xvdf'}],
+            'VolumeType': 'gp3', 'Iops': 3000, 'Encrypted': True, 'MultiAttachEnabled': False,
+        })
+        self.assertEqual(response['Volumes'][1]['Attachments'], [],
+                         'Should read an empty set as an empty list.')
+        self.assertNotIn('RequestId', response)
+
+    def test_parse_timestamp(self):
+        for value in ['2020-05-23T12:00:00.000Z', '2020-05-23T12:00:00Z', '2020-05-23T12:00:00+00:00']:
+            self.assertEqual(parse_timestamp(value),
+                             datetime.datetime(2020, 5, 23, 12, tzinfo=datetime.timezone.utc), value)
+
+    def test_parse_instances(self):
+        response = parse_response(ec2_response('DescribeInstances', INSTANCES)[1])
+        instance = response['Reservations'][0]['Instances'][0]
+
+        self.assertEqual(instance['State'], {'Code': '16', 'Name': 'running'})
+        self.assertEqual(instance['Placement']['AvailabilityZone'], 'us-east-1a')
+        self.assertEqual(instance['BlockDeviceMappings'],
+                         [{'DeviceName': '/dev/xvda', 'Ebs': {'VolumeId': 'vol-root', 'State': 'attached'}}])
+
+    def test_signature_matches_botocore(self):
+        body = 'Action=DescribeVolumes&Version=2016-11-15&Filter.1.Name=tag-key&Filter.1.Value.1=sebs'
+        credentials = StaticCredentials().get()
+
+        headers = sign(credentials, 'us-east-1', 'ec2', 'ec2.us-east-1.amazonaws.com', body, NOW)
+
+        request = botocore.awsrequest.AWSRequest(
+            method='POST', url='https://ec2.us-east-1.amazonaws.com/', data=body,
+            headers={'Content-Type': 'application/x-www-form-urlencoded; charset=utf-8'})
+        auth = botocore.auth.SigV4Auth(
+            botocore.credentials.Credentials('AKIDEXAMPLE', 'wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY',
+                                             'session-token'), 'ec2', 'us-east-1')
+
+        with patch('botocore.auth.get_current_datetime', return_value=NOW.replace(tzinfo=None)):
+            auth.add_auth(request)
+
+        self.assertEqual(headers['authorization'], request.headers['Authorization'])
+        self.assertEqual(headers['x-amz-date'], '20200523T123000Z')
+
+
+class TestLeanEC2Client(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+        self.server = FakeAwsServer().__enter__()
+        self.client = LeanEC2Client('us-east-1', credentials=StaticCredentials(),
+                                    endpoint=self.server.endpoint, now=lambda: NOW)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.__exit__()
+        logging.disable(logging.NOTSET)
+
+    def test_describe_volumes(self):
+        self.server.add('DescribeVolumes', ec2_response('DescribeVolumes', VOLUMES))
+
+        response = self.client.describe_volumes(
+            Filters=[{'Name': 'tag-key', 'Values': ['sebs']}])
+
+        self.assertEqual([volume['VolumeId'] for volume in response['Volumes']],
+                         ['vol-1234', 'vol-5678'])
+
+        request = self.server.ec2_requests()[0]
+        self.assertEqual(request['form'], {'Action': 'DescribeVolumes', 'Version': '2016-11-15',
+                                           'Filter.1.Name': 'tag-key', 'Filter.1.Value.1': 'sebs'})
+        self.assertTrue(request['headers']['authorization'].startswith(
+            'AWS4-HMAC-SHA256 Credential=AKIDEXAMPLE/20200523/us-east-1/ec2/aws4_request'))
+        self.assertEqual(request['headers']['x-amz-security-token'], 'session-token')
+
+    def test_reuses_connections(self):
+        self.server.add('DeleteVolume', ec2_response('DeleteVolume', '<return>true</return>'))
+
+        for _ in range(5):
+            self.assertEqual(self.client.delete_volume(VolumeId='vol-1234'), {'Return': True})
+
+        self.assertEqual(len(self.server.ec2_requests()), 5)
+        self.assertEqual(len(self.server.connections()), 1,
+                         'Should keep the connection alive between calls.')
+
+    def test_dropped_connections(self):
+        self.server.add('DeleteVolume', ec2_response('DeleteVolume', '<return>true</return>'))
+
+        class DroppedConnection:
+            closed = False
+
+            def request(self, *args, **kwargs):
+                raise http.client.RemoteDisconnected('Remote end closed connection')
+
+            def close(self):
+                self.closed = True
+
+        dropped = [DroppedConnection(), DroppedConnection()]
+
+        for connection in dropped:
+            self.client.pool.idle.put(connection)
+
+        self.assertEqual(self.client.delete_volume(VolumeId='vol-1234'), {'Return': True})
+        self.assertTrue(dropped[1].closed)
+        self.assertNotIn(dropped[1], list(self.client.pool.idle.queue),
+                         'Should not keep a dropped connection.')
+        self.assertEqual(len(self.server.ec2_requests()), 1,
+                         'Should retry on a new connection.')
+
+        self.server.add('CreateVolume', ec2_error('InvalidSnapshot.NotFound', 'No snapshot'))
+
+        with self.assertRaises(Exception) as context:
+            self.client.create_volume(AvailabilityZone='us-east-1a', SnapshotId='snap-1234')
+
+        self.assertEqual(error_code(context.exception), 'InvalidSnapshot.NotFound')
+        self.assertIn('CreateVolume', str(context.exception))
+
+    def test_retried_by_api_client(self):
+        clock = FakeClock()
+        api = ApiClient(self.client, clock=clock, sleep=clock.sleep, rand=lambda: 0.5)
+        self.server.add('CreateSnapshot',
+                        ec2_error('RequestLimitExceeded', 'Slow down', status=503),
+                        ec2_response('CreateSnapshot', '<snapshotId>snap-1234</snapshotId><volumeId>vol-1234</volumeId>'))
+
+        response = api.create_snapshot(VolumeId='vol-1234', Description='Intermediate snapshot for SEBS.')
+
+        self.assertEqual(response, {'SnapshotId': 'snap-1234', 'VolumeId': 'vol-1234'})
+        self.assertEqual(api.stats(), {'calls': 2, 'retries': 1, 'throttles': 1})
+
+    def test_unreachable(self):
+        unused = socket.socket()
+        unused.bind(('127.0.0.1', 0))
+        port = unused.getsockname()[1]
+        unused.close()
+
+        client = LeanEC2Client('us-east-1', credentials=StaticCredentials(),
+                               endpoint=f'http://127.0.0.1:{port}', timeout=1)
+
+        with self.assertRaises(LeanConnectionError):
+            client.describe_instances(InstanceIds=['i-1234'])
+
+    def test_only_sebs_operations(self):
+        with self.assertRaises(AttributeError):
+            self.client.run_instances
+
+    def start_instance(self):
+        # Runs sebs on i-1234 against the fake server
+        self.server.metadata[IDENTITY_PATH] = json.dumps(
+            {'instanceId': 'i-1234', 'region': 'us-east-1', 'availabilityZone': 'us-east-1a'})
+        self.server.add('DescribeInstances', ec2_response('DescribeInstances', INSTANCES))
+        self.server.add('DescribeVolumes', ec2_response('DescribeVolumes', VOLUMES))
+        metadata = InstanceMetadata(MetadataClient(self.server.endpoint))
+        self.providers = []
+
+        def lean_client(region, credentials, **kwargs):
+            self.providers.append(credentials)
+            return LeanEC2Client(region, credentials=StaticCredentials(),
+                                 endpoint=self.server.endpoint, **kwargs)
+
+        with patch('sebs.ec2.LeanEC2Client', side_effect=lean_client), \
+                patch('sebs.ec2.make_session') as mock_make_session:
+            server = Instance('sebs', transport='lean', metadata=metadata)
+
+        mock_make_session.assert_not_called()
+
+        return server, metadata
+
+    def test_instance_transport(self):
+        server, metadata = self.start_instance()
+
+        self.assertEqual(self.providers[0].metadata, metadata.client,
+                         'Credentials should be read with the same token.')
+        self.assertEqual(server.availability_zone(), 'us-east-1a')
+        self.assertEqual(self.server.tokens, 1)
+        self.assertIsNone(server.config, 'Should not load botocore.')
+        self.assertEqual(server.instance.id, 'i-1234')
+        self.assertEqual(server.instance.placement['AvailabilityZone'], 'us-east-1a')
+        self.assertEqual(server.asg_name(), 'app-asg')
+
+    def test_pipelined_startup(self):
+        # Every EC2 call takes a slow round trip, one after the other the
+        # probe and both volume searches would take 0.6s
+        self.server.delays = {'DescribeInstances': 0.2, 'DescribeVolumes': 0.2}
+
+        started = time.monotonic()
+        server, _metadata = self.start_instance()
+        elapsed = time.monotonic() - started
+
+        self.assertLess(elapsed, 0.45, 'Should search for volumes while the instance is probed.')
+        self.assertTrue(server.inventory.loaded)
+
+        spans = {span['name']: span for span in server.timer.report('Ready')['spans']}
+        probe, inventory = spans['instance_load'], spans['inventory']
+        self.assertLess(inventory['start'], probe['start'] + probe['duration'])
+
+        server.add_stateful_device('/dev/xvdf')
+
+        self.assertEqual(server.backup[0].status, 'Attached')
+        self.assertEqual([request['form']['Action'] for request in self.server.ec2_requests()].count(
+            'DescribeVolumes'), 2, 'The device should use the prefetched search.')
+
+
+class TestCredentialProvider(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeAwsServer().__enter__()
+        self.now = NOW
+        self.server.metadata['meta-data/iam/security-credentials/'] = 'app-role'
+        self.server.metadata['meta-data/iam/security-credentials/app-role'] = json.dumps({
+            'AccessKeyId': 'ASIAEXAMPLE', 'SecretAccessKey': 'secret', 'Token': 'token',
+            'Expiration': '2020-05-23T13:00:00Z'})
+        self.provider = CredentialProvider(MetadataClient(self.server.endpoint),
+                                           environ={}, now=lambda: self.now)
+
+    def tearDown(self):
+        self.server.__exit__()
+
+    def test_instance_profile(self):
+        credentials = self.provider.get()
+
+        self.assertEqual(credentials.access_key, 'ASIAEXAMPLE')
+        self.assertEqual(credentials.token, 'token')
+        self.assertEqual(self.provider.get(), credentials, 'Should reuse unexpired credentials.')
+        self.assertEqual(self.server.tokens, 1, 'Should reuse the IMDSv2 token.')
+        self.assertEqual(len(self.server.requests), 3)
+
+        self.now = NOW + datetime.timedelta(minutes=26)
+
+        self.assertIsNot(self.provider.get(), credentials,
+                         'Should refresh credentials before they expire.')
+
+    def test_environment(self):
+        provider = CredentialProvider(MetadataClient(self.server.endpoint), environ={
+            'AWS_ACCESS_KEY_ID': 'AKID', 'AWS_SECRET_ACCESS_KEY': 'secret'})
+
+        self.assertEqual(provider.get().access_key, 'AKID')
+        self.assertEqual(self.server.requests, [], 'Should not ask the metadata service.')
+
+
+if __name__ == '__main__':
+    unittest.main()
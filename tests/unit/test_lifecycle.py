@@ -0,0 +1,62 @@
+import logging
+import unittest
+import threading
+from unittest.mock import MagicMock
+from sebs.lifecycle import LifecycleAction
+
+
+class TestLifecycleAction(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+        self.client = MagicMock(name='autoscaling')
+        self.params = {'LifecycleHookName': 'drain',
+                       'AutoScalingGroupName': 'app-asg',
+                       'InstanceId': 'i-1111'}
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_heartbeats(self):
+        beats = threading.Semaphore(0)
+
+        def heartbeat(**kwargs):
+            beats.release()
+            # A failed heartbeat should not stop the next one
+            raise Exception('Throttling')
+
+        self.client.record_lifecycle_action_heartbeat.side_effect = heartbeat
+
+        action = LifecycleAction(self.client, 'drain', 'app-asg', 'i-1111',
+                                 interval=0.01)
+        action.start()
+
+        self.assertTrue(beats.acquire(timeout=5))
+        self.assertTrue(beats.acquire(timeout=5))
+
+        action.stop()
+
+        self.assertFalse(action.thread.is_alive())
+        self.client.record_lifecycle_action_heartbeat.assert_called_with(
+            **self.params)
+
+    def test_no_heartbeat_before_interval(self):
+        action = LifecycleAction(self.client, 'drain', 'app-asg', 'i-1111',
+                                 interval=60)
+        action.start()
+        action.stop()
+
+        self.client.record_lifecycle_action_heartbeat.assert_not_called()
+
+    def test_complete(self):
+        action = LifecycleAction(self.client, 'drain', 'app-asg', 'i-1111')
+
+        action.complete()
+
+        self.client.complete_lifecycle_action.assert_called_once_with(
+            LifecycleActionResult='CONTINUE', **self.params)
+
+
+if __name__ == '__main__':
+    unittest.main()
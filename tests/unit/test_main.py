@@ -1,26 +1,206 @@
+import os
+import json
+import tempfile
 import unittest
 import argparse
 from sebs.app import main
-from unittest.mock import MagicMock, patch
+from unittest.mock import MagicMock, patch, ANY
 
 
 class TestApplicaton(unittest.TestCase):
 
     @patch('sebs.app.Instance')
-    @patch('sebs.ec2.ec2_metadata')
-    def test_main(self, mock_metadata, mock_class):
+    def test_main(self, mock_class):
         mock_instance = MagicMock(name='mock_instance')
         mock_class.return_value = mock_instance
+        mock_instance.attach_stateful_volumes.return_value = []
+        mock_instance.cleanup_resources.return_value = []
 
-        args = argparse.Namespace(name='sebs', backup=['/dev/xdv', '/dev/svh'])
-        with self.assertRaises(SystemExit):
+        args = argparse.Namespace(
+            command='restore', name='sebs', backup=['/dev/xdv', '/dev/svh'], parallel=1,
+            overrides={'/dev/svh': {'VolumeType': 'gp3'}},
+            max_connections=10, keepalive=True, wait_timeout=1800, deadline=None,
+            fast_restore=False, init_rate=None, reuse_snapshot=None, hydrate=False,
+            hydrate_workers=8, hydrate_rate=None, report=None, prometheus=None, emf=None, journal=None,
+            transport='boto3', metadata_timeout=1.0, metadata_cache=None)
+        with self.assertRaises(SystemExit) as context:
             main(args)
 
-        mock_class.assert_called_once_with('sebs')
-        mock_instance.add_stateful_device.assert_any_call('/dev/xdv')
-        mock_instance.add_stateful_device.assert_any_call('/dev/svh')
-        mock_instance.attach_stateful_volumes.assert_called_once()
+        self.assertIsNone(context.exception.code, 'Should exit cleanly.')
+
+        mock_class.assert_called_once_with('sebs',
+                                           max_pool_connections=10,
+                                           tcp_keepalive=True,
+                                           poller=ANY,
+                                           fast_restore=False,
+                                           init_rate=None,
+                                           hydrate=None,
+                                           reuse_snapshot=None,
+                                           timer=ANY, journal=ANY,
+                                           transport='boto3', metadata=ANY)
+        mock_instance.add_stateful_device.assert_any_call('/dev/xdv', None)
+        mock_instance.add_stateful_device.assert_any_call(
+            '/dev/svh', {'VolumeType': 'gp3'})
+        mock_instance.attach_stateful_volumes.assert_called_once_with(1)
         mock_instance.tag_stateful_volumes.assert_called_once()
+        mock_instance.cleanup_resources.assert_called_once()
+        # Hydrating comes last so it doesn't hold up tagging and cleanup
+        stages = ['attach_stateful_volumes', 'tag_stateful_volumes', 'cleanup_resources',
+                  'hydrate_stateful_volumes']
+        self.assertEqual([name for name, _args, _kwargs in mock_instance.mock_calls
+                          if name in stages], stages)
+
+    @patch('sebs.app.Instance')
+    def test_main_failed_device(self, mock_class):
+        mock_instance = MagicMock(name='mock_instance')
+        mock_class.return_value = mock_instance
+        mock_volume = MagicMock(name='mock_volume', device_name='/dev/xdv')
+        mock_instance.attach_stateful_volumes.return_value = [mock_volume]
+
+        args = argparse.Namespace(
+            command='restore', name='sebs', backup=['/dev/xdv', '/dev/svh'], parallel=20, overrides={},
+            max_connections=10, keepalive=False, wait_timeout=1800, deadline=600,
+            fast_restore=True, init_rate=None, reuse_snapshot=900, hydrate=True,
+            hydrate_workers=4, hydrate_rate=100, report=None, prometheus=None, emf=None, journal=None,
+            transport='boto3', metadata_timeout=1.0, metadata_cache=None)
+
+        with tempfile.TemporaryDirectory() as reports:
+            args.report = os.path.join(reports, 'report.json')
+
+            with self.assertRaises(SystemExit) as context:
+                main(args)
+
+            with open(args.report) as report:
+                self.assertEqual(json.load(report)['status'], 'Failed',
+                                 'Should write the report of a failed run.')
+
+        # The pool should grow to fit every worker
+        mock_class.assert_called_once_with('sebs',
+                                           max_pool_connections=20,
+                                           tcp_keepalive=False,
+                                           poller=ANY,
+                                           fast_restore=True,
+                                           init_rate=None,
+                                           hydrate={'workers': 4, 'rate': 100},
+                                           reuse_snapshot=900,
+                                           timer=ANY, journal=ANY,
+                                           transport='boto3', metadata=ANY)
+
+        poller = mock_class.call_args[1]['poller']
+        self.assertEqual(poller.timeout, 1800)
+        self.assertEqual(poller.deadline.timeout, 600)
+
+        self.assertEqual(context.exception.code, 1,
+                         'Should exit with an error when a device fails.')
+        mock_instance.attach_stateful_volumes.assert_called_once_with(20)
+
+    @patch('sebs.app.Instance')
+    def test_main_failed_cleanup(self, mock_class):
+        mock_instance = MagicMock(name='mock_instance')
+        mock_class.return_value = mock_instance
+        mock_instance.attach_stateful_volumes.return_value = []
+        mock_instance.cleanup_resources.return_value = ['delete snapshot sn-12345']
+
+        args = argparse.Namespace(
+            command='restore', name='sebs', backup=['/dev/xdv'], parallel=1, overrides={},
+            max_connections=10, keepalive=True, wait_timeout=1800, deadline=None,
+            fast_restore=False, init_rate=None, reuse_snapshot=None, hydrate=False,
+            hydrate_workers=8, hydrate_rate=None, report=None, prometheus=None, emf=None, journal=None,
+            transport='boto3', metadata_timeout=1.0, metadata_cache=None)
+        with self.assertRaises(SystemExit) as context:
+            main(args)
+
+        self.assertEqual(context.exception.code, 1,
+                         'Should exit with an error when cleanup fails.')
+        mock_instance.tag_stateful_volumes.assert_called_once()
+
+    @patch('sebs.app.signal')
+    @patch('sebs.app.SnapshotDaemon')
+    @patch('sebs.app.Instance')
+    def test_daemon(self, mock_class, mock_daemon, mock_signal):
+        mock_instance = MagicMock(name='mock_instance')
+        mock_class.return_value = mock_instance
+        mock_instance.asg_availability_zones.return_value = [
+            'us-east-1a', 'us-east-1b']
+
+        args = argparse.Namespace(
+            command='daemon', name='sebs', backup=['/dev/xdv'], interval=600,
+            retain=2, standby_az=['us-east-1b'], standby_asg=True,
+            max_connections=10, keepalive=True, wait_timeout=1800,
+            metadata_timeout=1.0, metadata_cache=None)
+        with self.assertRaises(SystemExit) as context:
+            main(args)
+
+        self.assertIsNone(context.exception.code, 'Should exit cleanly.')
+        mock_instance.add_stateful_device.assert_called_once_with('/dev/xdv')
+        mock_instance.attach_stateful_volumes.assert_not_called()
+        mock_daemon.assert_called_once_with(mock_instance, interval=600, retain=2,
+                                            standby_azs=['us-east-1b', 'us-east-1a'])
+        mock_daemon.return_value.run.assert_called_once()
+        mock_signal.signal.assert_called_once()
+
+    @patch('sebs.app.LifecycleAction')
+    @patch('sebs.app.Instance')
+    def test_on_terminate(self, mock_class, mock_action):
+        mock_instance = MagicMock(name='mock_instance')
+        mock_class.return_value = mock_instance
+        mock_instance.asg_name.return_value = 'app-asg'
+        mock_instance.snapshot_stateful_volumes.return_value = []
+
+        args = argparse.Namespace(
+            command='on-terminate', name='sebs', backup=['/dev/xdv'], hook='drain',
+            asg=None, heartbeat=30, max_connections=10, keepalive=True,
+            wait_timeout=1800, metadata_timeout=1.0, metadata_cache=None)
+        with self.assertRaises(SystemExit) as context:
+            main(args)
+
+        self.assertIsNone(context.exception.code, 'Should exit cleanly.')
+        mock_action.assert_called_once_with(mock_instance.autoscaling_client.return_value,
+                                            'drain', 'app-asg', mock_instance.instance.id,
+                                            interval=30)
+        mock_action.return_value.start.assert_called_once()
+        mock_action.return_value.stop.assert_called_once()
+        mock_action.return_value.complete.assert_called_once()
+
+    @patch('sebs.app.LifecycleAction')
+    @patch('sebs.app.Instance')
+    def test_on_terminate_failure(self, mock_class, mock_action):
+        mock_instance = MagicMock(name='mock_instance')
+        mock_class.return_value = mock_instance
+        mock_instance.snapshot_stateful_volumes.side_effect = Exception('Throttled')
+
+        args = argparse.Namespace(
+            command='on-terminate', name='sebs', backup=['/dev/xdv'], hook='drain',
+            asg='app-asg', heartbeat=30, max_connections=10, keepalive=True,
+            wait_timeout=1800, metadata_timeout=1.0, metadata_cache=None)
+        with self.assertRaises(Exception):
+            main(args)
+
+        # The group should never be left waiting on us
+        mock_instance.asg_name.assert_not_called()
+        mock_action.return_value.complete.assert_called_once()
+
+    @patch('sebs.app.FleetController')
+    @patch('sebs.app.load_groups')
+    def test_fleet(self, mock_load, mock_controller):
+        mock_load.return_value = [{'asg': 'app-asg', 'name': 'app-sebs', 'backup': ['/dev/xdv']}]
+
+        mock_controller.return_value.run.return_value = (
+            [{'asg': 'app-asg', 'instance_id': 'i-1234', 'devices': {'/dev/xdv': 'Failed'}}], [])
+
+        args = argparse.Namespace(
+            command='fleet', config='groups.json', concurrency=20, interval=None,
+            region='us-east-2', fast_restore=False, init_rate=None, reuse_snapshot=None,
+            max_connections=10, keepalive=True, wait_timeout=1800)
+        with self.assertRaises(SystemExit) as context:
+            main(args)
+
+        self.assertEqual(context.exception.code, 1, 'Should fail on a failed device.')
+        mock_load.assert_called_once_with('groups.json')
+        mock_controller.assert_called_once_with(ANY, mock_load.return_value, concurrency=20,
+                                                max_pool_connections=20, tcp_keepalive=True,
+                                                poller=ANY, fast_restore=False, init_rate=None,
+                                                reuse_snapshot=None)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import socket
+import logging
+import tempfile
+import unittest
+from unittest.mock import patch
+from sebs.metadata import (MetadataClient, MetadataError, InstanceMetadata, IDENTITY_PATH)
+from sebs.model import make_session
+from tests.utils.fake_aws_server import FakeAwsServer
+
+IDENTITY = {'instanceId': 'i-1234', 'region': 'us-east-1', 'availabilityZone': 'us-east-1a',
+            'accountId': '123456789012', 'instanceType': 'm5.large'}
+
+
+def closed_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class TestInstanceMetadata(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+        self.server = FakeAwsServer().__enter__()
+        self.server.metadata[IDENTITY_PATH] = json.dumps(IDENTITY)
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.directory.name, 'sebs', 'identity.json')
+
+    def tearDown(self):
+        self.server.__exit__()
+        self.directory.cleanup()
+        logging.disable(logging.NOTSET)
+
+    def test_identity_once(self):
+        metadata = InstanceMetadata(MetadataClient(self.server.endpoint))
+
+        self.assertEqual(metadata.instance_id(), 'i-1234')
+        self.assertEqual(metadata.region(), 'us-east-1')
+
+        for _ in range(5):
+            self.assertEqual(metadata.availability_zone(), 'us-east-1a')
+
+        self.assertEqual(self.server.tokens, 1)
+        self.assertEqual(len(self.server.requests), 2,
+                         'Should read the identity document once.')
+
+    def test_disk_cache(self):
+        InstanceMetadata(MetadataClient(self.server.endpoint), cache_path=self.cache_path).identity()
+        requests = len(self.server.requests)
+
+        metadata = InstanceMetadata(MetadataClient(self.server.endpoint), cache_path=self.cache_path)
+
+        self.assertEqual(metadata.identity(), IDENTITY)
+        self.assertEqual(len(self.server.requests), requests,
+                         'Should not ask the metadata service again on the same boot.')
+
+        with patch('sebs.metadata.boot_id', return_value='another-boot'):
+            metadata = InstanceMetadata(MetadataClient(self.server.endpoint), cache_path=self.cache_path)
+            metadata.identity()
+
+        self.assertGreater(len(self.server.requests), requests,
+                           'Should not trust a cache from another boot.')
+
+    def test_bad_cache(self):
+        os.makedirs(os.path.dirname(self.cache_path))
+
+        with open(self.cache_path, 'w') as cached:
+            cached.write('{"document": ')
+
+        metadata = InstanceMetadata(MetadataClient(self.server.endpoint), cache_path=self.cache_path)
+
+        self.assertEqual(metadata.instance_id(), 'i-1234')
+
+        with open(self.cache_path) as cached:
+            self.assertEqual(json.load(cached)['document'], IDENTITY, 'Should rewrite the cache.')
+
+    def test_off_ec2(self):
+        metadata = InstanceMetadata(MetadataClient(f'http://127.0.0.1:{closed_port()}'))
+        started = time.monotonic()
+
+        with self.assertRaises(MetadataError):
+            metadata.instance_id()
+
+        self.assertLess(time.monotonic() - started, 1, 'Should fail fast.')
+
+        with patch.dict(os.environ, {'AWS_EC2_METADATA_DISABLED': 'true'}):
+            client = MetadataClient(self.server.endpoint)
+
+        with self.assertRaises(MetadataError):
+            client.get(IDENTITY_PATH)
+
+        self.assertEqual(self.server.requests, [])
+
+    def test_hop_limit(self):
+        # The token reply never makes it back to a container
+        self.server.delays['api/token'] = 0.5
+        self.server.imdsv1 = True
+        client = MetadataClient(self.server.endpoint, timeout=0.1)
+
+        self.assertEqual(InstanceMetadata(client).region(), 'us-east-1')
+        self.assertIsNone(client.token(), 'Should carry on without a token.')
+        self.assertEqual([request['method'] for request in self.server.requests], ['PUT', 'GET'],
+                         'Should only wait on a token once.')
+
+    def test_hop_limit_imdsv2_required(self):
+        self.server.delays['api/token'] = 0.5
+        client = MetadataClient(self.server.endpoint, timeout=0.1)
+
+        with self.assertRaisesRegex(MetadataError, 'hop limit'):
+            InstanceMetadata(client).identity()
+
+    def test_session_credentials(self):
+        self.server.metadata['meta-data/iam/security-credentials/'] = 'app-role'
+        self.server.metadata['meta-data/iam/security-credentials/app-role'] = json.dumps({
+            'AccessKeyId': 'ASIAEXAMPLE', 'SecretAccessKey': 'secret', 'Token': 'token',
+            'Expiration': '2999-01-01T00:00:00Z'})
+        metadata = InstanceMetadata(MetadataClient(self.server.endpoint))
+        environ = {key: value for key, value in os.environ.items() if not key.startswith('AWS_')}
+        environ['AWS_CONFIG_FILE'] = environ['AWS_SHARED_CREDENTIALS_FILE'] = os.devnull
+
+        with patch.dict(os.environ, environ, clear=True):
+            session = make_session(metadata.region(), cache_dir=self.directory.name,
+                                   metadata=metadata.client)
+            credentials = session.get_credentials()
+
+        self.assertEqual(credentials.access_key, 'ASIAEXAMPLE')
+        self.assertEqual(credentials.method, 'sebs-iam-role')
+        self.assertEqual(self.server.tokens, 1,
+                         'Credentials should be read with the identity token.')
+
+
+if __name__ == '__main__':
+    unittest.main()
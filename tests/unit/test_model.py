@@ -0,0 +1,110 @@
+import os
+import json
+import logging
+import tempfile
+import unittest
+import botocore.loaders
+from botocore.stub import Stubber
+from unittest.mock import patch
+from sebs.model import EC2_OPERATIONS, make_session, trim_service_model
+
+
+class TestModel(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.directory.name, 'models')
+
+    def tearDown(self):
+        self.directory.cleanup()
+        logging.disable(logging.NOTSET)
+
+    def cached_model(self):
+        name = next(name for name in os.listdir(self.cache_dir) if 'service-2' in name)
+
+        return os.path.join(self.cache_dir, name)
+
+    def test_trim(self):
+        full = botocore.loaders.Loader().load_service_model('ec2', 'service-2')
+        trimmed = trim_service_model(full)
+
+        self.assertEqual(sorted(trimmed['operations']), sorted(EC2_OPERATIONS))
+        self.assertEqual(trimmed['metadata'], full['metadata'])
+        self.assertIn('Volume', trimmed['shapes'])
+        self.assertIn('Filter', trimmed['shapes'])
+        self.assertNotIn('RunInstancesRequest', trimmed['shapes'])
+        self.assertNotIn('"documentation"', json.dumps(trimmed))
+        self.assertLess(len(json.dumps(trimmed)), len(json.dumps(full)) / 20)
+
+    def test_client(self):
+        client = make_session('us-east-1', cache_dir=self.cache_dir).client('ec2')
+
+        with Stubber(client) as stub:
+            stub.add_response('describe_volumes', {'Volumes': [{'VolumeId': 'vol-1234', 'Size': 50}]},
+                              {'Filters': [{'Name': 'tag-key', 'Values': ['sebs']}]})
+
+            response = client.describe_volumes(Filters=[{'Name': 'tag-key', 'Values': ['sebs']}])
+
+        self.assertEqual(response['Volumes'][0]['Size'], 50)
+        self.assertFalse(hasattr(client, 'run_instances'), 'Should only know what sebs calls.')
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+    def test_uses_cache(self):
+        make_session('us-east-1', cache_dir=self.cache_dir).client('ec2')
+
+        with open(self.cached_model()) as cached:
+            model = json.load(cached)
+
+        del model['operations']['DeleteTags']
+
+        with open(self.cached_model(), 'w') as cached:
+            json.dump(model, cached)
+
+        client = make_session('us-east-1', cache_dir=self.cache_dir).client('ec2')
+
+        self.assertFalse(hasattr(client, 'delete_tags'), 'Should load the cached model.')
+        self.assertTrue(hasattr(client, 'create_tags'))
+
+    def test_cache_keyed_on_operations(self):
+        make_session('us-east-1', cache_dir=self.cache_dir).client('ec2')
+        first = self.cached_model()
+
+        with patch('sebs.model.EC2_OPERATIONS', EC2_OPERATIONS + ['RunInstances']):
+            client = make_session('us-east-1', cache_dir=self.cache_dir).client('ec2')
+
+        self.assertTrue(hasattr(client, 'run_instances'),
+                        'Should not load a cache built for other operations.')
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+        with patch('sebs.model.MODEL_FORMAT', 0):
+            make_session('us-east-1', cache_dir=self.cache_dir).client('ec2')
+
+        self.assertEqual(len(os.listdir(self.cache_dir)), 3,
+                         'Should rebuild a cache from another trimmer.')
+        self.assertTrue(os.path.exists(first))
+
+    def test_corrupt_cache(self):
+        make_session('us-east-1', cache_dir=self.cache_dir).client('ec2')
+
+        with open(self.cached_model(), 'w') as cached:
+            cached.write('{"operations": ')
+
+        client = make_session('us-east-1', cache_dir=self.cache_dir).client('ec2')
+
+        self.assertTrue(hasattr(client, 'delete_tags'), 'Should rebuild the model.')
+
+        with open(self.cached_model()) as cached:
+            self.assertIn('DeleteTags', json.load(cached)['operations'])
+
+    def test_unwritable_cache(self):
+        open(self.cache_dir, 'w').close()
+
+        client = make_session('us-east-1', cache_dir=self.cache_dir).client('ec2')
+
+        self.assertTrue(hasattr(client, 'describe_volumes'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import logging
+import unittest
+from sebs.poller import Poller, Deadline, WaitTimeout
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestPoller(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.clock = FakeClock()
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def make_poller(self, **kwargs):
+        kwargs.setdefault('jitter', 0)
+        return Poller(clock=self.clock, sleep=self.clock.sleep,
+                      rand=lambda: 0.5, **kwargs)
+
+    def test_ready_without_sleeping(self):
+        poller = self.make_poller()
+
+        attempts = poller.wait(lambda: True, 'test')
+
+        self.assertEqual(attempts, 1, 'Should only check once.')
+        self.assertEqual(self.clock.sleeps, [], 'Should never sleep.')
+
+    def test_exponential_backoff(self):
+        poller = self.make_poller(initial_interval=1,
+                                  backoff=2, max_interval=5)
+        checks = iter([False, False, False, False, True])
+
+        attempts = poller.wait(lambda: next(checks), 'test')
+
+        self.assertEqual(attempts, 5)
+        self.assertEqual(self.clock.sleeps, [1, 2, 4, 5],
+                         'Should back off up to the max interval.')
+
+    def test_jitter(self):
+        poller = Poller(initial_interval=10, jitter=0.2, clock=self.clock,
+                        sleep=self.clock.sleep, rand=lambda: 1.0)
+        checks = iter([False, True])
+
+        poller.wait(lambda: next(checks), 'test')
+
+        self.assertAlmostEqual(self.clock.sleeps[0], 12,
+                               msg='Should add up to 20% jitter.')
+
+    def test_operation_timeout(self):
+        poller = self.make_poller(initial_interval=1, backoff=2, timeout=10)
+
+        with self.assertRaises(WaitTimeout):
+            poller.wait(lambda: False, 'test')
+
+        self.assertEqual(self.clock.now, 10,
+                         'Should give up right at the timeout.')
+
+    def test_timeout_override(self):
+        poller = self.make_poller(initial_interval=1, timeout=100)
+
+        with self.assertRaises(WaitTimeout):
+            poller.wait(lambda: False, 'test', timeout=3)
+
+        self.assertEqual(self.clock.now, 3)
+
+    def test_run_deadline(self):
+        deadline = Deadline(15, clock=self.clock)
+        poller = self.make_poller(initial_interval=1, backoff=1,
+                                  timeout=10, deadline=deadline)
+
+        poller.wait(lambda: self.clock.now >= 8, 'first')
+
+        # Only 7 seconds of the run are left for this wait
+        with self.assertRaises(WaitTimeout) as context:
+            poller.wait(lambda: False, 'second')
+
+        self.assertEqual(self.clock.now, 15)
+        self.assertIn('run deadline', str(context.exception))
+
+    def test_deadline_without_timeout(self):
+        deadline = Deadline(clock=self.clock)
+
+        self.assertIsNone(deadline.remaining())
+        self.assertFalse(deadline.expired())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import logging
+import unittest
+import threading
+import botocore.session
+from botocore.stub import Stubber
+from sebs.ec2 import ResourceWaiter
+from sebs.poller import Poller, WaitFailed
+from tests.unit.test_poller import FakeClock
+
+
+class TestResourceWaiter(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+        ec2 = botocore.session.get_session().create_client('ec2', region_name='us-west-2')
+        self.ec2_client = ec2
+        self.stub_client = Stubber(ec2)
+        self.stub_client.activate()
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+        self.stub_client.deactivate()
+
+    def volume_params(self, *volume_ids):
+        return {'Filters': [{'Name': 'volume-id', 'Values': list(volume_ids)}]}
+
+    def snapshot_params(self, *snapshot_ids):
+        return {'OwnerIds': ['self'],
+                'Filters': [{'Name': 'snapshot-id', 'Values': list(snapshot_ids)}]}
+
+    def test_wait_for_new_volume(self):
+        # A new volume may not be visible right away
+        self.stub_client.add_response(
+            'describe_volumes', {'Volumes': []}, self.volume_params('vol-2222'))
+
+        self.stub_client.add_response('describe_volumes', {'Volumes': [
+                                      {'VolumeId': 'vol-2222', 'State': 'creating'}]}, self.volume_params('vol-2222'))
+
+        self.stub_client.add_response('describe_volumes', {'Volumes': [
+                                      {'VolumeId': 'vol-2222', 'State': 'available'}]}, self.volume_params('vol-2222'))
+
+        clock = FakeClock()
+        poller = Poller(initial_interval=1, backoff=2, jitter=0,
+                        clock=clock, sleep=clock.sleep)
+        waiter = ResourceWaiter(self.ec2_client, poller)
+
+        waiter.wait_for_volume('vol-2222', 'available')
+
+        self.stub_client.assert_no_pending_responses()
+        self.assertEqual(clock.sleeps, [1, 2], 'Should poll with backoff.')
+        self.assertEqual(waiter.pending, {'volume': {}, 'snapshot': {}},
+                         'Should stop watching the volume.')
+
+    def test_wait_for_failed_snapshot(self):
+        self.stub_client.add_response('describe_snapshots', {'Snapshots': [
+                                      {'SnapshotId': 'sn-12345', 'State': 'error'}]}, self.snapshot_params('sn-12345'))
+
+        waiter = ResourceWaiter(self.ec2_client, Poller())
+
+        with self.assertRaises(WaitFailed):
+            waiter.wait_for_snapshot('sn-12345')
+
+    def test_batched_wait(self):
+        calls = []
+
+        class FakeClient:
+            def describe_volumes(self, **kwargs):
+                calls.append(('describe_volumes', kwargs))
+                return {'Volumes': [
+                    {'VolumeId': 'vol-1111', 'State': 'in-use'},
+                    {'VolumeId': 'vol-2222', 'State': 'available'}]}
+
+            def describe_snapshots(self, **kwargs):
+                calls.append(('describe_snapshots', kwargs))
+                return {'Snapshots': [
+                    {'SnapshotId': 'sn-12345', 'State': 'completed'}]}
+
+        barrier = threading.Barrier(3)
+
+        class StartTogether(ResourceWaiter):
+            # Make sure every worker is waiting before the first poll
+            def watch(self, kind, resource_id):
+                seen = super().watch(kind, resource_id)
+                barrier.wait()
+                return seen
+
+        waiter = StartTogether(FakeClient(), Poller(max_interval=0.1))
+
+        workers = [
+            threading.Thread(target=waiter.wait_for_volume,
+                             args=('vol-1111', 'in-use')),
+            threading.Thread(target=waiter.wait_for_volume,
+                             args=('vol-2222', 'available')),
+            threading.Thread(target=waiter.wait_for_snapshot,
+                             args=('sn-12345',)),
+        ]
+
+        for worker in workers:
+            worker.start()
+
+        for worker in workers:
+            worker.join(5)
+
+        # Everything pending is polled with a single call per resource type
+        self.assertEqual(calls, [
+            ('describe_volumes',
+             self.volume_params('vol-1111', 'vol-2222')),
+            ('describe_snapshots', self.snapshot_params('sn-12345')),
+        ])
+
+    def test_stale_state(self):
+        self.stub_client.add_response('describe_volumes', {'Volumes': [
+                                      {'VolumeId': 'vol-1111', 'State': 'in-use'}]}, self.volume_params('vol-1111'))
+
+        self.stub_client.add_response('describe_volumes', {'Volumes': [
+                                      {'VolumeId': 'vol-1111', 'State': 'available'}]}, self.volume_params('vol-1111'))
+
+        clock = FakeClock()
+        poller = Poller(jitter=0, clock=clock, sleep=clock.sleep)
+        waiter = ResourceWaiter(self.ec2_client, poller)
+
+        waiter.wait_for_volume('vol-1111', 'in-use')
+        clock.now += 0.5
+        waiter.wait_for_volume('vol-1111', 'available')
+
+        # A poll from before the wait started should never be trusted
+        self.stub_client.assert_no_pending_responses()
+
+
+if __name__ == '__main__':
+    unittest.main()
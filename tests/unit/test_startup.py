@@ -0,0 +1,76 @@
+import os
+import sys
+import unittest
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Cold import of sebs.app in milliseconds, boto3 on its own takes longer
+IMPORT_BUDGET_MS = int(os.environ.get('SEBS_IMPORT_BUDGET_MS', 250))
+
+# Only loaded once sebs first talks to AWS
+HEAVY_MODULES = ['boto3', 'botocore', 'requests', 'urllib3', 'ec2_metadata', 'asyncio']
+
+
+def import_times(*args):
+    # Runs python -X importtime and returns what was imported with the
+    # cumulative microseconds each import took
+    result = subprocess.run([sys.executable, '-X', 'importtime', *args], cwd=ROOT,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    times = {}
+
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+
+        _self, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+
+    return result, times
+
+
+class TestStartup(unittest.TestCase):
+
+    def assertLight(self, times):
+        loaded = [name for name in times if name.split('.')[0] in HEAVY_MODULES]
+
+        self.assertEqual(loaded, [], 'Should not import the AWS stack at startup.')
+
+    def test_import_app(self):
+        result, times = import_times('-c', 'import sebs.app')
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertLight(times)
+        self.assertLess(times['sebs.app'] / 1000, IMPORT_BUDGET_MS,
+                        'Importing sebs.app took longer than the startup budget.')
+
+    def test_import_handler(self):
+        result, times = import_times('-c', 'import sebs.handler')
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertLight(times)
+
+    def test_import_lean(self):
+        result, times = import_times('-c', 'import sebs.lean')
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertLight(times)
+
+    def test_version(self):
+        result, times = import_times(os.path.join('bin', 'sebs'), '--version')
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn('version', result.stdout)
+        self.assertLight(times)
+        self.assertNotIn('sebs.ec2', times, 'Should not load the restore code.')
+
+    def test_bad_arguments(self):
+        result, times = import_times(os.path.join('bin', 'sebs'), '--parallel', '0', '-b', '/dev/xvdf')
+
+        self.assertEqual(result.returncode, 2)
+        self.assertNotIn('sebs.ec2', times)
+
+
+if __name__ == '__main__':
+    unittest.main()
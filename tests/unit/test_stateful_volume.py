@@ -1,15 +1,15 @@
-import sys
-import boto3
+import time
 import logging
-import unittest
+import threading
 import datetime
+import unittest
 import botocore.session
 from botocore.stub import Stubber, ANY
-from unittest.mock import patch, MagicMock, Mock
-
-if('sebs.ec2' in sys.modules):
-    # We need to un-import it if imported already
-    del sys.modules["sebs.ec2"]
+from botocore.exceptions import ClientError
+from unittest.mock import patch
+from sebs.ec2 import StatefulVolume, VolumeInventory, VolumeRecord
+from sebs.journal import RestoreJournal
+from tests.utils.fake_ec2 import FakeEC2
 
 
 class TestStatefulVolume(unittest.TestCase):
@@ -27,103 +27,100 @@ class TestStatefulVolume(unittest.TestCase):
         self.ec2_client = ec2
         self.stub_client = Stubber(ec2)
 
-        # Setup our ec2 resource stub
-        ec2_resource = boto3.resource('ec2', region_name='us-west-2')
-        self.stub_resource = Stubber(ec2_resource.meta.client)
-
-        # Use mocks to pass out client stubb to our code
-        self.boto3 = MagicMock(name='module_mock')
-        self.mock_client = MagicMock(name='client_mock', return_value=ec2)
-        self.boto3.client = self.mock_client
-
-        # Setup resource and volume mocks
-        self.mock_snapshot = MagicMock(
-            name='snapshot_mock', snapshot_id='sn-12345')
-        self.first_volume = Mock(name='first_volume',
-                                 attachments=[{'InstanceId': ''}], volume_type='GP2', volume_id='vol-1111')
-
-        self.second_volume = Mock(name='second_volume',
-                                  attachments=[{'InstanceId': ''}], volume_type='GP2', volume_id='vol-2222')
-
-        self.first_volume.create_snapshot = Mock(
-            return_value=self.mock_snapshot)
-
-        self.mock_resource = MagicMock(
-            name='mock_resource_object')
-
-        self.mock_resource.Volume = MagicMock(
-            name='mock_volume_constructor')
+        # Keep track of every API call our code makes
+        self.calls = []
+        ec2.meta.events.register('provide-client-params.ec2', self.count_call)
+
+        self.first_volume = VolumeRecord({
+            'VolumeId': 'vol-1111',
+            'AvailabilityZone': 'fakeAZ',
+            'VolumeType': 'gp2',
+            'Size': 50,
+            'Attachments': [],
+        })
+
+        self.tag_params = {'Filters': [
+            {
+                'Name': 'tag-key',
+                'Values': [self.tag_name]
+            }
+        ]}
+
+        self.attachment_params = {'Filters': [
+            {
+                'Name': 'attachment.instance-id',
+                'Values': [self.instance_id]
+            }
+        ]}
 
-        self.mock_resource.Volume.side_effect = [
-            self.first_volume, self.second_volume]
-
-        self.boto3.resource = MagicMock(
-            name='mock_resource_contructor', return_value=self.mock_resource)
-
-        self.mock_session = MagicMock(name='mock_session')
-
-        self.mock_session.client.return_value = self.ec2_client
+        self.stub_client.activate()
 
-        self.mock_session.resource.return_value = self.mock_resource
+    def tearDown(self):
+        # Turn logging back on
+        logging.disable(logging.NOTSET)
 
-        self.boto3.session.Session = self.mock_session
+        self.stub_client.deactivate()
 
-        modules = {
-            'boto3': self.boto3,
-            'ec2_metadata': MagicMock()
+    def count_call(self, model, **kwargs):
+        self.calls.append(model.name)
+
+    def tagged_volume(self, volume_id, device_name=None, az='fakeAZ'):
+        return {
+            'VolumeId': volume_id,
+            'AvailabilityZone': az,
+            'VolumeType': 'gp2',
+            'Size': 50,
+            'Attachments': [],
+            'Tags': [
+                {
+                    'Key': self.tag_name,
+                    'Value': device_name or self.device_name
+                },
+            ]
         }
 
-        self.default_response = {
-            'Volumes': [
+    def attached_volume(self, volume_id, device_name=None):
+        return {
+            'VolumeId': volume_id,
+            'AvailabilityZone': 'fakeAZ',
+            'Attachments': [
                 {
-                    'Attachments': [],
-                    'AvailabilityZone': 'string',
-                    'CreateTime': datetime.datetime(2015, 1, 1),
-                    'Encrypted': False,
-                    'KmsKeyId': 'string',
-                    'OutpostArn': 'string',
-                    'Size': 123,
-                    'SnapshotId': 'string',
-                    'State': 'available',
-                    'VolumeId': 'vol-XXXXXX',
-                    'Iops': 123,
-                    'Tags': [
-                        {
-                            'Key': 'string',
-                            'Value': 'string'
-                        },
-                    ],
-                    'VolumeType': 'gp2',
-                    'FastRestored': False,
-                    'MultiAttachEnabled': False
-                }
+                    'InstanceId': self.instance_id,
+                    'Device': device_name or self.device_name
+                },
             ]
         }
 
-        self.default_params = {'Filters': ANY}
+    def add_inventory_responses(self, tagged, attached):
+        self.stub_client.add_response(
+            'describe_volumes', {'Volumes': tagged}, self.tag_params)
 
-        self.stub_client.activate()
+        self.stub_client.add_response(
+            'describe_volumes', {'Volumes': attached}, self.attachment_params)
 
-        self.module_patcher = patch.dict('sys.modules', modules)
-        self.module_patcher.start()
+    def add_tag_response(self, volume_id):
+        self.stub_client.add_response('create_tags', {}, {
+            'Resources': [volume_id],
+            'Tags': [{'Key': self.tag_name, 'Value': self.device_name}]
+        })
 
-        from sebs.ec2 import StatefulVolume
+    def volume_params(self, *volume_ids):
+        return {'Filters': [{'Name': 'volume-id', 'Values': list(volume_ids)}]}
 
-        self.StatefulVolume = StatefulVolume
+    def snapshot_params(self, *snapshot_ids):
+        return {'OwnerIds': ['self'],
+                'Filters': [{'Name': 'snapshot-id', 'Values': list(snapshot_ids)}]}
 
-    def tearDown(self):
-        # Turn logging back on
-        logging.disable(logging.NOTSET)
-
-        self.module_patcher.stop()
-        self.stub_client.deactivate()
+    def make_volume(self, **kwargs):
+        return StatefulVolume(self.ec2_client,
+                              self.instance_id,
+                              self.device_name,
+                              self.tag_name,
+                              **kwargs)
 
     def test_class_properties(self):
 
-        sv = self.StatefulVolume(self.mock_session,
-                                 self.instance_id,
-                                 self.device_name,
-                                 self.tag_name)
+        sv = self.make_volume()
 
         self.stub_client.assert_no_pending_responses()
 
@@ -138,71 +135,34 @@ class TestStatefulVolume(unittest.TestCase):
         self.assertEqual(sv.tag_name, self.tag_name, 'Should set the tag name')
         self.assertEqual(sv.ec2_client, self.ec2_client,
                          'Should set an ec2 client')
-        self.assertEqual(sv.ec2_resource, self.mock_resource,
-                         'Should set our mock volume.')
+        self.assertEqual(self.calls, [], 'Should not call AWS.')
 
     def test_status_new(self):
 
-        response = self.default_response.copy()
-        response['Volumes'] = []
-
-        self.stub_client.add_response(
-            'describe_volumes', response, self.default_params)
+        self.add_inventory_responses(
+            [], [self.attached_volume('vol-XXXXXX')])
+        self.add_tag_response('vol-XXXXXX')
 
-        self.stub_client.add_response(
-            'describe_volumes', self.default_response, {'Filters': [
-                {
-                    'Name': 'attachment.instance-id',
-                    'Values': [self.instance_id]
-                },
-                {
-                    'Name': 'attachment.device',
-                    'Values': [
-                        self.device_name,
-                    ]
-                }
-            ]})
-
-        sv = self.StatefulVolume(self.mock_session,
-                                 self.instance_id,
-                                 self.device_name,
-                                 self.tag_name)
+        sv = self.make_volume()
 
         sv.get_status()
 
         self.stub_client.assert_no_pending_responses()
         self.assertEqual(sv.status, 'Attached',
                          'Volume should be mounted already.')
-        self.assertIsInstance(sv.volume, Mock,
-                              'Should have a boto3 Volume resource')
+        self.assertIsInstance(sv.volume, VolumeRecord,
+                              'Should have a volume record')
+        self.assertEqual(sv.volume.volume_id, 'vol-XXXXXX')
         self.assertEqual(sv.ready, True, 'Should be ready.')
 
     def test_status_missing(self):
 
-        response = self.default_response.copy()
-        response['Volumes'] = []
+        # Volumes at other devices should not count as ours
+        self.add_inventory_responses(
+            [self.tagged_volume('vol-1111', '/dev/other')],
+            [self.attached_volume('vol-2222', '/dev/other')])
 
-        self.stub_client.add_response(
-            'describe_volumes', response, self.default_params)
-
-        self.stub_client.add_response(
-            'describe_volumes', response, {'Filters': [
-                {
-                    'Name': 'attachment.instance-id',
-                    'Values': [self.instance_id]
-                },
-                {
-                    'Name': 'attachment.device',
-                    'Values': [
-                        self.device_name,
-                    ]
-                }
-            ]})
-
-        sv = self.StatefulVolume(self.mock_session,
-                                 self.instance_id,
-                                 self.device_name,
-                                 self.tag_name)
+        sv = self.make_volume()
 
         sv.get_status()
 
@@ -215,17 +175,10 @@ class TestStatefulVolume(unittest.TestCase):
 
     def test_status_duplicate(self):
 
-        response = self.default_response.copy()
-        response['Volumes'] = [
-            {'VolumeId': 'vol-1111'}, {'VolumeId': 'vol-2222'}]
-
-        self.stub_client.add_response(
-            'describe_volumes', response, self.default_params)
+        self.add_inventory_responses(
+            [self.tagged_volume('vol-1111'), self.tagged_volume('vol-2222')], [])
 
-        sv = self.StatefulVolume(self.mock_session,
-                                 self.instance_id,
-                                 self.device_name,
-                                 self.tag_name)
+        sv = self.make_volume()
 
         sv.get_status()
 
@@ -238,66 +191,74 @@ class TestStatefulVolume(unittest.TestCase):
 
     def test_status_not_attached(self):
 
-        self.stub_client.add_response(
-            'describe_volumes', self.default_response, self.default_params)
+        self.add_inventory_responses([self.tagged_volume('vol-1111')], [])
 
-        sv = self.StatefulVolume(self.mock_session,
-                                 self.instance_id,
-                                 self.device_name,
-                                 self.tag_name)
+        sv = self.make_volume()
 
         sv.get_status()
 
         self.stub_client.assert_no_pending_responses()
         self.assertEqual(sv.status, 'Not Attached',
                          'Should find an existing volume')
-        self.assertEqual(sv.volume, self.first_volume,
-                         'Should be our volume mock')
+        self.assertEqual(sv.volume.volume_id, 'vol-1111',
+                         'Should be our tagged volume')
+        self.assertEqual(sv.volume.availability_zone, 'fakeAZ',
+                         'Should keep the details from the search')
         self.assertEqual(sv.ready, False, 'Volume should not be Ready')
 
-    def test_volume_tagging(self):
-        response = self.default_response.copy()
-        response['Volumes'] = []
+    def test_status_attached(self):
+        volume = self.tagged_volume('vol-1111')
+        volume['Attachments'] = [
+            {'InstanceId': self.instance_id, 'Device': self.device_name}]
 
-        self.stub_client.add_response(
-            'describe_volumes', response, {'Filters': [
-                {
-                    'Name': f'tag:{self.tag_name}',
-                    'Values': [self.device_name]
-                }
-            ]})
+        self.add_inventory_responses([volume], [volume])
+        self.add_tag_response('vol-1111')
 
-        self.stub_client.add_response(
-            'describe_volumes', self.default_response, {'Filters': [
-                {
-                    'Name': 'attachment.instance-id',
-                    'Values': [self.instance_id]
-                },
-                {
-                    'Name': 'attachment.device',
-                    'Values': [
-                        self.device_name,
-                    ]
-                }
-            ]})
-
-        sv = self.StatefulVolume(self.mock_session,
-                                 self.instance_id,
-                                 self.device_name,
-                                 self.tag_name)
+        sv = self.make_volume()
 
         sv.get_status()
+        sv.tag_volume()
 
+        self.stub_client.assert_no_pending_responses()
+        self.assertEqual(sv.status, 'Attached',
+                         'Should already be attached to us.')
+
+    def test_attached_boot_api_calls(self):
+        # A normal boot should only search for volumes and then tag them
+        volume = self.tagged_volume('vol-1111')
+        volume['Attachments'] = [
+            {'InstanceId': self.instance_id, 'Device': self.device_name}]
+
+        self.add_inventory_responses([volume], [volume])
+        self.add_tag_response('vol-1111')
+
+        sv = self.make_volume()
+
+        sv.get_status()
+        sv.copy('fakeAZ')
+        sv.attach()
         sv.tag_volume()
 
-        self.first_volume.create_tags.assert_called_with(
-            Tags=[{'Key': self.tag_name, 'Value': self.device_name}])
+        self.stub_client.assert_no_pending_responses()
+        self.assertEqual(self.calls, ['DescribeVolumes', 'DescribeVolumes', 'CreateTags'],
+                         'Should not load any volume details a second time.')
+
+    def test_volume_tagging(self):
+        self.add_inventory_responses(
+            [], [self.attached_volume('vol-XXXXXX')])
+        self.add_tag_response('vol-XXXXXX')
+        self.add_tag_response('vol-XXXXXX')
+
+        sv = self.make_volume()
+
+        sv.get_status()
+
+        sv.tag_volume()
+
+        self.stub_client.assert_no_pending_responses()
 
     def test_copy_new(self):
-        sv = self.StatefulVolume(self.mock_session,
-                                 self.instance_id,
-                                 self.device_name,
-                                 self.tag_name)
+        sv = self.make_volume()
         sv.status = 'New'
 
         response = sv.copy('fakeAZ')
@@ -306,12 +267,8 @@ class TestStatefulVolume(unittest.TestCase):
                          "Should do nothing if status in not 'Not Attached'.")
 
     def test_copy_same_az(self):
-        sv = self.StatefulVolume(self.mock_session,
-                                 self.instance_id,
-                                 self.device_name,
-                                 self.tag_name)
+        sv = self.make_volume()
 
-        self.first_volume.availability_zone = 'fakeAZ'
         sv.status = 'Not Attached'
         sv.volume = self.first_volume
 
@@ -319,49 +276,681 @@ class TestStatefulVolume(unittest.TestCase):
 
         self.assertEqual(response, 'Not Attached',
                          "Should not change the status if in the same AZ.")
-        self.first_volume.copy.assert_not_called()
+        self.assertEqual(self.calls, [], 'Should not copy the volume.')
 
     def test_copy_different_az(self):
 
+        self.stub_client.add_response('create_snapshot', {'SnapshotId': 'sn-12345', 'VolumeId': 'vol-1111'}, {
+                                      'VolumeId': 'vol-1111',
+                                      'Description': ANY,
+                                      'TagSpecifications': ANY})
+
+        # Lets another run pick up the snapshot if this one is interrupted
+        self.stub_client.add_response('create_tags', {}, {
+            'Resources': ['vol-1111'],
+            'Tags': [{'Key': 'sebs:final-snapshot', 'Value': 'sn-12345'}]})
+
+        self.stub_client.add_response('describe_snapshots', {'Snapshots': [
+                                      {'SnapshotId': 'sn-12345', 'State': 'completed'}]}, self.snapshot_params('sn-12345'))
+
         self.stub_client.add_response(
             'create_volume', {'VolumeId': 'vol-2222',
                               'AvailabilityZone': 'newAZ',
                               'Encrypted': True,
                               'Size': 50,
-                              'SnapshotId': 'sn-2323',
+                              'SnapshotId': 'sn-12345',
                               'VolumeType': 'gp2'}, {'AvailabilityZone': 'newAZ',
-                                                     'SnapshotId': ANY,
-                                                     'VolumeType': ANY,
+                                                     'SnapshotId': 'sn-12345',
+                                                     'VolumeType': 'gp2',
+                                                     'Size': 50,
+                                                     'ClientToken': ANY,
                                                      'TagSpecifications': ANY})
 
         self.stub_client.add_response('describe_volumes', {'Volumes': [
-                                      {'VolumeId': 'vol-2222', 'State': 'available'}]}, {'VolumeIds': ['vol-2222']})
+                                      {'VolumeId': 'vol-2222', 'State': 'available'}]}, self.volume_params('vol-2222'))
 
-        sv = self.StatefulVolume(self.mock_session,
-                                 self.instance_id,
-                                 self.device_name,
-                                 self.tag_name)
+        self.stub_client.add_response(
+            'delete_volume', {}, {'VolumeId': 'vol-1111'})
+
+        self.stub_client.add_response(
+            'delete_snapshot', {}, {'SnapshotId': 'sn-12345'})
+
+        sv = self.make_volume()
 
-        self.first_volume.availability_zone = 'fakeAZ'
         sv.status = 'Not Attached'
-        sv.volume = self.mock_resource.Volume()
+        sv.volume = self.first_volume
 
         response = sv.copy('newAZ')
 
-        # Last test we need here is that we are actually creating a second volume
+        self.assertNotIn('DeleteVolume', self.calls,
+                         'Should leave cleanup until every device is attached.')
+        self.assertEqual(len(sv.cleanup.tasks), 2,
+                         'Should queue the old volume and snapshot for cleanup.')
+
+        self.assertEqual(sv.cleanup.run(), [], 'Should clean up both.')
+
         self.assertEqual(response, 'Not Attached',
                          'Should not change the status after a copy')
         self.assertFalse(sv.ready, 'We should not be ready after copying.')
-        self.assertEqual(sv.volume, self.second_volume,
+        self.assertEqual(sv.volume.volume_id, 'vol-2222',
                          'Should have our second volume.')
-        self.first_volume.delete.assert_called_once()
-        self.mock_snapshot.delete.assert_called_once()
+        self.assertEqual(sv.volume.availability_zone, 'newAZ',
+                         'Should use the details from create_volume.')
+        self.stub_client.assert_no_pending_responses()
+
+    def add_copy_responses(self):
+        self.stub_client.add_response('create_snapshot', {'SnapshotId': 'sn-12345', 'VolumeId': 'vol-1111'}, {
+                                      'VolumeId': 'vol-1111',
+                                      'Description': ANY,
+                                      'TagSpecifications': ANY})
+
+        # Lets another run pick up the snapshot if this one is interrupted
+        self.stub_client.add_response('create_tags', {}, {
+            'Resources': ['vol-1111'],
+            'Tags': [{'Key': 'sebs:final-snapshot', 'Value': 'sn-12345'}]})
+
+        self.stub_client.add_response('describe_snapshots', {'Snapshots': [
+                                      {'SnapshotId': 'sn-12345', 'State': 'completed'}]}, self.snapshot_params('sn-12345'))
+
+    def add_create_responses(self, **create_params):
+        params = {'AvailabilityZone': 'newAZ',
+                  'SnapshotId': 'sn-12345',
+                  'VolumeType': 'gp2',
+                  'Size': 50,
+                  'ClientToken': ANY,
+                  'TagSpecifications': ANY}
+        params.update(create_params)
+
+        self.stub_client.add_response(
+            'create_volume', {'VolumeId': 'vol-2222', 'AvailabilityZone': 'newAZ'}, params)
+
+        self.stub_client.add_response('describe_volumes', {'Volumes': [
+                                      {'VolumeId': 'vol-2222', 'State': 'available'}]}, self.volume_params('vol-2222'))
+
+    def add_cleanup_responses(self):
+        self.stub_client.add_response(
+            'delete_volume', {}, {'VolumeId': 'vol-1111'})
+
+        self.stub_client.add_response(
+            'delete_snapshot', {}, {'SnapshotId': 'sn-12345'})
+
+    def fast_restore_params(self):
+        return {'AvailabilityZones': ['newAZ'], 'SourceSnapshotIds': ['sn-12345']}
+
+    def test_copy_fast_restore(self):
+        self.add_copy_responses()
+
+        self.stub_client.add_response('enable_fast_snapshot_restores', {
+                                      'Successful': [{'SnapshotId': 'sn-12345', 'State': 'enabling'}]}, self.fast_restore_params())
+
+        self.stub_client.add_response('describe_fast_snapshot_restores', {'FastSnapshotRestores': [
+                                      {'SnapshotId': 'sn-12345', 'AvailabilityZone': 'newAZ', 'State': 'enabled'}]}, {
+                                      'Filters': [
+                                          {'Name': 'snapshot-id', 'Values': [
+                                              'sn-12345']},
+                                          {'Name': 'availability-zone',
+                                              'Values': ['newAZ']},
+                                      ]})
+
+        self.add_create_responses()
+
+        # Fast restore costs money so it must be turned off again
+        self.stub_client.add_response('disable_fast_snapshot_restores', {
+        }, self.fast_restore_params())
+
+        self.add_cleanup_responses()
+
+        sv = self.make_volume(fast_restore=True)
+        sv.status = 'Not Attached'
+        sv.volume = self.first_volume
+
+        sv.copy('newAZ')
+        sv.cleanup.run()
+
+        self.stub_client.assert_no_pending_responses()
+
+    def test_copy_fast_restore_unavailable(self):
+        self.add_copy_responses()
+
+        self.stub_client.add_response('enable_fast_snapshot_restores', {'Unsuccessful': [
+            {'SnapshotId': 'sn-12345', 'FastSnapshotRestoreStateErrors': [
+                {'AvailabilityZone': 'newAZ', 'Error': {'Code': 'Limit', 'Message': 'Limit reached'}}]}]},
+            self.fast_restore_params())
+
+        # We should still copy the volume without fast restore
+        self.add_create_responses()
+        self.add_cleanup_responses()
+
+        sv = self.make_volume(fast_restore=True)
+        sv.status = 'Not Attached'
+        sv.volume = self.first_volume
+
+        sv.copy('newAZ')
+        sv.cleanup.run()
+
+        self.stub_client.assert_no_pending_responses()
+        self.assertEqual(sv.volume.volume_id, 'vol-2222')
+
+    def test_copy_fast_restore_denied(self):
+        self.add_copy_responses()
+
+        self.stub_client.add_client_error('enable_fast_snapshot_restores', 'UnauthorizedOperation',
+                                          'You are not authorized to perform this operation.',
+                                          expected_params=self.fast_restore_params())
+
+        # A missing permission should not fail the copy
+        self.add_create_responses()
+        self.add_cleanup_responses()
+
+        sv = self.make_volume(fast_restore=True)
+        sv.status = 'Not Attached'
+        sv.volume = self.first_volume
+
+        sv.copy('newAZ')
+        sv.cleanup.run()
+
+        self.stub_client.assert_no_pending_responses()
+        self.assertEqual(sv.volume.volume_id, 'vol-2222')
+
+    def test_copy_group_snapshot(self):
+        # The snapshot was already taken with the other devices
+        self.stub_client.add_response('describe_snapshots', {'Snapshots': [
+                                      {'SnapshotId': 'sn-12345', 'State': 'completed'}]}, self.snapshot_params('sn-12345'))
+        self.add_create_responses()
+        self.add_cleanup_responses()
+
+        sv = self.make_volume()
+        sv.status = 'Not Attached'
+        sv.volume = self.first_volume
+        sv.snapshot_id = 'sn-12345'
+
+        sv.copy('newAZ')
+        sv.cleanup.run()
+
+        self.stub_client.assert_no_pending_responses()
+        self.assertNotIn('CreateSnapshot', self.calls)
+
+    def standby_params(self):
+        return {'OwnerIds': ['self'],
+                'Filters': [{'Name': 'tag:sebs:standby', 'Values': ['sebs:/dev/xdf']}]}
+
+    def add_no_standby_volumes(self):
+        self.stub_client.add_response('describe_volumes', {'Volumes': []}, {'Filters': [
+            {'Name': 'tag:sebs:standby-volume', 'Values': ['sebs:/dev/xdf']},
+            {'Name': 'availability-zone', 'Values': ['newAZ']}]})
+
+    def test_copy_standby_snapshot(self):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.add_no_standby_volumes()
+
+        self.stub_client.add_response('describe_snapshots', {'Snapshots': [
+            {'SnapshotId': 'sn-12345', 'State': 'completed',
+             'StartTime': now - datetime.timedelta(minutes=10)},
+            {'SnapshotId': 'sn-pending', 'State': 'pending',
+             'StartTime': now - datetime.timedelta(minutes=1)},
+            {'SnapshotId': 'sn-old', 'State': 'completed',
+             'StartTime': now - datetime.timedelta(hours=2)},
+        ]}, self.standby_params())
+
+        self.stub_client.add_response('describe_snapshots', {'Snapshots': [
+                                      {'SnapshotId': 'sn-12345', 'State': 'completed'}]}, self.snapshot_params('sn-12345'))
+        self.add_create_responses()
+
+        # Only the old volume is deleted, the daemon owns the snapshot
+        self.stub_client.add_response(
+            'delete_volume', {}, {'VolumeId': 'vol-1111'})
+
+        sv = self.make_volume(reuse_snapshot=3600)
+        sv.status = 'Not Attached'
+        sv.volume = self.first_volume
+
+        sv.copy('newAZ')
+        sv.cleanup.run()
+
+        self.stub_client.assert_no_pending_responses()
+        self.assertNotIn('CreateSnapshot', self.calls)
+
+    def test_copy_standby_too_old(self):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.add_no_standby_volumes()
+
+        self.stub_client.add_response('describe_snapshots', {'Snapshots': [
+            {'SnapshotId': 'sn-old', 'State': 'completed',
+             'StartTime': now - datetime.timedelta(hours=2)},
+        ]}, self.standby_params())
+
+        self.add_copy_responses()
+        self.add_create_responses()
+        self.add_cleanup_responses()
+
+        sv = self.make_volume(reuse_snapshot=3600)
+        sv.status = 'Not Attached'
+        sv.volume = self.first_volume
+
+        sv.copy('newAZ')
+        sv.cleanup.run()
+
+        self.stub_client.assert_no_pending_responses()
+
+    def test_copy_standby_attached(self):
+        # A volume still attached elsewhere always gets a final snapshot
+        volume = self.tagged_volume('vol-1111')
+        volume['Attachments'] = [{'InstanceId': 'i-old', 'Device': self.device_name}]
+
+        sv = self.make_volume(reuse_snapshot=3600)
+        sv.volume = VolumeRecord(volume)
+
+        self.assertIsNone(sv.latest_standby_snapshot())
+        self.assertEqual(self.calls, [])
+
+    def test_create_standby_snapshot(self):
+        self.stub_client.add_response('create_snapshot', {'SnapshotId': 'sn-12345'}, {
+            'VolumeId': 'vol-1111',
+            'Description': 'Standby snapshot for SEBS.',
+            'TagSpecifications': [{'ResourceType': 'snapshot', 'Tags': [
+                {'Key': self.tag_name, 'Value': self.device_name},
+                {'Key': 'sebs:standby', 'Value': 'sebs:/dev/xdf'}]}]})
+
+        sv = self.make_volume()
+        sv.volume = self.first_volume
+
+        self.assertEqual(sv.create_standby_snapshot(), 'sn-12345')
+        self.stub_client.assert_no_pending_responses()
+
+    def test_promote_standby_volume(self):
+        ec2 = FakeEC2()
+        old = ec2.add_volume('fakeAZ', {self.tag_name: self.device_name})
+        stale = ec2.add_volume('newAZ', {'sebs:standby-volume': 'sebs:/dev/xdf',
+                                         'sebs:snapshot-time': str(int(time.time()) - 600)})
+        fresh = ec2.add_volume('newAZ', {'sebs:standby-volume': 'sebs:/dev/xdf',
+                                         'sebs:snapshot': 'snap-9999',
+                                         'sebs:snapshot-time': str(int(time.time()) - 60)})
+        # Another AZ and another device should never be promoted
+        ec2.add_volume('otherAZ', {'sebs:standby-volume': 'sebs:/dev/xdf',
+                                   'sebs:snapshot-time': str(int(time.time()))})
+        ec2.add_volume('newAZ', {'sebs:standby-volume': 'sebs:/dev/xdg',
+                                 'sebs:snapshot-time': str(int(time.time()))})
+
+        sv = StatefulVolume(ec2, self.instance_id, self.device_name, self.tag_name,
+                            reuse_snapshot=300)
+        sv.status = 'Not Attached'
+        sv.volume = VolumeRecord(ec2.volumes[old])
+
+        sv.copy('newAZ')
+
+        self.assertEqual(sv.volume.volume_id, fresh, 'Should use the newest standby.')
+        self.assertTrue(sv.copied, 'A standby is restored from a snapshot.')
+        self.assertNotIn('CreateSnapshot', ec2.calls)
+        self.assertNotIn('CreateVolume', ec2.calls)
+        self.assertEqual(ec2.tags(fresh), {self.tag_name: self.device_name,
+                                           'sebs:restored-from': old},
+                         'Should swap the standby tags for the control tag.')
+        self.assertIn('sebs:standby-volume', ec2.tags(stale))
+        self.assertIn('promote', sv.timings)
+
+        self.assertEqual(sv.cleanup.run(), [])
+        self.assertNotIn(old, ec2.volumes, 'Should delete the old volume.')
+
+    def test_final_snapshot_over_standby(self):
+        ec2 = FakeEC2(auto_finish=True)
+        old = ec2.add_volume('fakeAZ', {self.tag_name: self.device_name})
+        # Taken by on-terminate once the volume was detached
+        final = ec2.add_snapshot(old)
+        ec2.volumes[old]['Tags'].append({'Key': 'sebs:final-snapshot', 'Value': final})
+        standby = ec2.add_volume('newAZ', {'sebs:standby-volume': 'sebs:/dev/xdf',
+                                           'sebs:snapshot-time': str(int(time.time()) - 1800)})
+        ec2.add_snapshot(old, {'sebs:standby': 'sebs:/dev/xdf'})
+
+        sv = StatefulVolume(ec2, self.instance_id, self.device_name, self.tag_name,
+                            reuse_snapshot=3600)
+        sv.status = 'Not Attached'
+        sv.volume = VolumeRecord(ec2.volumes[old])
+
+        self.assertIsNone(sv.latest_standby_snapshot())
+
+        sv.copy('newAZ')
+
+        self.assertNotEqual(sv.volume.volume_id, standby,
+                            'A standby would lose what was written after it.')
+        self.assertEqual(ec2.volumes[sv.volume.volume_id]['SnapshotId'], final)
+        self.assertIn('sebs:standby-volume', ec2.tags(standby))
+
+    def test_promote_stale_standby_volume(self):
+        ec2 = FakeEC2()
+        old = ec2.add_volume('fakeAZ', {self.tag_name: self.device_name})
+        ec2.add_volume('newAZ', {'sebs:standby-volume': 'sebs:/dev/xdf',
+                                 'sebs:snapshot-time': str(int(time.time()) - 600)})
+
+        sv = StatefulVolume(ec2, self.instance_id, self.device_name, self.tag_name,
+                            reuse_snapshot=300)
+        sv.status = 'Not Attached'
+        sv.volume = VolumeRecord(ec2.volumes[old])
+
+        self.assertFalse(sv.promote_standby_volume('newAZ'),
+                         'Should copy instead of using an old standby.')
+
+        # Without --reuse-snapshot standby volumes are never looked up
+        sv.reuse_snapshot = None
+        ec2.calls = []
+
+        self.assertFalse(sv.promote_standby_volume('newAZ'))
+        self.assertEqual(ec2.calls, [])
+
+    def test_detach_and_snapshot(self):
+        self.stub_client.add_response('detach_volume', {}, {
+            'Device': self.device_name,
+            'InstanceId': self.instance_id,
+            'VolumeId': 'vol-1111'})
+
+        self.stub_client.add_response('describe_volumes', {'Volumes': [
+                                      {'VolumeId': 'vol-1111', 'State': 'available'}]}, self.volume_params('vol-1111'))
+
+        self.stub_client.add_response('create_snapshot', {'SnapshotId': 'sn-12345'}, {
+            'VolumeId': 'vol-1111',
+            'Description': 'Final snapshot for SEBS.',
+            'TagSpecifications': ANY})
+
+        self.stub_client.add_response('create_tags', {}, {
+            'Resources': ['vol-1111'],
+            'Tags': [{'Key': 'sebs:final-snapshot', 'Value': 'sn-12345'}]})
+
+        sv = self.make_volume()
+        sv.status = 'Attached'
+        sv.volume = self.first_volume
+
+        self.assertEqual(sv.detach_and_snapshot(), 'sn-12345')
+        self.assertEqual(sv.status, 'Not Attached')
+        self.stub_client.assert_no_pending_responses()
+
+    def test_copy_final_snapshot(self):
+        volume = self.tagged_volume('vol-1111')
+        volume['Tags'].append({'Key': 'sebs:final-snapshot', 'Value': 'sn-12345'})
+
+        self.stub_client.add_response('describe_snapshots', {'Snapshots': [
+                                      {'SnapshotId': 'sn-12345', 'State': 'completed'}]}, self.snapshot_params('sn-12345'))
+        self.add_create_responses()
+        # The final snapshot is only good for one restore
+        self.add_cleanup_responses()
+
+        sv = self.make_volume()
+        sv.status = 'Not Attached'
+        sv.volume = VolumeRecord(volume)
+
+        sv.copy('newAZ')
+        sv.cleanup.run()
+
+        self.stub_client.assert_no_pending_responses()
+        self.assertNotIn('CreateSnapshot', self.calls)
+
+    def interrupted_restore(self):
+        # A restore to newAZ that stopped after it created the copy
+        ec2 = FakeEC2(auto_finish=True)
+        instance = ec2.add_instance('newAZ')
+        old = ec2.add_volume('fakeAZ', {self.tag_name: self.device_name})
+        snapshot = ec2.add_snapshot(old)
+        ec2.create_tags(Resources=[old], Tags=[{'Key': 'sebs:final-snapshot', 'Value': snapshot}])
+        copy = ec2.add_volume('newAZ', {self.tag_name: self.device_name,
+                                        'sebs:restored-from': old})
+
+        return ec2, instance, copy
+
+    def test_resume_interrupted_copy(self):
+        ec2, instance, copy = self.interrupted_restore()
+        sv = StatefulVolume(ec2, instance, self.device_name, self.tag_name)
+
+        self.assertEqual(sv.get_status(), 'Not Attached',
+                         'Should not mistake the copy for a duplicate.')
+
+        sv.copy('newAZ')
+        sv.attach()
+
+        self.assertEqual(sv.cleanup.run(), [])
+        self.assertEqual(sv.volume.volume_id, copy)
+        self.assertNotIn('CreateSnapshot', ec2.calls)
+        self.assertNotIn('CreateVolume', ec2.calls)
+        self.assertEqual(list(ec2.volumes), [copy], 'Should delete the old volume.')
+        self.assertEqual(ec2.snapshots, {}, 'Should delete the final snapshot.')
+        self.assertEqual(ec2.tags(copy), {self.tag_name: self.device_name},
+                         'An attached copy should no longer look interrupted.')
+
+    def test_resume_attached_copy(self):
+        ec2, instance, copy = self.interrupted_restore()
+        ec2.attach_volume(Device=self.device_name, InstanceId=instance, VolumeId=copy)
+
+        sv = StatefulVolume(ec2, instance, self.device_name, self.tag_name)
+
+        self.assertEqual(sv.get_status(), 'Attached')
+        self.assertEqual(sv.volume.volume_id, copy)
+        self.assertNotIn('sebs:restored-from', ec2.tags(copy))
+        self.assertEqual(sv.cleanup.run(), [])
+        self.assertEqual(list(ec2.volumes), [copy],
+                         'Should finish the cleanup the last run never got to.')
+
+    def test_stale_interrupted_copy(self):
+        ec2, instance, copy = self.interrupted_restore()
+        old = next(volume_id for volume_id in ec2.volumes if volume_id != copy)
+        # The old instance came back and is writing to its volume again
+        ec2.attach_volume(Device=self.device_name, InstanceId=ec2.add_instance('fakeAZ'),
+                          VolumeId=old)
+
+        sv = StatefulVolume(ec2, instance, self.device_name, self.tag_name)
+        sv.get_status()
+        sv.copy('newAZ')
+
+        self.assertNotEqual(sv.volume.volume_id, copy, 'Should not attach an old copy.')
+        self.assertIn('CreateSnapshot', ec2.calls)
+
+        sv.attach()
+        sv.cleanup.run()
+
+        self.assertNotIn(copy, ec2.volumes, 'Should discard the old copy.')
+
+        # A snapshot taken with the other devices is never left unused
+        ec2, instance, copy = self.interrupted_restore()
+        sv = StatefulVolume(ec2, instance, self.device_name, self.tag_name)
+        sv.get_status()
+        sv.snapshot_id = ec2.add_snapshot(sv.volume.volume_id)
+        sv.copy('newAZ')
+
+        self.assertEqual(ec2.volumes[sv.volume.volume_id]['SnapshotId'], sv.snapshot_id)
+
+    def test_untag_denied(self):
+        ec2, instance, copy = self.interrupted_restore()
+        denied = ClientError({'Error': {'Code': 'UnauthorizedOperation', 'Message': 'denied'}},
+                             'DeleteTags')
+
+        with patch.object(ec2, 'delete_tags', side_effect=denied):
+            sv = StatefulVolume(ec2, instance, self.device_name, self.tag_name)
+            sv.get_status()
+            sv.copy('newAZ')
+
+            self.assertEqual(sv.attach(), 'Attached', 'The copy is attached anyway.')
+            self.assertEqual(sv.cleanup.run(), [])
+
+            sv = StatefulVolume(ec2, instance, self.device_name, self.tag_name)
+
+            self.assertEqual(sv.get_status(), 'Attached',
+                             'Should still start on the next boot.')
+
+        self.assertEqual(list(ec2.volumes), [copy])
+
+    def test_completed_copy_is_duplicate(self):
+        ec2 = FakeEC2(auto_finish=True)
+        first = ec2.add_instance('fakeAZ')
+        original = ec2.add_volume('fakeAZ', {self.tag_name: self.device_name})
+
+        # Restored to newAZ and attached, but the old volume was never deleted
+        sv = StatefulVolume(ec2, ec2.add_instance('newAZ'), self.device_name, self.tag_name)
+        sv.status = 'Not Attached'
+        sv.volume = VolumeRecord(ec2.volumes[original])
+        sv.copy('newAZ')
+        sv.attach()
+        copy = sv.volume.volume_id
+        ec2.detach_volume(Device=self.device_name, InstanceId=sv.instance_id, VolumeId=copy)
+
+        ec2.calls = []
+        sv = StatefulVolume(ec2, first, self.device_name, self.tag_name)
+
+        self.assertEqual(sv.get_status(), 'Duplicate',
+                         'A copy that was in use must never be thrown away.')
+        self.assertEqual(sv.cleanup.run(), [])
+        self.assertIn(original, ec2.volumes)
+        self.assertIn(copy, ec2.volumes)
+        self.assertNotIn('DeleteVolume', ec2.calls)
+
+    def test_resume_journaled_snapshot(self):
+        ec2 = FakeEC2(auto_finish=True)
+        instance = ec2.add_instance('newAZ')
+        old = ec2.add_volume('fakeAZ', {self.tag_name: self.device_name})
+        # The last run died before it could tag the volume
+        snapshot = ec2.add_snapshot(old, state='pending')
+        journal = RestoreJournal()
+        journal.update(f'{self.tag_name}:{self.device_name}', phase='snapshot',
+                       source=old, snapshot=snapshot)
+
+        sv = StatefulVolume(ec2, instance, self.device_name, self.tag_name,
+                            journal=journal)
+        sv.get_status()
+        sv.copy('newAZ')
+
+        self.assertNotIn('CreateSnapshot', ec2.calls)
+        self.assertEqual(ec2.volumes[sv.volume.volume_id]['SnapshotId'], snapshot)
+        self.assertEqual(journal.get(f'{self.tag_name}:{self.device_name}')['volume'],
+                         sv.volume.volume_id)
+
+        # A retried create_volume gets the same volume back
+        sv.volume = VolumeRecord(ec2.volumes[old])
+        sv.copy('newAZ')
+
+        self.assertEqual(ec2.calls.count('CreateVolume'), 2)
+        self.assertEqual(len(ec2.volumes), 2, 'Should never leak a second copy.')
+
+        sv.attach()
+
+        self.assertEqual(journal.get(f'{self.tag_name}:{self.device_name}'), {},
+                         'Should forget the restore once it is attached.')
+
+    def test_attach_drops_final_snapshot(self):
+        volume = self.tagged_volume('vol-2222')
+        volume['Tags'].append({'Key': 'sebs:final-snapshot', 'Value': 'sn-12345'})
+
+        self.add_inventory_responses([volume], [])
+
+        self.stub_client.add_response('attach_volume', {}, {
+            'Device': self.device_name,
+            'InstanceId': self.instance_id,
+            'VolumeId': 'vol-2222'})
+
+        self.stub_client.add_response('describe_volumes', {'Volumes': [
+                                      {'VolumeId': 'vol-2222', 'State': 'in-use'}]}, self.volume_params('vol-2222'))
+
+        self.stub_client.add_response(
+            'delete_snapshot', {}, {'SnapshotId': 'sn-12345'})
+
+        self.stub_client.add_response('delete_tags', {}, {
+            'Resources': ['vol-2222'],
+            'Tags': [{'Key': 'sebs:final-snapshot'}]})
+
+        sv = self.make_volume()
+        sv.get_status()
+        sv.attach()
+        sv.cleanup.run()
+
+        self.stub_client.assert_no_pending_responses()
+
+    def test_copy_init_rate(self):
+        self.add_copy_responses()
+        self.add_create_responses(VolumeInitializationRate=300)
+        self.add_cleanup_responses()
+
+        sv = self.make_volume(init_rate=300)
+        sv.status = 'Not Attached'
+        sv.volume = self.first_volume
+
+        sv.copy('newAZ')
+        sv.cleanup.run()
+
+        self.stub_client.assert_no_pending_responses()
+
+    def test_copy_keeps_settings(self):
+        volume = self.tagged_volume('vol-1111')
+        volume.update({'VolumeType': 'gp3', 'Size': 500, 'Iops': 16000, 'Throughput': 1000,
+                       'Encrypted': True, 'KmsKeyId': 'arn:aws:kms:key'})
+
+        sv = self.make_volume()
+        sv.volume = VolumeRecord(volume)
+
+        self.assertEqual(sv.volume_settings(), {
+            'VolumeType': 'gp3',
+            'Size': 500,
+            'Iops': 16000,
+            'Throughput': 1000,
+            'Encrypted': True,
+            'KmsKeyId': 'arn:aws:kms:key',
+        }, 'Should carry over size, performance and encryption.')
+
+    def test_copy_io2_settings(self):
+        volume = self.tagged_volume('vol-1111')
+        volume.update({'VolumeType': 'io2', 'Size': 100, 'Iops': 20000,
+                       'MultiAttachEnabled': True})
+
+        sv = self.make_volume()
+        sv.volume = VolumeRecord(volume)
+
+        self.assertEqual(sv.volume_settings(), {
+            'VolumeType': 'io2',
+            'Size': 100,
+            'Iops': 20000,
+            'MultiAttachEnabled': True,
+        }, 'Should not send throughput for io2.')
+
+    def test_copy_gp2_settings(self):
+        volume = self.tagged_volume('vol-1111')
+        volume['Iops'] = 150
+
+        sv = self.make_volume()
+        sv.volume = VolumeRecord(volume)
+
+        self.assertEqual(sv.volume_settings(), {'VolumeType': 'gp2', 'Size': 50},
+                         'Should not send the baseline iops of gp2.')
+
+    def test_copy_overrides(self):
+        volume = self.tagged_volume('vol-1111')
+        volume['Iops'] = 150
+
+        # Migrate from gp2 to gp3 while copying
+        sv = self.make_volume(overrides={'VolumeType': 'gp3', 'Throughput': 500})
+        sv.volume = VolumeRecord(volume)
+
+        self.assertEqual(sv.volume_settings(), {
+            'VolumeType': 'gp3',
+            'Size': 50,
+            'Throughput': 500,
+        }, 'Should not carry gp2 iops over to gp3.')
+
+        sv.overrides = {'VolumeType': 'gp3', 'Iops': 6000, 'Size': 80}
+
+        self.assertEqual(sv.volume_settings(), {
+            'VolumeType': 'gp3',
+            'Size': 80,
+            'Iops': 6000,
+        })
+
+    def test_copy_encrypted_override(self):
+        volume = self.tagged_volume('vol-1111')
+        volume.update({'Encrypted': True, 'KmsKeyId': 'arn:aws:kms:key'})
+
+        sv = self.make_volume(overrides={'Encrypted': False})
+        sv.status = 'Not Attached'
+        sv.volume = VolumeRecord(volume)
+
+        with self.assertRaisesRegex(ValueError, 'encrypted'):
+            sv.copy('newAZ')
+
+        self.assertEqual(self.calls, [], 'Should not snapshot a volume it can not copy.')
 
     def test_attach_new(self):
-        sv = self.StatefulVolume(self.mock_session,
-                                 self.instance_id,
-                                 self.device_name,
-                                 self.tag_name)
+        sv = self.make_volume()
         sv.status = 'New'
 
         response = sv.attach()
@@ -371,43 +960,181 @@ class TestStatefulVolume(unittest.TestCase):
 
     def test_attach(self):
 
-        self.stub_client.add_response('describe_volumes', {'Volumes': [
-                                      {'VolumeId': 'vol-1111', 'State': 'in-use'}]}, {'Filters': [
-                                          {
-                                              'Name': 'attachment.instance-id',
-                                              'Values': [
-                                                  self.instance_id,
-                                              ]
-                                          },
-                                          {
-                                              'Name': 'attachment.device',
-                                              'Values': [
-                                                  self.device_name,
-                                              ]
-                                          },
-                                      ]})
+        self.add_inventory_responses(
+            [self.tagged_volume('vol-2222')], [self.attached_volume('vol-1111')])
+
+        self.stub_client.add_response('detach_volume', {}, {
+            'Device': self.device_name,
+            'InstanceId': self.instance_id,
+            'VolumeId': 'vol-1111'})
 
         self.stub_client.add_response('describe_volumes', {'Volumes': [
-                                      {'VolumeId': 'vol-2222', 'State': 'available'}]}, {'VolumeIds': ['vol-1111']})
+                                      {'VolumeId': 'vol-1111', 'State': 'available'}]}, self.volume_params('vol-1111'))
+
+        self.stub_client.add_response('attach_volume', {}, {
+            'Device': self.device_name,
+            'InstanceId': self.instance_id,
+            'VolumeId': 'vol-2222'})
 
         self.stub_client.add_response('describe_volumes', {'Volumes': [
-                                      {'VolumeId': 'vol-2222', 'State': 'in-use'}]}, {'VolumeIds': ['vol-2222']})
+                                      {'VolumeId': 'vol-2222', 'State': 'in-use'}]}, self.volume_params('vol-2222'))
+
+        # We shoud delete the previous volume once everything is attached
+        self.stub_client.add_response(
+            'delete_volume', {}, {'VolumeId': 'vol-1111'})
 
-        sv = self.StatefulVolume(self.mock_session,
-                                 self.instance_id,
-                                 self.device_name,
-                                 self.tag_name)
+        sv = self.make_volume()
 
         sv.status = 'Not Attached'
-        sv.volume = self.second_volume
+        sv.volume = VolumeRecord(self.tagged_volume('vol-2222'))
 
         response = sv.attach()
+        sv.cleanup.run()
 
         self.assertEqual(response, 'Attached',
                          'Should be Attached to the instance.')
         self.assertFalse(sv.ready, 'Should not be Ready')
-        # We shoud delete the previous volume
-        self.first_volume.delete.assert_called_once()
+        self.stub_client.assert_no_pending_responses()
+
+    def test_detach_placeholder_once(self):
+        self.add_inventory_responses(
+            [self.tagged_volume('vol-2222')], [self.attached_volume('vol-1111')])
+
+        self.stub_client.add_response('detach_volume', {}, {
+            'Device': self.device_name,
+            'InstanceId': self.instance_id,
+            'VolumeId': 'vol-1111'})
+
+        self.stub_client.add_response('describe_volumes', {'Volumes': [
+                                      {'VolumeId': 'vol-1111', 'State': 'available'}]}, self.volume_params('vol-1111'))
+
+        self.stub_client.add_response('attach_volume', {}, {
+            'Device': self.device_name,
+            'InstanceId': self.instance_id,
+            'VolumeId': 'vol-2222'})
+
+        self.stub_client.add_response('describe_volumes', {'Volumes': [
+                                      {'VolumeId': 'vol-2222', 'State': 'in-use'}]}, self.volume_params('vol-2222'))
+
+        sv = self.make_volume()
+        sv.status = 'Not Attached'
+        sv.volume = VolumeRecord(self.tagged_volume('vol-2222'))
+
+        sv.detach_placeholder()
+        sv.attach()
+
+        # Attach should reuse the detach that was already done
+        self.stub_client.assert_no_pending_responses()
+        self.assertEqual(list(sv.timings), ['detach', 'attach'],
+                         'Should time each phase.')
+        self.assertEqual(len(sv.cleanup.tasks), 1,
+                         'Should delete the launch volume later.')
+
+    def test_reattach_placeholder(self):
+        self.stub_client.add_response('attach_volume', {}, {
+            'Device': self.device_name,
+            'InstanceId': self.instance_id,
+            'VolumeId': 'vol-1111'})
+
+        self.stub_client.add_response('describe_volumes', {'Volumes': [
+                                      {'VolumeId': 'vol-1111', 'State': 'in-use'}]}, self.volume_params('vol-1111'))
+
+        sv = self.make_volume()
+
+        sv.reattach_placeholder()
+        self.assertEqual(self.calls, [], 'Nothing was detached.')
+
+        sv.placeholder = VolumeRecord(self.attached_volume('vol-1111'))
+        sv.reattach_placeholder()
+
+        self.stub_client.assert_no_pending_responses()
+        self.assertIsNone(sv.placeholder)
+        self.assertEqual(sv.cleanup.tasks, [],
+                         'Should not delete a volume that is back in use.')
+
+    def test_restore_overlaps_detach(self):
+        detached = threading.Event()
+        order = []
+
+        def detach():
+            order.append('detach')
+            detached.set()
+
+        def copy(target_az):
+            # Only finishes if the detach runs while we copy
+            self.assertTrue(detached.wait(5), 'Should detach during the copy.')
+            order.append('copy')
+
+        sv = self.make_volume()
+        sv.status = 'Not Attached'
+        sv.volume = self.first_volume
+
+        with patch.object(sv, 'detach_placeholder', side_effect=detach), \
+                patch.object(sv, 'copy', side_effect=copy), \
+                patch.object(sv, 'attach', side_effect=lambda: order.append('attach')), \
+                patch.object(sv, 'reattach_placeholder') as reattach:
+            sv.restore('newAZ')
+
+        self.assertEqual(order, ['detach', 'copy', 'attach'])
+        reattach.assert_not_called()
+
+    def test_restore_same_az(self):
+        sv = self.make_volume()
+        sv.status = 'Not Attached'
+        sv.volume = self.first_volume
+
+        with patch.object(sv, 'detach_placeholder') as detach, \
+                patch.object(sv, 'copy') as copy, \
+                patch.object(sv, 'attach') as attach:
+            sv.restore('fakeAZ')
+
+        # Attach does its own detach when there is nothing to overlap
+        detach.assert_not_called()
+        copy.assert_not_called()
+        attach.assert_called_once()
+
+    def test_restore_failed_copy(self):
+        sv = self.make_volume()
+        sv.status = 'Not Attached'
+        sv.volume = self.first_volume
+
+        with patch.object(sv, 'detach_placeholder'), \
+                patch.object(sv, 'copy', side_effect=Exception('Snapshot failed')), \
+                patch.object(sv, 'attach') as attach, \
+                patch.object(sv, 'reattach_placeholder') as reattach:
+            with self.assertRaises(Exception):
+                sv.restore('newAZ')
+
+        # The launch volume goes back when the copy fails
+        reattach.assert_called_once()
+        attach.assert_not_called()
+
+    def test_shared_inventory(self):
+        self.add_inventory_responses(
+            [self.tagged_volume('vol-1111'),
+             self.tagged_volume('vol-3333', '/dev/xdg')],
+            [self.attached_volume('vol-2222', '/dev/xdg')])
+
+        inventory = VolumeInventory(
+            self.ec2_client, self.instance_id, self.tag_name)
+
+        first = self.make_volume(inventory=inventory)
+
+        second = StatefulVolume(self.ec2_client,
+                                self.instance_id,
+                                '/dev/xdg',
+                                self.tag_name,
+                                inventory=inventory)
+
+        first.get_status()
+        second.get_status()
+
+        # Both devices should be resolved from the same two searches
+        self.stub_client.assert_no_pending_responses()
+        self.assertEqual(first.status, 'Not Attached',
+                         'Should find the tagged volume.')
+        self.assertEqual(second.status, 'Not Attached',
+                         'Should find the tagged volume.')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,105 @@
+import os
+import json
+import logging
+import tempfile
+import unittest
+from sebs.timing import Timer, prometheus_text, emf_lines, write_reports
+from tests.unit.test_poller import FakeClock
+
+
+class TestTimer(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+        self.clock = FakeClock()
+        self.clock.now = 100.0
+        self.timer = Timer(clock=self.clock, wall=lambda: 1600000000.0)
+        self.timer.tags['instance_id'] = 'i-1234'
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def make_report(self, status='Ready'):
+        with self.timer.span('metadata'):
+            self.clock.sleep(0.25)
+
+        self.timer.add('snapshot', 100.5, 112.5, device='/dev/xvdf', snapshot='sn-1')
+        self.timer.add('attach', 113.0, 115.0, device='/dev/xvdf', volume='vol-1')
+        self.timer.add('attach', 113.0, 114.5, device='/dev/xvdg', volume=None)
+        self.clock.now = 120.0
+
+        return self.timer.report(status)
+
+    def test_report(self):
+        report = self.make_report()
+
+        self.assertEqual(report['status'], 'Ready')
+        self.assertEqual(report['started'], 1600000000.0)
+        self.assertEqual(report['duration'], 20.0)
+        self.assertEqual(report['tags'], {'instance_id': 'i-1234'})
+        self.assertEqual(report['spans'][0], {'name': 'metadata', 'start': 0,
+                                              'duration': 0.25, 'tags': {}})
+        self.assertEqual(report['spans'][1]['tags'], {'device': '/dev/xvdf', 'snapshot': 'sn-1'})
+        self.assertEqual(report['spans'][3]['tags'], {'device': '/dev/xvdg'},
+                         'Should leave out missing ids.')
+
+    def test_span_error(self):
+        with self.assertRaises(ValueError):
+            with self.timer.span('inventory'):
+                raise ValueError('Throttled')
+
+        self.assertEqual(self.timer.spans[0]['error'], 'ValueError: Throttled')
+
+    def test_prometheus(self):
+        text = prometheus_text(self.make_report('Failed'))
+
+        self.assertIn('sebs_phase_duration_seconds{phase="snapshot",device="/dev/xvdf"} 12.0\n', text)
+        self.assertIn('sebs_phase_duration_seconds{phase="metadata",device=""} 0.25\n', text)
+        self.assertIn('sebs_run_duration_seconds 20.0\n', text)
+        self.assertIn('sebs_run_success 0\n', text)
+
+    def test_emf(self):
+        documents = [json.loads(line) for line in emf_lines(self.make_report(), namespace='test')]
+
+        attach = [document for document in documents if document.get('Phase') == 'attach']
+        self.assertEqual([document['PhaseDuration'] for document in attach], [2.0, 1.5])
+        self.assertEqual(attach[0]['_aws']['CloudWatchMetrics'][0]['Namespace'], 'test')
+        self.assertEqual(attach[0]['_aws']['CloudWatchMetrics'][0]['Dimensions'], [['Phase']])
+        self.assertEqual(attach[0]['_aws']['Timestamp'], 1600000000000)
+        self.assertEqual(attach[0]['instance_id'], 'i-1234')
+
+        self.assertEqual(documents[-1]['RunDuration'], 20.0)
+        self.assertEqual(documents[-1]['RunFailed'], 0)
+
+    def test_write_reports(self):
+        report = self.make_report()
+
+        with tempfile.TemporaryDirectory() as reports:
+            json_path = os.path.join(reports, 'report.json')
+            prometheus_path = os.path.join(reports, 'sebs.prom')
+            emf_path = os.path.join(reports, 'metrics.log')
+
+            for _ in range(2):
+                write_reports(report, json_path=json_path,
+                              prometheus_path=prometheus_path, emf_path=emf_path)
+
+            with open(json_path) as output:
+                self.assertEqual(json.load(output), report)
+
+            with open(prometheus_path) as output:
+                self.assertEqual(output.read(), prometheus_text(report))
+
+            with open(emf_path) as output:
+                self.assertEqual(len(output.readlines()), 2 * len(emf_lines(report)),
+                                 'Should append embedded metrics.')
+
+            self.assertEqual(sorted(os.listdir(reports)),
+                             ['metrics.log', 'report.json', 'sebs.prom'])
+
+            # An unwritable report never fails the run
+            write_reports(report, json_path=os.path.join(reports, 'missing', 'report.json'))
+
+
+if __name__ == '__main__':
+    unittest.main()
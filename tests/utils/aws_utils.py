@@ -38,6 +38,7 @@ def create_iam_resources():
                 "ec2:DeleteVolume",
                 "ec2:DeleteSnapshot",
                 "ec2:CreateTags",
+                "ec2:DeleteTags",
                 "ec2:CreateSnapshot",
                 "ec2:CreateVolume"
             ],
@@ -0,0 +1,127 @@
+import time
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EC2_NAMESPACE = 'http://ec2.amazonaws.com/doc/2016-11-15/'
+
+
+def ec2_response(action, body):
+    return (200, f'<?xml version="1.0" encoding="UTF-8"?>\n<{action}Response xmlns="{EC2_NAMESPACE}">'
+                 f'<requestId>req-1234</requestId>{body}</{action}Response>')
+
+
+def ec2_error(code, message, status=400):
+    return (status, f'<?xml version="1.0" encoding="UTF-8"?>\n<Response><Errors><Error><Code>{code}</Code>'
+                    f'<Message>{message}</Message></Error></Errors><RequestID>req-1234</RequestID></Response>')
+
+
+class FakeAwsHandler(BaseHTTPRequestHandler):
+    # Keep-alive like the real endpoints so connection reuse can be seen
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body):
+        data = body.encode()
+
+        # A delayed reply can find the client has already given up
+        try:
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def do_PUT(self):
+        server = self.server.fake
+        server.record('PUT', self.path, self.headers, {}, self.client_address)
+
+        if self.path != '/latest/api/token' or not self.headers.get('X-aws-ec2-metadata-token-ttl-seconds'):
+            return self.reply(400, 'Bad token request')
+
+        server.delay('api/token')
+
+        server.tokens += 1
+        self.reply(200, f'token-{server.tokens}')
+
+    def do_GET(self):
+        server = self.server.fake
+        server.record('GET', self.path, self.headers, {}, self.client_address)
+
+        token = self.headers.get('X-aws-ec2-metadata-token')
+
+        if token != f'token-{server.tokens}' and not (server.imdsv1 and token is None):
+            return self.reply(401, 'Unauthorized')
+
+        path = self.path[len('/latest/'):]
+        server.delay(path)
+
+        if path not in server.metadata:
+            return self.reply(404, 'Not Found')
+
+        self.reply(200, server.metadata[path])
+
+    def do_POST(self):
+        server = self.server.fake
+        length = int(self.headers.get('Content-Length', 0))
+        form = dict(urllib.parse.parse_qsl(self.rfile.read(length).decode()))
+        server.record('POST', self.path, self.headers, form, self.client_address)
+
+        server.delay(form.get('Action'))
+        responses = server.responses.get(form.get('Action'))
+
+        if not responses:
+            return self.reply(*ec2_error('InvalidAction', f"Unknown action {form.get('Action')}"))
+
+        response = responses.pop(0) if len(responses) > 1 else responses[0]
+        self.reply(*response(form) if callable(response) else response)
+
+
+class FakeAwsServer:
+    def __init__(self):
+        # Stands in for the EC2 query API and the instance metadata service
+        # on a local port. responses maps an EC2 action to the (status, body)
+        # replies to give in order, the last one is repeated. delays maps an
+        # EC2 action or metadata path to the seconds to wait before replying.
+        self.responses = {}
+        self.metadata = {}
+        self.delays = {}
+        self.requests = []
+        self.tokens = 0
+        # Answer metadata requests that come without a token
+        self.imdsv1 = False
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), FakeAwsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake = self
+        self.endpoint = f'http://127.0.0.1:{self.httpd.server_address[1]}'
+        self.thread = threading.Thread(target=self.httpd.serve_forever, args=(0.05,), daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def record(self, method, path, headers, form, client):
+        with self.lock:
+            self.requests.append({'method': method, 'path': path, 'headers': dict(headers),
+                                  'form': form, 'client': client})
+
+    def delay(self, name):
+        if name in self.delays:
+            time.sleep(self.delays[name])
+
+    def add(self, action, *responses):
+        self.responses[action] = list(responses)
+
+    def ec2_requests(self):
+        return [request for request in self.requests if request['method'] == 'POST']
+
+    def connections(self):
+        return {request['client'] for request in self.ec2_requests()}
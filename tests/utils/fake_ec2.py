@@ -0,0 +1,242 @@
+import copy
+import datetime
+import itertools
+from botocore.exceptions import ClientError
+
+
+class FakePaginator:
+
+    def __init__(self, method):
+        self.method = method
+
+    def paginate(self, **kwargs):
+        yield self.method(**kwargs)
+
+
+# In memory stand-in for the parts of the EC2 client sebs uses
+class FakeEC2:
+
+    def __init__(self, clock=None, auto_finish=False):
+        self.instances = {}
+        self.volumes = {}
+        self.snapshots = {}
+        self.tokens = {}
+        # Finish anything in progress whenever it is described
+        self.auto_finish = auto_finish
+        self.calls = []
+        self.ids = itertools.count(1)
+        self.clock = clock or (
+            lambda: datetime.datetime.now(datetime.timezone.utc))
+
+    def get_paginator(self, name):
+        return FakePaginator(getattr(self, name))
+
+    def new_id(self, prefix):
+        return f'{prefix}-{next(self.ids):04d}'
+
+    def add_instance(self, az, state='running', tags=None):
+        instance_id = self.new_id('i')
+        self.instances[instance_id] = {
+            'InstanceId': instance_id, 'Placement': {'AvailabilityZone': az},
+            'State': {'Name': state},
+            'Tags': [{'Key': key, 'Value': value} for key, value in (tags or {}).items()]}
+
+        return instance_id
+
+    def add_volume(self, az, tags=None, attached_to=None, device=None, **settings):
+        volume_id = self.new_id('vol')
+        volume = {'VolumeId': volume_id, 'AvailabilityZone': az, 'State': 'available',
+                  'VolumeType': 'gp2', 'Size': 10, 'Attachments': [],
+                  'Tags': [{'Key': key, 'Value': value} for key, value in (tags or {}).items()]}
+        volume.update(settings)
+
+        if attached_to:
+            volume['State'] = 'in-use'
+            volume['Attachments'] = [{'InstanceId': attached_to, 'Device': device,
+                                      'VolumeId': volume_id, 'State': 'attached'}]
+
+        self.volumes[volume_id] = volume
+
+        return volume_id
+
+    def add_snapshot(self, volume_id, tags=None, state='completed', start_time=None):
+        snapshot_id = self.new_id('snap')
+        self.snapshots[snapshot_id] = {
+            'SnapshotId': snapshot_id, 'VolumeId': volume_id, 'State': state,
+            'StartTime': start_time or self.clock(),
+            'Tags': [{'Key': key, 'Value': value} for key, value in (tags or {}).items()]}
+
+        return snapshot_id
+
+    def tags(self, resource_id):
+        resource = self.volumes.get(resource_id) or self.snapshots[resource_id]
+        return {tag['Key']: tag['Value'] for tag in resource['Tags']}
+
+    def not_found(self, kind, resource_id, operation):
+        raise ClientError({'Error': {'Code': f'Invalid{kind}.NotFound',
+                                     'Message': f'{resource_id} does not exist'}}, operation)
+
+    def matches(self, resource, filters):
+        tags = {tag['Key']: tag['Value'] for tag in resource.get('Tags', [])}
+        fields = {
+            'volume-id': resource.get('VolumeId'),
+            'snapshot-id': resource.get('SnapshotId'),
+            'availability-zone': resource.get('AvailabilityZone'),
+            'status': resource.get('State'),
+            'instance-id': resource.get('InstanceId'),
+        }
+
+        for resource_filter in filters:
+            name, values = resource_filter['Name'], resource_filter['Values']
+
+            if name == 'tag-key':
+                found = [key for key in tags if key in values]
+            elif name.startswith('tag:'):
+                found = [tags.get(name[4:])] if tags.get(name[4:]) in values else []
+            elif name == 'instance-state-name':
+                found = [resource['State']['Name']] if resource['State']['Name'] in values else []
+            elif name == 'attachment.instance-id':
+                found = [attachment for attachment in resource.get('Attachments', [])
+                         if attachment['InstanceId'] in values]
+            else:
+                found = [fields[name]] if fields[name] in values else []
+
+            if not found:
+                return False
+
+        return True
+
+    def describe_instances(self, InstanceIds=(), Filters=()):
+        self.calls.append('DescribeInstances')
+
+        if Filters:
+            return {'Reservations': [{'Instances': [
+                copy.deepcopy(instance) for instance in self.instances.values()
+                if self.matches(instance, Filters)]}]}
+
+        for instance_id in InstanceIds:
+            if instance_id not in self.instances:
+                self.not_found('InstanceID', instance_id, 'DescribeInstances')
+
+        instances = [copy.deepcopy(self.instances[instance_id])
+                     for instance_id in InstanceIds]
+
+        if self.auto_finish:
+            self.finish()
+
+        return {'Reservations': [{'Instances': instances}]}
+
+    def describe_volumes(self, Filters=(), **kwargs):
+        self.calls.append('DescribeVolumes')
+
+        if self.auto_finish:
+            self.finish()
+
+        return {'Volumes': [copy.deepcopy(volume) for volume in self.volumes.values()
+                            if self.matches(volume, Filters)]}
+
+    def describe_snapshots(self, Filters=(), OwnerIds=None, **kwargs):
+        self.calls.append('DescribeSnapshots')
+
+        if self.auto_finish:
+            self.finish()
+
+        return {'Snapshots': [copy.deepcopy(snapshot) for snapshot in self.snapshots.values()
+                              if self.matches(snapshot, Filters)]}
+
+    def create_snapshot(self, VolumeId, Description='', TagSpecifications=()):
+        self.calls.append('CreateSnapshot')
+        tags = {tag['Key']: tag['Value']
+                for spec in TagSpecifications for tag in spec['Tags']}
+        snapshot_id = self.add_snapshot(VolumeId, tags, state='pending')
+
+        return copy.deepcopy(self.snapshots[snapshot_id])
+
+    def create_volume(self, AvailabilityZone, SnapshotId=None, TagSpecifications=(),
+                      ClientToken=None, **settings):
+        self.calls.append('CreateVolume')
+
+        # Asking again with the same token returns the same volume
+        if ClientToken in self.tokens:
+            return copy.deepcopy(self.volumes[self.tokens[ClientToken]])
+
+        tags = {tag['Key']: tag['Value']
+                for spec in TagSpecifications for tag in spec['Tags']}
+        volume_id = self.add_volume(AvailabilityZone, tags,
+                                    SnapshotId=SnapshotId, **settings)
+        self.volumes[volume_id]['State'] = 'creating'
+
+        if ClientToken:
+            self.tokens[ClientToken] = volume_id
+
+        return copy.deepcopy(self.volumes[volume_id])
+
+    def attach_volume(self, Device, InstanceId, VolumeId):
+        self.calls.append('AttachVolume')
+        volume = self.volumes[VolumeId]
+
+        if self.instances[InstanceId]['State']['Name'] != 'running' or volume['State'] != 'available':
+            raise ClientError({'Error': {'Code': 'IncorrectState',
+                                         'Message': f'Can not attach {VolumeId}'}}, 'AttachVolume')
+
+        if volume['AvailabilityZone'] != self.instances[InstanceId]['Placement']['AvailabilityZone']:
+            raise ClientError({'Error': {'Code': 'InvalidVolume.ZoneMismatch',
+                                         'Message': f'{VolumeId} is in another AZ'}}, 'AttachVolume')
+
+        volume['State'] = 'in-use'
+        volume['Attachments'] = [{'InstanceId': InstanceId, 'Device': Device,
+                                  'VolumeId': VolumeId, 'State': 'attached'}]
+
+    def detach_volume(self, Device, InstanceId, VolumeId):
+        self.calls.append('DetachVolume')
+        volume = self.volumes[VolumeId]
+        volume['State'] = 'available'
+        volume['Attachments'] = []
+
+    def delete_volume(self, VolumeId):
+        self.calls.append('DeleteVolume')
+
+        if VolumeId not in self.volumes:
+            self.not_found('Volume', VolumeId, 'DeleteVolume')
+
+        del self.volumes[VolumeId]
+
+    def delete_snapshot(self, SnapshotId):
+        self.calls.append('DeleteSnapshot')
+
+        if SnapshotId not in self.snapshots:
+            self.not_found('Snapshot', SnapshotId, 'DeleteSnapshot')
+
+        del self.snapshots[SnapshotId]
+
+    def create_tags(self, Resources, Tags):
+        self.calls.append('CreateTags')
+
+        for resource_id in Resources:
+            resource = self.volumes.get(resource_id) or self.snapshots[resource_id]
+            keys = [tag['Key'] for tag in Tags]
+            resource['Tags'] = [tag for tag in resource['Tags']
+                                if tag['Key'] not in keys] + list(Tags)
+
+    def delete_tags(self, Resources, Tags):
+        self.calls.append('DeleteTags')
+
+        for resource_id in Resources:
+            resource = self.volumes.get(resource_id) or self.snapshots[resource_id]
+            keys = [tag['Key'] for tag in Tags]
+            resource['Tags'] = [tag for tag in resource['Tags']
+                                if tag['Key'] not in keys]
+
+    def finish(self):
+        # Everything that was in progress completes
+        for instance in self.instances.values():
+            if instance['State']['Name'] == 'pending':
+                instance['State']['Name'] = 'running'
+
+        for volume in self.volumes.values():
+            if volume['State'] == 'creating':
+                volume['State'] = 'available'
+
+        for snapshot in self.snapshots.values():
+            if snapshot['State'] == 'pending':
+                snapshot['State'] = 'completed'